@@ -4,16 +4,45 @@ An MPI plugin for PySCF
 
 __version__ = '0.3.1'
 
+import time
+_t0 = time.perf_counter()
+
+import os
 import pyscf
 from distutils.version import LooseVersion
 assert(LooseVersion(pyscf.__version__) >= LooseVersion('1.7'))
 del(LooseVersion)
+from pyscf import __config__
 
-# import all pyscf submodules before suspending the slave processes
-from pyscf import __all__
+# How the slave processes start
+#   'eager': import all pyscf submodules before suspending the slave processes
+#   'lazy': the slave processes only import mpi4pyscf.tools.mpi and the
+#       modules listed in MPI4PYSCF_PRELOAD (comma separated).  The modules of
+#       the parallel functions are imported when they are first called.
+STARTUP = os.environ.get('MPI4PYSCF_STARTUP',
+                         getattr(__config__, 'mpi_startup', 'eager'))
+PRELOAD = os.environ.get('MPI4PYSCF_PRELOAD',
+                         getattr(__config__, 'mpi_preload', ''))
+
+if STARTUP not in ('eager', 'lazy'):
+    raise ValueError('Unknown startup mode %s' % STARTUP)
 
-# NOTE: suspend all slave processes at last
 from .tools import mpi
+if mpi.pool.is_master() or STARTUP == 'eager':
+    from pyscf import __all__
+else:
+    import importlib
+    for _mod in PRELOAD.split(','):
+        if _mod.strip():
+            importlib.import_module(_mod.strip())
+
+# The import time of this process. It is shown in the report of the
+# communication profiler (see tools.profiler)
+mpi.startup_time = time.perf_counter() - _t0
+if mpi.profiler.ENABLED:
+    mpi.profiler.stats.record('startup', STARTUP, 0, 0, mpi.startup_time, 0.)
+
+# NOTE: suspend all slave processes at last
 if not mpi.pool.is_master():
     import sys
     import traceback
@@ -28,6 +28,9 @@ rank = mpi.rank
 
 BLKMIN = getattr(__config__, 'cc_ccsd_blkmin', 4)
 MEMORYMIN = getattr(__config__, 'cc_ccsd_memorymin', 2000)
+# Compression of the tensor blocks passed around in _rotate_tensor_block.
+# None for mpi.COMPRESSION.  'float32' enables the lossy compression here.
+COMPRESSION = getattr(__config__, 'cc_ccsd_mpi_compression', None)
 
 
 @mpi.parallel_call(skip_args=[1], skip_kwargs=['eris'])
@@ -63,20 +66,25 @@ def kernel(mycc, eris=None, t1=None, t2=None, max_cycle=50, tol=1e-8,
         adiis = None
 
     conv = False
-    for istep in range(max_cycle):
-        t1new, t2new = mycc.update_amps(t1, t2, eris)
-        normt = _diff_norm(mycc, t1new, t2new, t1, t2)
-        t1, t2 = t1new, t2new
-        t1new = t2new = None
-
-        t1, t2 = mycc.run_diis(t1, t2, istep, normt, eccsd-eold, adiis)
-        eold, eccsd = eccsd, mycc.energy(t1, t2, eris)
-        log.info('cycle = %d  E(CCSD) = %.15g  dE = %.9g  norm(t1,t2) = %.6g',
-                 istep+1, eccsd, eccsd - eold, normt)
-        cput1 = log.timer('CCSD iter', *cput1)
-        if abs(eccsd-eold) < tol and normt < tolnormt:
-            conv = True
-            break
+    try:
+        for istep in range(max_cycle):
+            t1new, t2new = mycc.update_amps(t1, t2, eris)
+            normt = _diff_norm(mycc, t1new, t2new, t1, t2)
+            t1, t2 = t1new, t2new
+            t1new = t2new = None
+
+            t1, t2 = mycc.run_diis(t1, t2, istep, normt, eccsd-eold, adiis)
+            eold, eccsd = eccsd, mycc.energy(t1, t2, eris)
+            log.info('cycle = %d  E(CCSD) = %.15g  dE = %.9g  norm(t1,t2) = %.6g',
+                     istep+1, eccsd, eccsd - eold, normt)
+            cput1 = log.timer('CCSD iter', *cput1)
+            if abs(eccsd-eold) < tol and normt < tolnormt:
+                conv = True
+                break
+    finally:
+        # The buffers of the ring shift (twice the largest tensor block) are
+        # not kept for (T) and the following calculations
+        _release_ring_shift()
 
     mycc.e_corr = eccsd
     mycc.t1 = t1
@@ -290,29 +298,38 @@ def update_amps(mycc, t1, t2, eris):
     fswap = None
     time1 = log.timer_debug1('contracting wVOov', *time1)
 
-    foo += mpi.allreduce(foo_priv)
-    fov += mpi.allreduce(fov_priv)
-    fvv += mpi.allreduce(fvv_priv)
+    # Overlap the reduction of the Fock intermediates with the local work.
+    # The shapes are unchanged in the iterations. The metadata are cached.
+    chan = mpi.channel(('ccsd.update_amps', nocc, nvir))
+    foo_req = chan.iallreduce(foo_priv, inplace=True)
+    fov_req = chan.iallreduce(fov_priv, inplace=True)
+    fvv_req = chan.iallreduce(fvv_priv, inplace=True)
 
     theta = t2T.transpose(0,1,3,2) * 2 - t2T
+    fov += fov_req.wait()
     t1T_priv[vloc0:vloc1] += numpy.einsum('jb,abji->ai', fov, theta)
     ovoo = _cp(eris.ovoo)
     for task_id, ovoo, p0, p1 in _rotate_vir_block(ovoo):
         t1T_priv[vloc0:vloc1] -= lib.einsum('jbki,abjk->ai', ovoo, theta[:,p0:p1])
     theta = ovoo = None
 
-    woooo = mpi.allreduce(woooo)
-    woooo += _cp(eris.oooo).transpose(0,2,1,3)
+    woooo_req = chan.iallreduce(woooo, inplace=True)
+    eris_oooo = _cp(eris.oooo).transpose(0,2,1,3)
     tau = t2T + numpy.einsum('ai,bj->abij', t1T[vloc0:vloc1], t1T)
+    woooo = woooo_req.wait()
+    woooo += eris_oooo
     t2Tnew += .5 * lib.einsum('abkl,ijkl->abij', tau, woooo)
-    tau = woooo = None
+    tau = woooo = eris_oooo = None
 
-    t1Tnew += mpi.allreduce(t1T_priv)
+    t1T_req = chan.iallreduce(t1T_priv, inplace=True)
 
+    foo += foo_req.wait()
+    fvv += fvv_req.wait()
     ft_ij = foo + numpy.einsum('aj,ia->ij', .5*t1T, fov)
     ft_ab = fvv - numpy.einsum('ai,ib->ab', .5*t1T, fov)
     t2Tnew += lib.einsum('acij,bc->abij', t2T, ft_ab)
     t2Tnew -= lib.einsum('ki,abkj->abij', ft_ij, t2T)
+    t1Tnew += t1T_req.wait()
 
     eia = mo_e_o[:,None] - mo_e_v
     t1Tnew += numpy.einsum('bi,ab->ai', t1T, fvv)
@@ -494,36 +511,34 @@ def _task_location(n, task=rank):
     return loc0, loc1
 
 ASYNC = True
-if ASYNC:
-    def _rotate_tensor_block(buf):
-        ntasks = mpi.pool.size
-        tasks = list(range(ntasks))
-        tasks = tasks[rank:] + tasks[:rank]
-
-        buf_prefetch = [None]
-        def rotate():
-            buf_prefetch[0] = mpi.rotate(buf, blocking=False)
-# DO NOT ThreadWithReturnValue, the return value of mpi.rotate is too large
-# for Queue module.
-        handler = lib.ThreadWithTraceBack(target=rotate, args=())
-        handler.start()
-        for k, task in enumerate(tasks):
-            if task != rank:
-                handler.join()
-                buf = buf_prefetch[0]
-                if k + 1 < ntasks:
-                    handler = lib.ThreadWithTraceBack(target=rotate, args=())
-                    handler.start()
-            yield task, buf
-else:
-    def _rotate_tensor_block(buf):
-        ntasks = mpi.pool.size
-        tasks = list(range(ntasks))
-        tasks = tasks[rank:] + tasks[:rank]
-        for task in tasks:
-            if task != rank:
-                buf = mpi.rotate(buf)
-            yield task, buf
+# The communication buffers and the persistent requests of the ring shift
+# are reused for all hops and all CCSD iterations.  They are released when
+# kernel returns (see _release_ring_shift).
+_ring_shift = None
+def _rotate_tensor_block(buf):
+    global _ring_shift
+    if ASYNC and not COMPRESSION:
+        if _ring_shift is None:
+            _ring_shift = mpi.RingShift()
+            mpi.pool.close_callbacks.append(_release_ring_shift)
+        return _ring_shift.iterate(buf)
+    else:
+        return _rotate_tensor_block_sync(buf)
+
+def _release_ring_shift():
+    '''Release the buffers, the persistent requests and the helper thread
+    of the ring shift.  They are created again by the next ring shift.'''
+    if _ring_shift is not None:
+        _ring_shift.close()
+
+def _rotate_tensor_block_sync(buf):
+    ntasks = mpi.pool.size
+    tasks = list(range(ntasks))
+    tasks = tasks[rank:] + tasks[:rank]
+    for task in tasks:
+        if task != rank:
+            buf = mpi.rotate(buf, compress=COMPRESSION)
+        yield task, buf
 
 
 def _contract_vvvv_t2(mycc, vvvv, t2T, task_locs, out=None, verbose=None):
@@ -636,10 +651,10 @@ def vector_to_amplitudes(vector, nmo, nocc):
 
     if rank == 0:
         t1T = vector[:nov].copy().reshape((nvir,nocc))
-        mpi.bcast(t1T)
+        mpi.channel(('ccsd.t1T', nvir, nocc)).bcast(t1T)
         t2tril = vector[nov:].reshape(nvir_seg,nvir,nocc2)
     else:
-        t1T = mpi.bcast(None)
+        t1T = mpi.channel(('ccsd.t1T', nvir, nocc)).bcast(None)
         t2tril = vector.reshape(nvir_seg,nvir,nocc2)
 
     t2T = lib.unpack_tril(t2tril.reshape(nvir_seg*nvir,nocc2), filltriu=lib.PLAIN)
@@ -789,16 +804,16 @@ def _pack_scf(mf):
     return mfdic
 
 def _init_ccsd(ccsd_obj):
-    from pyscf import gto
     from mpi4pyscf.tools import mpi
     from mpi4pyscf.cc import ccsd
     if mpi.rank == 0:
-        mpi.comm.bcast((ccsd_obj.mol.dumps(), ccsd_obj.pack()))
+        mpi.comm.bcast(ccsd_obj.pack())
+        mpi.bcast_mole(ccsd_obj.mol)
     else:
         ccsd_obj = ccsd.CCSD.__new__(ccsd.CCSD)
         ccsd_obj.t1 = ccsd_obj.t2 = None
-        mol, cc_attr = mpi.comm.bcast(None)
-        ccsd_obj.mol = gto.mole.loads(mol)
+        cc_attr = mpi.comm.bcast(None)
+        ccsd_obj.mol = mpi.bcast_mole(None)
         ccsd_obj.unpack_(cc_attr)
     if 0:  # If also to initialize cc._scf object
         if mpi.rank == 0:
@@ -1005,7 +1020,7 @@ def _make_eris_outcore(mycc, mo_coeff=None):
     return eris
 
 def _sync_(mycc):
-    return mycc.unpack_(comm.bcast(mycc.pack()))
+    return mpi.sync(mycc)
 
 def _cp(a, order=None):
     # h5py-2.8 adds an explict LE/BE label to the dataset. When data was
@@ -10,15 +10,20 @@ import threading
 import numpy
 from pyscf import lib
 from pyscf.cc import _ccsd
+from pyscf import __config__
 
 from mpi4py import MPI
 from mpi4pyscf.lib import logger
 from mpi4pyscf.cc import ccsd
 from mpi4pyscf.tools import mpi
 
-comm = mpi.comm
+comm = mpi.profiled_comm()
 rank = mpi.rank
 
+# Compression of the vvvo/vvop tensors exchanged between processes.  None
+# for mpi.COMPRESSION.  'float32' enables the lossy compression here.
+COMPRESSION = getattr(__config__, 'cc_ccsd_t_mpi_compression', None)
+
 
 @mpi.parallel_call(skip_args=[1], skip_kwargs=['eris'])
 def kernel(mycc, eris=None):
@@ -188,7 +193,7 @@ class GlobalDataHandler(object):
                 j0, j1 = p0 - vloc0, p1 - vloc0
                 sub_locs = comm.allgather((p0,p1))
                 vvvo = mpi.alltoall([eris.vvvo[:,:,q0:q1] for q0, q1 in sub_locs],
-                                    split_recvbuf=True)
+                                    split_recvbuf=True, compress=COMPRESSION)
                 save_vvop(j0, j1, vvvo)
                 cpu1 = log.timer_debug1('transpose %d:%d'%(p0,p1), *cpu1)
 
@@ -201,7 +206,7 @@ class GlobalDataHandler(object):
                             return
                         else:
                             mpi.send(self._get_tensor(task, slices), dest,
-                                     tag=TRANSFER_DATA)
+                                     tag=TRANSFER_DATA, compress=COMPRESSION)
                 time.sleep(interval)
 
         daemon = threading.Thread(target=send_data)
@@ -14,10 +14,10 @@ comm = mpi.comm
 rank = mpi.rank
 
 
-@mpi.parallel_call(skip_args=[1, 2, 3, 4], skip_kwargs=['dm_last', 'vhf_last'])
+@mpi.parallel_call(skip_args=[1], skip_kwargs=['mol'])
 def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
     t0 = (logger.process_clock(), logger.perf_counter())
-    mf.unpack_(comm.bcast(mf.pack()))
+    mpi.sync(mf)
     mol = mf.mol
     ni = mf._numint
 
@@ -25,18 +25,13 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
         raise NotImplementedError
     omega, alpha, hyb = ni.rsh_and_hybrid_coeff(mf.xc, spin=mol.spin)
 
-    # Broadcast the large input arrays here.
-    if any(comm.allgather(dm is mpi.Message.SkippedArg)):
-        if rank == 0 and dm is None:
+    # The input arrays were broadcast (out of band) with the arguments by the
+    # pool.  Only the density matrix generated on root needs a broadcast.
+    if dm is None:
+        if rank == 0:
             dm = mf.make_rdm1()
         dm = mpi.bcast_tagged_array(dm)
 
-    if any(comm.allgather(dm_last is mpi.Message.SkippedArg)):
-        dm_last = mpi.bcast_tagged_array(dm_last)
-
-    if any(comm.allgather(vhf_last is mpi.Message.SkippedArg)):
-        vhf_last = mpi.bcast_tagged_array(vhf_last)
-
     ground_state = (isinstance(dm, numpy.ndarray) and dm.ndim == 2)
 
     if mf.grids.coords is None:
@@ -49,7 +44,8 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
         n, exc, vxc = ni.nr_rks(mol, mf.grids, mf.xc, dm)
         n = comm.allreduce(n)
         exc = comm.allreduce(exc)
-        vxc = mpi.reduce(vxc)
+        # The reduction of vxc is overlapped with the J/K builds
+        vxc = mpi.ireduce(vxc, inplace=True)
         logger.debug(mf, 'nelec by numeric integration = %s', n)
         t0 = logger.timer(mf, 'vxc', *t0)
 
@@ -61,6 +57,8 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
             vj += vhf_last.vj
         else:
             vj = mf.get_j(mol, dm, hermi)
+        if isinstance(vxc, mpi.CollectiveRequest):
+            vxc = vxc.wait()
         vxc += vj
     else:
         if getattr(vhf_last, 'vk', None) is not None:
@@ -79,6 +77,8 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
             if abs(omega) > 1e-10:
                 vklr = mf.get_k(mol, dm, hermi, omega=omega)
                 vk += vklr * (alpha - hyb)
+        if isinstance(vxc, mpi.CollectiveRequest):
+            vxc = vxc.wait()
         vxc += vj - vk * .5
 
         if ground_state:
@@ -93,10 +93,36 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
     return vxc
 
 
+# The attributes of Grids which are built by grids.build
+_GRIDS_BUILT_ATTRS = ('mol', 'stdout', 'coords', 'weights', 'non0tab',
+                      'screen_index', 'atm_idx', 'quadrature_weights')
+
+def _grids_key(mf, dm):
+    '''The key of the grids in the caches of the system.  The grids depend
+    on the settings of mf.grids and on the density matrix used to drop the
+    grids of small density.'''
+    settings = dict((k, v) for k, v in mf.grids.__dict__.items()
+                    if k not in _GRIDS_BUILT_ATTRS)
+    fps = (mpi._fingerprint(settings), mpi._fingerprint(numpy.asarray(dm)))
+    if None in fps:
+        return None
+    return ('grids', mf.small_rho_cutoff) + fps
+
 def _setup_grids_(mf, dm):
     mol = mf.mol
     grids = mf.grids
 
+    # The grids of the same system built by another object (see
+    # mpi.system_cache).  The settings of grids are only set on root.
+    sys_cache = mpi.system_cache(mol)
+    if sys_cache is not None:
+        key = comm.bcast(_grids_key(mf, dm) if rank == 0 else None)
+        if key is None:
+            sys_cache = None
+        elif all(comm.allgather(key in sys_cache)):
+            grids.coords, grids.weights, grids.non0tab = sys_cache[key]
+            return grids
+
     if rank == 0:
         grids.build(with_non0tab=False)
         ngrids = comm.bcast(grids.weights.size)
@@ -121,6 +147,8 @@ def _setup_grids_(mf, dm):
 
     grids.non0tab = grids.make_mask(mol, grids.coords)
 
+    if sys_cache is not None:
+        sys_cache[key] = (grids.coords, grids.weights, grids.non0tab)
     return grids
 
 
@@ -16,10 +16,10 @@ rank = mpi.rank
 
 
 @lib.with_doc(uks.get_veff.__doc__)
-@mpi.parallel_call(skip_args=[1, 2, 3, 4], skip_kwargs=['dm_last', 'vhf_last'])
+@mpi.parallel_call(skip_args=[1], skip_kwargs=['mol'])
 def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
     t0 = (logger.process_clock(), logger.perf_counter())
-    mf.unpack_(comm.bcast(mf.pack()))
+    mpi.sync(mf)
     mol = mf.mol
     ni = mf._numint
 
@@ -27,18 +27,13 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
         raise NotImplementedError
     omega, alpha, hyb = ni.rsh_and_hybrid_coeff(mf.xc, spin=mol.spin)
 
-    # Broadcast the large input arrays here.
-    if any(comm.allgather(dm is mpi.Message.SkippedArg)):
-        if rank == 0 and dm is None:
+    # The input arrays were broadcast (out of band) with the arguments by the
+    # pool.  Only the density matrix generated on root needs a broadcast.
+    if dm is None:
+        if rank == 0:
             dm = mf.make_rdm1()
         dm = mpi.bcast_tagged_array(dm)
 
-    if any(comm.allgather(dm_last is mpi.Message.SkippedArg)):
-        dm_last = mpi.bcast_tagged_array(dm_last)
-
-    if any(comm.allgather(vhf_last is mpi.Message.SkippedArg)):
-        vhf_last = mpi.bcast_tagged_array(vhf_last)
-
     ground_state = (dm.ndim == 3 and dm.shape[0] == 2)
 
     if mf.grids.coords is None:
@@ -51,7 +46,8 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
         n, exc, vxc = ni.nr_uks(mol, mf.grids, mf.xc, dm)
         n = comm.allreduce(n)
         exc = comm.allreduce(exc)
-        vxc = mpi.reduce(vxc)
+        # The reduction of vxc is overlapped with the J/K builds
+        vxc = mpi.ireduce(vxc, inplace=True)
         logger.debug(mf, 'nelec by numeric integration = %s', n)
         t0 = logger.timer(mf, 'vxc', *t0)
 
@@ -64,6 +60,8 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
             vj += vhf_last.vj
         else:
             vj = mf.get_j(mol, dm[0]+dm[1], hermi)
+        if isinstance(vxc, mpi.CollectiveRequest):
+            vxc = vxc.wait()
         vxc += vj
     else:
         if getattr(vhf_last, 'vk', None) is not None:
@@ -84,6 +82,8 @@ def get_veff(mf, mol=None, dm=None, dm_last=0, vhf_last=0, hermi=1):
             if abs(omega) > 1e-10:
                 vklr = mf.get_k(mol, dm, hermi, omega=omega)
                 vk += vklr * (alpha - hyb)
+        if isinstance(vxc, mpi.CollectiveRequest):
+            vxc = vxc.wait()
         vxc += vj
         vxc -= vk
 
@@ -28,7 +28,9 @@ class DistributedDIIS(lib.diis.DIIS):
             raise RuntimeError('No vector found in DIIS object.')
 
         h = self._H[:nd+1,:nd+1].copy()
-        h[1:,1:] = mpi.comm.allreduce(self._H[1:nd+1,1:nd+1])
+        # The metadata of the reduction are checked again when nd changes
+        chan = mpi.channel(('DistributedDIIS._H', self.space))
+        h[1:,1:] = chan.allreduce(self._H[1:nd+1,1:nd+1])
         g = numpy.zeros(nd+1, h.dtype)
         g[0] = 1
 
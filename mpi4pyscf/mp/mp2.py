@@ -239,5 +239,5 @@ def _task_location(n, task=rank):
     return loc0, loc1
 
 def _sync_(mp):
-    return mp.unpack_(comm.bcast(mp.pack()))
+    return mpi.sync(mp)
 
@@ -114,7 +114,7 @@ def _int_nuc_vloc(mydf, nuccell, kpts, intor='int3c2e_sph', aosym='s2', comp=1):
 
 
 def _sync_mydf(mydf):
-    mydf.unpack_(comm.bcast(mydf.pack()))
+    mpi.sync(mydf)
     return mydf
 
 
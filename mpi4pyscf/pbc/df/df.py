@@ -12,6 +12,7 @@ import scipy.linalg
 import h5py
 
 from pyscf import lib
+from pyscf import __config__
 from pyscf.pbc.df import ft_ao
 from pyscf.pbc.df import df
 from pyscf.pbc.df.incore import wrap_int3c
@@ -31,6 +32,10 @@ from mpi4pyscf.pbc.df import aft as mpi_aft
 comm = mpi.comm
 rank = mpi.rank
 
+# Compression of the j3c blocks exchanged when the 3-index tensor is saved.
+# None for mpi.COMPRESSION.  'float32' enables the lossy compression here.
+COMPRESSION = getattr(__config__, 'pbc_df_df_mpi_compression', None)
+
 
 @mpi.parallel_call
 def build(mydf, j_only=None, with_j3c=True, kpts_band=None):
@@ -142,7 +147,7 @@ def _make_j3c(mydf, cell, auxcell, kptij_lst, cderi_file):
             kLR = kLI = None
 
         j2c_k[:naux,naux:] = j2c_k[naux:,:naux].conj().T
-        j2c[k] -= mpi.allreduce(j2c_k)
+        j2c[k] -= mpi.allreduce(j2c_k, inplace=True)
         j2c[k] = fuse(fuse(j2c[k]).T).T
         try:
             fswap['j2c/%d'%k] = scipy.linalg.cholesky(j2c[k], lower=True)
@@ -359,7 +364,7 @@ def _assemble(mydf, kptij_lst, j3c_jobs, gen_int3c, ft_fuse, cderi_file, fswap,
     t2 = t1
     j3c_workers = numpy.zeros(len(j3c_jobs), dtype=int)
     #for job_id, ish0, ish1 in mpi.work_share_partition(j3c_jobs):
-    for job_id, ish0, ish1 in mpi.work_stealing_partition(j3c_jobs):
+    for job_id, ish0, ish1 in mpi.dynamic_partition(j3c_jobs):
         gen_int3c(job_id, ish0, ish1)
         t2 = log.alltimer_debug2('int j3c %d' % job_id, *t2)
 
@@ -424,7 +429,7 @@ def _assemble(mydf, kptij_lst, j3c_jobs, gen_int3c, ft_fuse, cderi_file, fswap,
         return segs
 
     def save(k, p0, p1, segs):
-        segs = mpi.alltoall(segs)
+        segs = mpi.alltoall(segs, compress=COMPRESSION)
         naux1 = nauxs[uniq_inverse[k]]
         loc0, loc1 = min(p0, naux1-naux0), min(p1, naux1-naux0)
         nL = loc1 - loc0
@@ -511,11 +516,13 @@ class DF(df.DF, mpi_aft.AFTDF):
                 'linear_dep_threshold': self.linear_dep_threshold,
                 '_cderi'     : self._cderi}
     def unpack_(self, dfdic):
-        remote_cderi = dfdic.pop('_cderi')
+        # dfdic only contains the attributes changed on master (see mpi.sync)
+        cderi_changed = '_cderi' in dfdic
+        remote_cderi = dfdic.pop('_cderi', None)
         self.__dict__.update(dfdic)
 # Note when auxbasis was changed in the master process, _cderi on master is
 # cleared.  Following to reset _cderi and _cderi_to_save when necessary.
-        if remote_cderi is None and self._cderi is not None:
+        if cderi_changed and remote_cderi is None and self._cderi is not None:
             self._cderi = None
             self._cderi_to_save = tempfile.NamedTemporaryFile(dir=lib.param.TMPDIR)
         return self
@@ -584,7 +591,7 @@ def grids2d_int3c_jobs(cell, auxcell, kptij_lst, chunks, aosym_s2):
     return jobs
 
 def _sync_mydf(mydf):
-    return mydf.unpack_(comm.bcast(mydf.pack()))
+    return mpi.sync(mydf)
 
 @mpi.reduced_yield
 def loop_yield_then_reduce(mydf):
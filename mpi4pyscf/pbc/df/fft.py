@@ -173,7 +173,7 @@ def get_pp(mydf, kpts=None):
         return vpp
 
 def _sync_mydf(mydf):
-    mydf.unpack_(comm.bcast(mydf.pack()))
+    mpi.sync(mydf)
     return mydf
 
 
@@ -28,6 +28,35 @@ rank = mpi.rank
 @mpi.parallel_call
 def get_j_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
                kpts_band=None):
+    return _get_j_kpts(mydf, dm_kpts, hermi, kpts, kpts_band)
+
+@mpi.parallel_call
+def get_k_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
+               kpts_band=None, exxdiv=None):
+    return _get_k_kpts(mydf, dm_kpts, hermi, kpts, kpts_band, exxdiv)
+
+def get_j_kpts_distributed(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
+                           kpts_band=None):
+    '''The J matrices left distributed over the processes (see
+    mpi.reduce_scatter) instead of being reduced to the root.
+
+    It should be called on all processes, with the same dm_kpts, inside a
+    parallel function (see mpi.pool.apply).  Each process returns the rows
+    mpi.row_blocks(nao) of the matrices, an array of shape
+    (nset,nband,r1-r0,nao).
+    '''
+    mpi.require_parallel_call('get_j_kpts_distributed')
+    return _get_j_kpts(mydf, dm_kpts, hermi, kpts, kpts_band, True)
+
+def get_k_kpts_distributed(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
+                           kpts_band=None, exxdiv=None):
+    '''The K matrices left distributed over the processes.  See
+    get_j_kpts_distributed.'''
+    mpi.require_parallel_call('get_k_kpts_distributed')
+    return _get_k_kpts(mydf, dm_kpts, hermi, kpts, kpts_band, exxdiv, True)
+
+def _get_j_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
+                kpts_band=None, distributed=False):
     mydf = _sync_mydf(mydf)
     cell = mydf.cell
     mesh = mydf.mesh
@@ -47,10 +76,12 @@ def get_j_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
                 rhoR[i,p0:p1] += numint.eval_rho(cell, ao, dms[i,k])
         ao = ao_ks = None
 
-    rhoR = mpi.allreduce(rhoR)
-    for i in range(nset):
-        rhoR[i] *= 1./nkpts
-        rhoG = tools.fft(rhoR[i], mesh)
+    # The FFT of one density overlaps with the reduction of the next one
+    for p0, p1, rhoR_i in mpi.allreduce_iter(rhoR, inplace=True,
+                                             blksize=ngrids):
+        i = p0 // ngrids
+        rhoR_i *= 1./nkpts
+        rhoG = tools.fft(rhoR_i, mesh)
         vG = coulG * rhoG
         vR[i] = tools.ifft(vG, mesh).real
 
@@ -68,14 +99,19 @@ def get_j_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
             for i in range(nset):
                 vj_kpts[i,k] += lib.dot(ao.T.conj()*vR[i,p0:p1], ao)
 
+    if distributed:
+        vj_kpts = mpi.reduce_scatter(vj_kpts)
+        if gamma_point(kpts_band):
+            vj_kpts = vj_kpts.real
+        return vj_kpts
+
     vj_kpts = mpi.reduce(vj_kpts)
     if gamma_point(kpts_band):
         vj_kpts = vj_kpts.real
     return _format_jks(vj_kpts, dm_kpts, input_band, kpts)
 
-@mpi.parallel_call
-def get_k_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
-               kpts_band=None, exxdiv=None):
+def _get_k_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
+                kpts_band=None, exxdiv=None, distributed=False):
     mydf = _sync_mydf(mydf)
     cell = mydf.cell
     mesh = mydf.mesh
@@ -195,6 +231,16 @@ def get_k_kpts(mydf, dm_kpts, hermi=1, kpts=numpy.zeros((1,3)),
         for i in range(nset):
             vk_kpts[i,k1] += weight * lib.dot(vR_dm[i], ao1T.T)
 
+    if distributed:
+        # The ewald correction is additive.  It is added to the partial
+        # result of root before the reduction.
+        if rank == 0 and exxdiv == 'ewald':
+            _ewald_exxdiv_for_G0(cell, kpts, dms, vk_kpts, kpts_band=kpts_band)
+        vk_kpts = mpi.reduce_scatter(vk_kpts)
+        if gamma_point(kpts_band) and gamma_point(kpts):
+            vk_kpts = vk_kpts.real
+        return vk_kpts
+
     vk_kpts = mpi.reduce(lib.asarray(vk_kpts))
     if gamma_point(kpts_band) and gamma_point(kpts):
         vk_kpts = vk_kpts.real
@@ -230,6 +276,5 @@ def get_k(mydf, dm, hermi=1, kpt=numpy.zeros(3), kpt_band=None, exxdiv=None):
     return vk.reshape(dm.shape)
 
 def _sync_mydf(mydf):
-    mydf.unpack_(comm.bcast(mydf.pack()))
-    return mydf
+    return mpi.sync(mydf)
 
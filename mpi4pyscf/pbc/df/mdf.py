@@ -87,7 +87,7 @@ def _make_j3c(mydf, cell, auxcell, kptij_lst, cderi_file):
                 j2cR, j2cI = zdotCN(LkR*coulG[p0:p1], LkI*coulG[p0:p1], LkR.T, LkI.T)
                 j2c_k += j2cR + j2cI * 1j
             LkR = LkI = None
-        j2c[k] -= mpi.allreduce(j2c_k)
+        j2c[k] -= mpi.allreduce(j2c_k, inplace=True)
 
         try:
             fswap['j2c/%d'%k] = scipy.linalg.cholesky(j2c[k], lower=True)
@@ -355,7 +355,7 @@ class MDF(mdf.MDF, mpi_df.DF):
 
 
 def _sync_mydf(mydf):
-    return mydf.unpack_(comm.bcast(mydf.pack()))
+    return mpi.sync(mydf)
 
 @mpi.reduced_yield
 def loop_yield_then_reduce(mydf):
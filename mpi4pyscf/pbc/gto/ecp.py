@@ -16,7 +16,6 @@ from pyscf import gto
 from pyscf.gto import AS_ECPBAS_OFFSET, AS_NECPBAS
 
 from pyscf.pbc.df import incore
-from pyscf.pbc import gto as pgto
 
 from mpi4pyscf.lib import logger
 from mpi4pyscf.tools import mpi
@@ -27,10 +26,7 @@ rank = mpi.rank
 
 @mpi.parallel_call
 def ecp_int(cell, kpts=None):
-    if rank == 0:
-        comm.bcast(cell.dumps())
-    else:
-        cell = pgto.loads(comm.bcast(None))
+    cell = mpi.bcast_mole(cell)
 
     if kpts is None:
         kpts_lst = numpy.zeros((1,3))
@@ -67,7 +63,7 @@ def ecp_int(cell, kpts=None):
     # shls_slice of auxiliary index (0,1) corresponds to the fictitious s function
     tasks = [(i, i+1, j, j+1, 0, 1) # shls_slice
              for i in range(cell.nbas) for j in range(i+1)]
-    for shls_slice in mpi.work_stealing_partition(tasks):
+    for shls_slice in mpi.dynamic_partition(tasks):
         i0 = ao_loc[shls_slice[0]]
         i1 = ao_loc[shls_slice[1]]
         j0 = ao_loc[shls_slice[2]]
@@ -2,6 +2,7 @@
 
 import time
 import numpy
+from mpi4py import MPI
 from pyscf import lib
 from pyscf import gto
 from pyscf import ao2mo
@@ -18,97 +19,147 @@ rank = mpi.rank
 from pyscf import __config__
 BLKSIZE_MIN = getattr(__config__, 'scf_hf_BLKSIZE_MIN', 60)
 BLKSIZE_MAX = getattr(__config__, 'scf_hf_BLKSIZE_MAX', 800)
+# The minimal wall time (in seconds) of the J/K jobs for each process. The
+# jobs of small systems are not spread over all processes.
+JK_MIN_TIME_PER_PROC = getattr(__config__, 'scf_hf_jk_min_time_per_proc', 0.02)
+# The number of the J/K job lists whose measured costs are kept
+JK_COSTS_CACHE_SIZE = 8
+# Semi-direct J/K build. The integral blocks of the most expensive jobs are
+# kept in memory (up to SEMI_DIRECT_MAX_MEMORY MB per process), then in the
+# scratch file in lib.param.TMPDIR (up to SEMI_DIRECT_MAX_DISK MB per
+# process) and reused in the following SCF iterations.  0 to disable.
+SEMI_DIRECT_MAX_MEMORY = getattr(__config__, 'scf_hf_semi_direct_max_memory', 0)
+SEMI_DIRECT_MAX_DISK = getattr(__config__, 'scf_hf_semi_direct_max_disk', 0)
 
 
 @lib.with_doc(hf.get_jk.__doc__)
-@mpi.parallel_call(skip_args=[1])
+@mpi.parallel_call(skip_args=[1], shared_args=[1])
 def get_jk(mol_or_mf=None, dm=None, hermi=1, with_j=True, with_k=True, omega=None):
-    '''MPI version of scf.hf.get_jk function'''
+    '''MPI version of scf.hf.get_jk function.  See get_jk_distributed for
+    the J and K matrices distributed over the processes.'''
     #vj = get_j(mol_or_mf, dm, hermi)
     #vk = get_k(mol_or_mf, dm, hermi)
-    if isinstance(mol_or_mf, gto.mole.Mole):
-        mf = hf.SCF(mol_or_mf).view(SCF)
-    else:
-        mf = mol_or_mf
-
-    # dm may be too big for mpi4py library to serialize. Broadcast dm here.
-    if any(comm.allgather(dm is mpi.Message.SkippedArg)):
-        dm = mpi.bcast_tagged_array(dm)
-
-    mf.unpack_(comm.bcast(mf.pack()))
-    if mf.opt is None:
-        mf.opt = mf.init_direct_scf()
-
-    if omega is None:
-        vj, vk = _eval_jk(mf, dm, hermi, _jk_jobs_s8)
-    else:
-        with mf.mol.with_range_coulomb(omega):
-            vj, vk = _eval_jk(mf, dm, hermi, _jk_jobs_s8)
+    mf = _as_mf(mol_or_mf)
+    vj, vk = _get_jk(mf, dm, hermi, omega)
 
     if rank == 0:
         for i in range(vj.shape[0]):
             lib.hermi_triu(vj[i], 1, inplace=True)
-    return vj.reshape(dm.shape), vk.reshape(dm.shape)
+    return _reshape_jk(vj, dm.shape), _reshape_jk(vk, dm.shape)
 
 @lib.with_doc(hf.SCF.get_j.__doc__)
-@mpi.parallel_call(skip_args=[1])
+@mpi.parallel_call(skip_args=[1], shared_args=[1])
 def get_j(mol_or_mf=None, dm=None, hermi=1, omega=None):
+    mf = _as_mf(mol_or_mf)
+    vj = _get_j(mf, dm, omega)
+    return _reshape_jk(vj, dm.shape)
+
+@lib.with_doc(hf.SCF.get_k.__doc__)
+@mpi.parallel_call(skip_args=[1], shared_args=[1])
+def get_k(mol_or_mf=None, dm=None, hermi=1, omega=None):
+    mf = _as_mf(mol_or_mf)
+    vk = _get_k(mf, dm, hermi, omega)
+    return _reshape_jk(vk, dm.shape)
+
+def get_jk_distributed(mol_or_mf, dm, hermi=1, with_j=True, with_k=True,
+                       omega=None):
+    '''J and K matrices left distributed over the processes (see
+    mpi.reduce_scatter) instead of being reduced to the root.
+
+    It should be called on all processes, with the same dm, inside a
+    parallel function (a function launched by mpi.pool.apply or a function
+    decorated by mpi.parallel_call).  Each process returns its rows
+    mpi.row_blocks(nao, layout) of J and K.  J (and K if hermi != 0) are
+    returned in the packed layout (the rows of the lower triangular part).
+    K of hermi = 0 is returned in the layout of rows.  vj (vk) is None if
+    with_j (with_k) is False.
+    '''
+    mpi.require_parallel_call('get_jk_distributed')
+    mf = _as_mf(mol_or_mf)
+    dm = numpy.asarray(dm)
+    vj = vk = None
+    if with_j and with_k:
+        vj, vk = _get_jk(mf, dm, hermi, omega,
+                         ('packed', 'packed' if hermi else 'rows'))
+    elif with_j:
+        vj = _get_j(mf, dm, omega, ('packed',))
+    elif with_k:
+        vk = _get_k(mf, dm, hermi, omega, ('packed' if hermi else 'rows',))
+    if vj is not None:
+        vj = _reshape_jk(vj, dm.shape)
+    if vk is not None:
+        vk = _reshape_jk(vk, dm.shape)
+    return vj, vk
+
+def _as_mf(mol_or_mf):
     if isinstance(mol_or_mf, gto.mole.Mole):
-        mf = hf.SCF(mol_or_mf).view(SCF)
+        return hf.SCF(mol_or_mf).view(SCF)
     else:
-        mf = mol_or_mf
+        return mol_or_mf
 
-    # dm may be too big for mpi4py library to serialize. Broadcast dm here.
-    if any(comm.allgather(dm is mpi.Message.SkippedArg)):
-        dm = mpi.bcast_tagged_array(dm)
+def _get_jk(mf, dm, hermi, omega, layouts=None):
+    mpi.sync(mf)
+    if mf.opt is None:
+        mf.opt = _init_direct_scf(mf)
+    if omega is None:
+        return _eval_jk(mf, dm, hermi, _jk_jobs_s8, layouts)
+    with mf.mol.with_range_coulomb(omega):
+        return _eval_jk(mf, dm, hermi, _jk_jobs_s8, layouts)
 
-    mf.unpack_(comm.bcast(mf.pack()))
+def _get_j(mf, dm, omega, layouts=None):
+    mpi.sync(mf)
     if mf.opt is None:
-        mf.opt = mf.init_direct_scf()
+        mf.opt = _init_direct_scf(mf)
     with lib.temporary_env(mf.opt._this.contents,
                            fprescreen=_vhf._fpointer('CVHFnrs8_vj_prescreen')):
         hermi = 1
         if omega is None:
-            vj = _eval_jk(mf, dm, hermi, _vj_jobs_s8)
+            vj = _eval_jk(mf, dm, hermi, _vj_jobs_s8, layouts)
         else:
             with mf.mol.with_range_coulomb(omega):
-                vj = _eval_jk(mf, dm, hermi, _vj_jobs_s8)
-    return vj.reshape(dm.shape)
-
-@lib.with_doc(hf.SCF.get_k.__doc__)
-@mpi.parallel_call(skip_args=[1])
-def get_k(mol_or_mf=None, dm=None, hermi=1, omega=None):
-    if isinstance(mol_or_mf, gto.mole.Mole):
-        mf = hf.SCF(mol_or_mf).view(SCF)
-    else:
-        mf = mol_or_mf
+                vj = _eval_jk(mf, dm, hermi, _vj_jobs_s8, layouts)
+    return vj[0]
 
-    # dm may be too big for mpi4py library to serialize. Broadcast dm here.
-    if any(comm.allgather(dm is mpi.Message.SkippedArg)):
-        dm = mpi.bcast_tagged_array(dm)
-
-    mf.unpack_(comm.bcast(mf.pack()))
+def _get_k(mf, dm, hermi, omega, layouts=None):
+    mpi.sync(mf)
     if mf.opt is None:
-        mf.opt = mf.init_direct_scf()
+        mf.opt = _init_direct_scf(mf)
     with lib.temporary_env(mf.opt._this.contents,
                            fprescreen=_vhf._fpointer('CVHFnrs8_vk_prescreen')):
         if omega is None:
-            vk = _eval_jk(mf, dm, hermi, _vk_jobs_s8)
+            vk = _eval_jk(mf, dm, hermi, _vk_jobs_s8, layouts)
         else:
             with mf.mol.with_range_coulomb(omega):
-                vk = _eval_jk(mf, dm, hermi, _vk_jobs_s8)
-    return vk.reshape(dm.shape)
-
-def _eval_jk(mf, dm, hermi, gen_jobs):
+                vk = _eval_jk(mf, dm, hermi, _vk_jobs_s8, layouts)
+    return vk[0]
+
+def _init_direct_scf(mf):
+    '''mf.init_direct_scf(), shared by the objects of the same system if the
+    caches of the systems are enabled (see mpi.system_cache)'''
+    sys_cache = mpi.system_cache(mf.mol)
+    if sys_cache is None:
+        return mf.init_direct_scf()
+    key = ('vhfopt', mf.__class__, mf.direct_scf_tol)
+    if key not in sys_cache:
+        sys_cache[key] = mf.init_direct_scf()
+    return sys_cache[key]
+
+def _reshape_jk(v, dm_shape):
+    # v is either the full matrices or the distributed row blocks
+    return v.reshape(dm_shape[:-2] + v.shape[1:])
+
+def _eval_jk(mf, dm, hermi, gen_jobs, layouts=None):
+    '''Evaluate the J/K recipes of the jobs.  The results are reduced to
+    root.  If layouts (one for each recipe) is given, the result of each
+    recipe is left distributed over the processes by mpi.reduce_scatter.
+    '''
     cpu0 = (logger.process_clock(), logger.perf_counter())
     mol = mf.mol
     ao_loc = mol.ao_loc_nr()
     nao = ao_loc[-1]
 
-    bas_groups = _partition_bas(mol)
-    jobs = gen_jobs(len(bas_groups), hermi)
+    bas_groups, jobs, quartets, eri_cache = _get_jobs(mf, mol, gen_jobs, hermi)
     njobs = len(jobs)
-    logger.debug1(mf, 'njobs %d', njobs)
 
     # Each job has multiple recipes.
     n_recipes = len(jobs[0][1:])
@@ -129,8 +180,75 @@ def _eval_jk(mf, dm, hermi, gen_jobs):
     # Then skip the "set_dm" initialization in function jk.get_jk/direct_bindm.
     vhfopt._dmcondname = None
 
+    active = _screen_jobs(mol, vhfopt, bas_groups, quartets, dm)
+    logger.debug1(mf, 'njobs %d, %d after screening', njobs, active.size)
+
+    # The wall time of the jobs measured in the first call is used as the cost
+    # model for the following calls (SCF iterations run the same job list).
+    # The costs depend on the job list, the number of processes and the
+    # geometry.
+    job_costs = mf.__dict__.get('_jk_job_costs')
+    if job_costs is None:
+        # Shared by the objects of the same system (see mpi.system_cache)
+        sys_cache = mpi.system_cache(mol)
+        if sys_cache is None:
+            job_costs = {}
+        else:
+            job_costs = sys_cache.setdefault('jk_job_costs', {})
+        mf.__dict__['_jk_job_costs'] = job_costs
+    costs_key = (gen_jobs.__name__, hermi, mpi.pool.size, mol._atm.tobytes(),
+                 mol._bas.tobytes(), mol._env.tobytes())
+    # The objects on the processes do not necessarily hold the same cache
+    # (e.g. a copy of mf on master shares the object of workers).  All
+    # processes have to agree on it because the measurement ends with a
+    # collective allreduce.
+    measured = all(comm.allgather(costs_key in job_costs))
+    if measured:
+        costs = job_costs[costs_key]
+        # The measured costs are the wall time of the jobs
+        nproc = mpi.active_size(costs[active].sum(), JK_MIN_TIME_PER_PROC)
+    else:
+        costs = _estimate_job_costs(mol, vhfopt, bas_groups, jobs)
+        nproc = mpi.pool.size
+    timings = numpy.zeros(njobs)
+
+    if ((SEMI_DIRECT_MAX_MEMORY > 0 or SEMI_DIRECT_MAX_DISK > 0) and
+            mol._env[gto.mole.PTR_RANGE_OMEGA] == 0):
+        # The jobs are pinned to the processes which hold their integrals
+        pinned = eri_cache.pinned.get(costs_key)
+        # The processes have to agree on whether to pin the jobs (a
+        # collective operation), see the comments of measured.
+        if not all(comm.allgather(pinned is not None)):
+            pinned = mpi.cost_balanced_partition(range(njobs), costs, residual=0)
+            pinned = eri_cache.pinned[costs_key] = numpy.array(list(pinned), dtype=int)
+            max_memory = min(SEMI_DIRECT_MAX_MEMORY,
+                             mf.max_memory - lib.current_memory()[0])
+            group_nao = numpy.array([ao_loc[i1] - ao_loc[i0] for i0, i1 in bas_groups])
+            eri_cache.plan(quartets[pinned], costs[pinned], group_nao,
+                           max_memory, SEMI_DIRECT_MAX_DISK)
+            logger.debug1(mf, 'semi-direct J/K: %d blocks cached (%.0f MB memory, '
+                          '%.0f MB disk)', len(eri_cache.slots),
+                          eri_cache.memory/1e6, eri_cache.disk/1e6)
+        is_active = numpy.zeros(njobs, dtype=bool)
+        is_active[active] = True
+        job_ids = pinned[is_active[pinned]]
+        group = comm
+    else:
+        eri_cache = None
+        logger.debug1(mf, 'get_jk on %d processes', nproc)
+        # The surplus processes (MPI.COMM_NULL) skip the jobs and the
+        # reduction.  They only take part in reduce_scatter, to receive
+        # their blocks of the distributed result.
+        group = mpi.active_comm(nproc)
+        if group == MPI.COMM_NULL:
+            job_ids = []
+        else:
+            job_ids = mpi.cost_balanced_partition(active, costs[active],
+                                                  group=group)
+
     logger.timer_debug1(mf, 'get_jk initialization', *cpu0)
-    for job_id in mpi.work_stealing_partition(range(njobs)):
+    for job_id in job_ids:
+        t0 = logger.perf_counter()
         group_ids = jobs[job_id][0]
         recipes = jobs[job_id][1:]
 
@@ -148,8 +266,16 @@ def _eval_jk(mf, dm, hermi, gen_jobs):
                    for recipe in recipes
                        for rec in recipe] * n_dm
 
-        kparts = jk.get_jk(mol, dm_blks, scripts, shls_slice=shls_slice,
-                           vhfopt=vhfopt)
+        if eri_cache is not None and group_ids in eri_cache.slots:
+            eri = eri_cache.get(group_ids)
+            if eri is None:
+                eri = mol.intor('int2e', shls_slice=shls_slice)
+                eri_cache.put(group_ids, eri)
+            kparts = [lib.einsum(script, eri, dm_blk)
+                      for script, dm_blk in zip(scripts, dm_blks)]
+        else:
+            kparts = jk.get_jk(mol, dm_blks, scripts, shls_slice=shls_slice,
+                               vhfopt=vhfopt)
 
         for i_dm in range(n_dm):
             for ir, recipe in enumerate(recipes):
@@ -159,8 +285,31 @@ def _eval_jk(mf, dm, hermi, gen_jobs):
                     vk[ir,i_dm,p0:p1,q0:q1] += kparts[i]
                 # Pop the results of one recipe
                 kparts = kparts[i+1:]
-
-    vk = mpi.reduce(vk)
+        timings[job_id] = logger.perf_counter() - t0
+
+    if not measured:
+        timings = mpi.allreduce(timings, inplace=True)
+        # The jobs dropped by the screening were not timed. Their estimated
+        # costs are scaled to the wall time of the other jobs.
+        skipped = numpy.ones(njobs, dtype=bool)
+        skipped[active] = False
+        est = costs[~skipped].sum()
+        if est > 0:
+            timings[skipped] = costs[skipped] * (timings[~skipped].sum() / est)
+        # Only the costs of the latest geometries are kept
+        while len(job_costs) >= JK_COSTS_CACHE_SIZE:
+            job_costs.pop(next(iter(job_costs)))
+        job_costs[costs_key] = timings
+
+    if layouts is not None:
+        vk = [mpi.reduce_scatter(vk[i], layout=layout)
+              for i, layout in enumerate(layouts)]
+        logger.timer(mf, 'get_jk', *cpu0)
+        return vk
+
+    if group != MPI.COMM_NULL:
+        vk = mpi.channel('scf.hf._eval_jk').reduce(vk, inplace=True,
+                                                   group=group)
     if rank == 0:
         if hermi:
             for i in range(n_recipes):
@@ -173,6 +322,118 @@ def _eval_jk(mf, dm, hermi, gen_jobs):
     logger.timer(mf, 'get_jk', *cpu0)
     return vk
 
+def _get_jobs(mf, mol, gen_jobs, hermi):
+    '''The basis groups, the jobs generated by gen_jobs, the (ip,jp,kp,lp)
+    indices of the jobs and the integral cache of the semi-direct mode.
+    They are cached in mf and rebuilt when the geometry or the basis of mol
+    is changed.'''
+    # The range-separation parameter does not change the jobs
+    env = mol._env.copy()
+    env[gto.mole.PTR_RANGE_OMEGA] = 0
+    mol_key = (mpi.pool.size, mol._atm.tobytes(), mol._bas.tobytes(),
+               env.tobytes())
+    cache = mf.__dict__.get('_jk_jobs_cache')
+    if cache is None or cache[0] != mol_key:
+        sys_cache = mpi.system_cache(mol)
+        if sys_cache is not None and sys_cache.get('jk_jobs', (None,))[0] == mol_key:
+            # The jobs (and the semi-direct integrals) of the same system
+            # built by another object
+            cache = sys_cache['jk_jobs']
+        else:
+            if cache is not None and sys_cache is None:
+                cache[3].close()
+            cache = (mol_key, _partition_bas(mol), {}, _ERICache())
+            if sys_cache is not None:
+                sys_cache['jk_jobs'] = cache
+        mf.__dict__['_jk_jobs_cache'] = cache
+    bas_groups, jobs_cache, eri_cache = cache[1:]
+
+    key = (gen_jobs.__name__, hermi)
+    if key not in jobs_cache:
+        jobs = gen_jobs(len(bas_groups), hermi)
+        quartets = numpy.array([job[0] for job in jobs], dtype=numpy.int32)
+        jobs_cache[key] = (jobs, quartets)
+    return (bas_groups,) + jobs_cache[key] + (eri_cache,)
+
+class _ERICache(object):
+    '''The integral blocks (ip,jp,kp,lp) of the jobs pinned to this process'''
+    def __init__(self):
+        self.pinned = {}  # job list -> the job ids assigned to this process
+        self.slots = {}   # (ip,jp,kp,lp) -> 'memory' or 'disk'
+        self.blocks = {}
+        self.feri = None
+        self.memory = 0
+        self.disk = 0
+
+    def plan(self, quartets, costs, group_nao, max_memory, max_disk):
+        '''Select the blocks to cache, the most expensive ones per byte first.
+        max_memory and max_disk are in MB.'''
+        nbytes = group_nao[quartets].prod(axis=1) * 8
+        for i in numpy.argsort(-costs / nbytes, kind='stable'):
+            q = tuple(int(x) for x in quartets[i])
+            if q in self.slots:
+                continue
+            if self.memory + nbytes[i] <= max_memory * 1e6:
+                self.slots[q] = 'memory'
+                self.memory += nbytes[i]
+            elif self.disk + nbytes[i] <= max_disk * 1e6:
+                self.slots[q] = 'disk'
+                self.disk += nbytes[i]
+
+    def get(self, q):
+        '''The cached integrals of block q, or None if not computed yet'''
+        if self.slots[q] == 'memory':
+            return self.blocks.get(q)
+        key = '%d_%d_%d_%d' % q
+        if self.feri is not None and key in self.feri:
+            return self.feri[key][:]
+        return None
+
+    def put(self, q, eri):
+        if self.slots[q] == 'memory':
+            self.blocks[q] = eri
+        else:
+            if self.feri is None:
+                self.feri = lib.H5TmpFile()
+            self.feri['%d_%d_%d_%d' % q] = eri
+
+    def close(self):
+        self.blocks.clear()
+        if self.feri is not None:
+            self.feri.close()
+            self.feri = None
+
+def _screen_jobs(mol, vhfopt, bas_groups, quartets, dm):
+    '''Indices of the jobs which are not negligible.  The contribution of a
+    job is bounded by the largest Schwarz factors (q_cond) of the bra and
+    the ket group pairs times the largest density matrix element of the
+    group pairs involved in the J and K contractions.  Jobs whose bound is
+    below direct_scf_tol are dropped.
+    '''
+    njobs = len(quartets)
+    try:
+        q_cond = numpy.asarray(vhfopt.q_cond).reshape(mol.nbas, mol.nbas)
+        cutoff = vhfopt.direct_scf_tol
+    except (AttributeError, ValueError, TypeError):
+        return numpy.arange(njobs)
+
+    ao_loc = mol.ao_loc_nr()
+    sh_starts = numpy.array([x[0] for x in bas_groups])
+    ao_starts = ao_loc[sh_starts]
+    q_max = numpy.maximum.reduceat(q_cond, sh_starts, axis=0)
+    q_max = numpy.maximum.reduceat(q_max, sh_starts, axis=1)
+    dm_max = abs(dm).max(axis=0)
+    dm_max = numpy.maximum.reduceat(dm_max, ao_starts, axis=0)
+    dm_max = numpy.maximum.reduceat(dm_max, ao_starts, axis=1)
+    dm_max = numpy.maximum(dm_max, dm_max.T)
+
+    ip, jp, kp, lp = quartets.T
+    dm_bound = numpy.max([dm_max[kp,lp], dm_max[ip,jp],
+                          dm_max[ip,kp], dm_max[ip,lp],
+                          dm_max[jp,kp], dm_max[jp,lp]], axis=0)
+    bound = q_max[ip,jp] * q_max[kp,lp] * dm_bound
+    return numpy.where(bound >= cutoff)[0]
+
 def _partition_bas(mol):
     ao_loc = mol.ao_loc_nr()
     nao = ao_loc[-1]
@@ -185,6 +446,57 @@ def _partition_bas(mol):
     logger.debug2(mol, 'bas_groups = %s', bas_groups)
     return bas_groups
 
+def _estimate_job_costs(mol, vhfopt, bas_groups, jobs):
+    '''Estimate the costs of the jobs.  The cost of a shell quartet is
+    approximated by the product of (number of functions * number of
+    primitives) of the four shells.  Shell quartets screened out by the
+    Schwarz inequality (q_cond) are not counted.
+    '''
+    ao_loc = mol.ao_loc_nr()
+    shl_cost = (ao_loc[1:] - ao_loc[:-1]) * mol._bas[:,gto.NPRIM_OF]
+    try:
+        q_cond = numpy.asarray(vhfopt.q_cond).reshape(mol.nbas, mol.nbas)
+        cutoff = vhfopt.direct_scf_tol
+    except (AttributeError, ValueError, TypeError):
+        q_cond = None
+
+    # For each pair of basis groups, the sorted q_cond and the cumulative
+    # costs of the shell pairs in the descending order of q_cond.
+    pair_data = {}
+    def get_pair_data(ip, jp):
+        if (ip, jp) not in pair_data:
+            i0, i1 = bas_groups[ip]
+            j0, j1 = bas_groups[jp]
+            w = numpy.outer(shl_cost[i0:i1], shl_cost[j0:j1]).ravel()
+            if q_cond is None:
+                pair_data[ip,jp] = (None, w, w.sum())
+            else:
+                q = q_cond[i0:i1,j0:j1].ravel()
+                idx = numpy.argsort(q)
+                q = q[idx]
+                w = w[idx]
+                # wsum_above[n] is the sum of weights of the pairs q[n:]
+                wsum_above = numpy.append(numpy.cumsum(w[::-1])[::-1], 0)
+                pair_data[ip,jp] = (q, w, wsum_above)
+        return pair_data[ip,jp]
+
+    costs = numpy.empty(len(jobs))
+    for job_id, job in enumerate(jobs):
+        ip, jp, kp, lp = job[0]
+        q_ij, w_ij, ws_ij = get_pair_data(ip, jp)
+        q_kl, w_kl, ws_kl = get_pair_data(kp, lp)
+        if q_cond is None:
+            cost = ws_ij * ws_kl
+        else:
+            with numpy.errstate(divide='ignore'):
+                thresholds = cutoff / q_ij
+            n_kl = numpy.searchsorted(q_kl, thresholds, side='right')
+            cost = numpy.dot(w_ij, ws_kl[n_kl])
+        # Each recipe is one contraction of the integrals with dm
+        n_contractions = sum(len(recipe) for recipe in job[1:])
+        costs[job_id] = cost * (1 + .1 * n_contractions)
+    return costs
+
 def _vj_jobs_s8(ngroups, hermi=1):
     jobs = []
     recipe = ((1,0,2,3), (0,1,2,3), (3,2,0,1), (2,3,0,1))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+'''
+Compression of numpy arrays for the communication of large tensors.
+
+Two modes are supported
+
+* 'lossless': the bytes of the array are shuffled (the i-th bytes of all
+  elements are grouped together) then compressed by LZ4, zstd or zlib,
+  whichever is available.
+* 'float32': double precision arrays are converted to single precision
+  before the lossless compression.  It should only be used for the
+  intermediates which tolerate the loss of precision.
+
+The compression ratio of each operation is recorded in the module-level
+``stats`` object.
+'''
+
+import time
+import zlib
+import threading
+import numpy
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+from pyscf import __config__
+
+# One of 'auto', 'lz4', 'zstd', 'zlib'
+CODEC = getattr(__config__, 'mpi_compression_codec', 'auto')
+LEVEL = getattr(__config__, 'mpi_compression_level', 1)
+
+MODES = ('lossless', 'float32')
+
+_LOSSY_DTYPES = {
+    numpy.dtype(numpy.float64): numpy.dtype(numpy.float32),
+    numpy.dtype(numpy.complex128): numpy.dtype(numpy.complex64),
+}
+
+
+def available_codecs():
+    codecs = []
+    if lz4 is not None:
+        codecs.append('lz4')
+    if zstd is not None:
+        codecs.append('zstd')
+    codecs.append('zlib')
+    return codecs
+
+def _select_codec(codec=None):
+    if codec is None:
+        codec = CODEC
+    if codec == 'auto':
+        return available_codecs()[0]
+    if codec not in available_codecs():
+        raise RuntimeError('Compression codec %s is not available' % codec)
+    return codec
+
+def get_mode(compress):
+    '''Convert the argument "compress" of the communication functions to
+    the compression mode.  None means no compression.'''
+    if not compress:
+        return None
+    elif compress is True:
+        return 'lossless'
+    elif compress in MODES:
+        return compress
+    else:
+        raise ValueError('Unknown compression mode %s' % compress)
+
+def _shuffle(arr):
+    '''Group the i-th bytes of all (real) elements together'''
+    if arr.dtype.kind == 'c':
+        arr = arr.view(arr.real.dtype)
+    nbytes = arr.dtype.itemsize
+    if nbytes == 1:
+        return arr.view(numpy.uint8).ravel()
+    return arr.view(numpy.uint8).reshape(-1,nbytes).T.ravel()
+
+def _unshuffle(buf, dtype, size):
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == 'c':
+        nbytes = dtype.itemsize // 2
+    else:
+        nbytes = dtype.itemsize
+    buf = numpy.frombuffer(buf, dtype=numpy.uint8)
+    if nbytes > 1:
+        buf = buf.reshape(nbytes,-1).T.ravel()
+    return buf.view(dtype)[:size]
+
+def compress(arr, mode='lossless', codec=None, level=None):
+    '''Compress the flattened array.
+
+    Returns:
+        header : tuple
+            (codec, dtype of the compressed data, dtype of the input array)
+            which is needed by decompress.
+        payload : ndarray of uint8
+    '''
+    if level is None:
+        level = LEVEL
+    codec = _select_codec(codec)
+    arr = numpy.asarray(arr, order='C').ravel()
+    dtype = arr.dtype
+    if mode == 'float32' and dtype in _LOSSY_DTYPES:
+        arr = arr.astype(_LOSSY_DTYPES[dtype])
+    raw = _shuffle(arr).tobytes()
+
+    if codec == 'lz4':
+        payload = lz4.compress(raw, compression_level=level)
+    elif codec == 'zstd':
+        payload = zstd.ZstdCompressor(level=level).compress(raw)
+    else:
+        payload = zlib.compress(raw, level)
+    header = (codec, arr.dtype.char, dtype.char)
+    return header, numpy.frombuffer(payload, dtype=numpy.uint8)
+
+def decompress(header, payload, size, out=None):
+    '''Restore the (flattened) array from the output of compress.'''
+    codec, packed_dtype, dtype = header
+    payload = numpy.asarray(payload, dtype=numpy.uint8).tobytes()
+    if codec == 'lz4':
+        raw = lz4.decompress(payload)
+    elif codec == 'zstd':
+        raw = zstd.ZstdDecompressor().decompress(payload)
+    else:
+        raw = zlib.decompress(payload)
+    arr = _unshuffle(raw, packed_dtype, size)
+    if out is None:
+        return arr.astype(dtype)
+    else:
+        out[:] = arr
+        return out
+
+
+class CompressionStats(object):
+    '''Accumulated sizes of the compressed data for each operation'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.records = {}
+
+    def record(self, name, raw_bytes, compressed_bytes, seconds):
+        with self._lock:
+            rec = self.records.setdefault(name, [0, 0, 0, 0.])
+            rec[0] += 1
+            rec[1] += raw_bytes
+            rec[2] += compressed_bytes
+            rec[3] += seconds
+
+    def ratio(self, name=None):
+        '''Compression ratio (raw size / compressed size)'''
+        with self._lock:
+            if name is None:
+                raw = sum(x[1] for x in self.records.values())
+                compressed = sum(x[2] for x in self.records.values())
+            elif name in self.records:
+                raw, compressed = self.records[name][1:3]
+            else:
+                return 1.
+        if compressed == 0:
+            return 1.
+        return float(raw) / compressed
+
+    def summary(self):
+        lines = ['%-12s %8s %14s %14s %7s %9s' %
+                 ('operation', 'calls', 'raw bytes', 'sent bytes', 'ratio',
+                  'time (s)')]
+        with self._lock:
+            records = sorted(self.records.items())
+        for name, (ncalls, raw, compressed, seconds) in records:
+            lines.append('%-12s %8d %14d %14d %7.2f %9.3f' %
+                         (name, ncalls, raw, compressed,
+                          float(raw)/max(compressed, 1), seconds))
+        return '\n'.join(lines)
+
+stats = CompressionStats()
+
+def compress_with_stats(name, arr, mode, codec=None):
+    '''compress and record the compression ratio in stats'''
+    t0 = time.perf_counter()
+    header, payload = compress(arr, mode, codec)
+    stats.record(name, arr.nbytes, payload.nbytes, time.perf_counter() - t0)
+    return header, payload
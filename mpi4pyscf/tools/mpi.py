@@ -1,28 +1,98 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import copy
 import time
 import enum
+import heapq
+import pickle
+import hashlib
+import collections
 import threading
 import traceback
+import weakref
 import numpy
 from mpi4py import MPI
 from . import mpi_pool
+from . import compression
+from . import profiler
 from .mpi_pool import MPIPool
 from pyscf import lib
+from pyscf import __config__
 
 _registry = {}
 
+# The processes can be split into groups of GROUP_SIZE processes, to run
+# independent calculations concurrently (see farm).  Each group has its own
+# pool and registry.  comm, rank and pool refer to the group.  The groups
+# have to be formed before any module takes the references of comm and rank,
+# therefore the group size is set by the environment variable
+# MPI4PYSCF_GROUP_SIZE or the config mpi_group_size.
+GROUP_SIZE = int(os.environ.get('MPI4PYSCF_GROUP_SIZE',
+                                getattr(__config__, 'mpi_group_size', 0)))
+world = MPI.COMM_WORLD
+if 0 < GROUP_SIZE < world.Get_size():
+    group_id = world.Get_rank() // GROUP_SIZE
+    ngroups = (world.Get_size() + GROUP_SIZE - 1) // GROUP_SIZE
+    _group_comm = world.Split(group_id, world.Get_rank())
+    # The communicator of the masters of all groups
+    _leader_comm = world.Split(0 if _group_comm.Get_rank() == 0 else MPI.UNDEFINED,
+                               world.Get_rank())
+else:
+    group_id = 0
+    ngroups = 1
+    _group_comm = world
+    _leader_comm = None
+
 if 'pool' not in _registry:
     import atexit
-    pool = MPIPool(debug=False)
+    pool = MPIPool(_group_comm, debug=False)
     _registry['pool'] = pool
     atexit.register(pool.close)
 
 comm = pool.comm
 rank = pool.rank
+if profiler.ENABLED:
+    pool.close_callbacks.append(lambda: profiler.stats.report(comm))
 INT_MAX = 2147483647
 BLKSIZE = INT_MAX // 32 + 1
+# Whether bcast and reduce go through the node leaders by default
+HIERARCHICAL = getattr(__config__, 'mpi_hierarchical_collectives', False)
+# Segment size (number of elements) and the number of segments in flight
+# for the pipelined collectives
+PIPELINE_BLKSIZE = getattr(__config__, 'mpi_pipeline_blksize', 1 << 22)
+PIPELINE_DEPTH = getattr(__config__, 'mpi_pipeline_depth', 2)
+# Default compression mode of send/recv/alltoall/rotate: False or True (or
+# 'lossless').  See tools.compression.  The lossy mode 'float32' cannot be
+# the default.  It has to be requested by the argument compress of each call
+# (e.g. the config cc_ccsd_t_mpi_compression of the call sites in ccsd_t).
+COMPRESSION = getattr(__config__, 'mpi_compression', False)
+if compression.get_mode(COMPRESSION) not in (None, 'lossless'):
+    raise ValueError('mpi_compression = %s.  The lossy compression can only '
+                     'be requested for each call' % COMPRESSION)
+# The messages of send/rotate and the blocks of alltoall smaller than this
+# (in bytes) are sent without compression
+COMPRESSION_MIN_BYTES = getattr(__config__, 'mpi_compression_min_bytes', 1 << 16)
+
+def _wait_for_peers(*args, **kwargs):
+    group = kwargs.get('group')
+    if group is None:
+        group = comm
+    group.Barrier()
+
+def _wait_for_message(source=0, tag=0):
+    comm.Probe(source=source, tag=tag)
+
+def profiled_comm(c=None):
+    '''The communicator which records the calls of its methods in the
+    communication profile (see tools.profiler) when the profiler is enabled.
+    '''
+    if c is None:
+        c = comm
+    if profiler.ENABLED:
+        return profiler.ProfiledComm(c)
+    return c
 
 def static_partition(tasks):
     size = len(tasks)
@@ -152,6 +222,169 @@ def work_stealing_partition(tasks, interval=.1):
 
     tasks_handler.join()
 
+def dynamic_partition(tasks, chunksize=1, guided=False):
+    '''Self-scheduling of the tasks with a global task counter.
+
+    The counter lives in an MPI RMA window on rank 0.  Each process fetches
+    the next chunk of tasks with an atomic operation on the counter.  No
+    helper thread or collective communication is required during the
+    iterations.  The generator has to be consumed (or closed) on all
+    processes because the window is released collectively in the end.
+
+    Kwargs:
+        chunksize : int
+            Number of tasks to fetch in each request.  For the guided mode,
+            it is the minimal size of the chunks.
+        guided : bool
+            Guided self-scheduling.  The chunk size is proportional to the
+            number of remaining tasks, (remaining tasks) / (2 * pool.size).
+    '''
+    return _counter_partition(tasks, chunksize, guided, comm)
+
+def _counter_partition(tasks, chunksize, guided, c):
+    # dynamic_partition over the processes of the communicator c
+    if c.Get_size() <= 1:
+        for task in tasks:
+            yield task
+        return
+
+    ntasks = len(tasks)
+    chunksize = max(1, int(chunksize))
+    if c.Get_rank() == 0:
+        counter = numpy.zeros(1, dtype=numpy.int64)
+        win = MPI.Win.Create(counter, counter.itemsize, comm=c)
+    else:
+        win = MPI.Win.Create(None, 1, comm=c)
+    c.Barrier()
+
+    mpi_dtype = MPI.INT64_T
+    inc = numpy.empty(1, dtype=numpy.int64)
+    start = numpy.empty(1, dtype=numpy.int64)
+    win.Lock_all()
+    try:
+        while True:
+            if guided:
+                # Compare-and-swap since the chunk size depends on the counter
+                win.Fetch_and_op([inc, mpi_dtype], [start, mpi_dtype], 0,
+                                 op=MPI.NO_OP)
+                win.Flush(0)
+                while start[0] < ntasks:
+                    cur = start[0]
+                    size = max(chunksize, (ntasks-cur) // (2*c.Get_size()))
+                    inc[0] = cur + size
+                    compare = numpy.array([cur], dtype=numpy.int64)
+                    win.Compare_and_swap([inc, mpi_dtype],
+                                         [compare, mpi_dtype],
+                                         [start, mpi_dtype], 0)
+                    win.Flush(0)
+                    if start[0] == cur:
+                        break
+            else:
+                size = chunksize
+                inc[0] = size
+                win.Fetch_and_op([inc, mpi_dtype], [start, mpi_dtype], 0,
+                                 op=MPI.SUM)
+                win.Flush(0)
+
+            p0 = int(start[0])
+            if p0 >= ntasks:
+                break
+            for i in range(p0, min(p0+size, ntasks)):
+                yield tasks[i]
+    finally:
+        win.Unlock_all()
+        win.Free()
+
+def active_size(work, min_work_per_proc, size=None):
+    '''The number of processes to use for the given amount of work.
+
+    Each process should get at least min_work_per_proc (in the same units as
+    work, e.g. seconds or number of tasks).  Otherwise the communication and
+    the scheduling overhead outweigh the computation.  The surplus processes
+    are left idle.
+    '''
+    if size is None:
+        size = pool.size
+    if min_work_per_proc <= 0:
+        return size
+    return int(max(1, min(size, work // min_work_per_proc)))
+
+_active_comms = {}
+def active_comm(nproc):
+    '''The communicator of the first nproc processes (see active_size).
+    MPI.COMM_NULL is returned on the other processes, which should skip the
+    operations of the communicator.  The communicator is created
+    collectively when it is first needed, then cached.  It is the
+    communicator of all processes if nproc >= pool.size.
+
+    It is used by scf.hf.get_jk.  The CC, MP2 and PBC DF drivers lay out their
+    tensors over all processes and do not use it.  Small calculations of
+    these kinds can be run in groups of processes with farm.
+    '''
+    if nproc >= pool.size:
+        return comm
+    if nproc not in _active_comms:
+        color = 0 if rank < nproc else MPI.UNDEFINED
+        _active_comms[nproc] = comm.Split(color, rank)
+    return _active_comms[nproc]
+
+def cost_balanced_partition(tasks, costs, residual=.1, chunksize=1, group=None):
+    '''Static partition of the tasks based on their costs, with dynamic
+    scheduling for the residual tasks.
+
+    The expensive tasks are assigned with the longest-processing-time-first
+    (LPT) rule, i.e. in the descending order of costs, each task is assigned
+    to the process with the least load.  The cheapest tasks, which sum up to
+    the fraction "residual" of the total cost, are left for
+    dynamic_partition to absorb the errors of the cost model.  The
+    generator has to be consumed on all processes.
+
+    Kwargs:
+        group : communicator
+            The tasks are distributed over the processes of group (e.g.
+            active_comm) instead of all processes.  The generator is only
+            consumed on the processes of group.
+    '''
+    if group is None:
+        group = comm
+    nproc = group.Get_size()
+    if nproc <= 1:
+        for task in tasks:
+            yield task
+        return
+
+    if group.Get_rank() == 0:
+        costs = numpy.asarray(costs, dtype=float)
+        _assert(costs.size == len(tasks))
+        order = numpy.argsort(-costs, kind='stable')
+        cum = numpy.cumsum(costs[order[::-1]])
+        if cum.size > 0 and residual > 0:
+            nresidual = int(numpy.searchsorted(cum, cum[-1]*residual, side='right'))
+        else:
+            nresidual = 0
+        nstatic = order.size - nresidual
+
+        loads = [(0., i) for i in range(nproc)]
+        assigned = [[] for i in range(nproc)]
+        for i in order[:nstatic]:
+            load, p = heapq.heappop(loads)
+            assigned[p].append(int(i))
+            heapq.heappush(loads, (load + costs[i], p))
+        residual_tasks = [int(i) for i in order[nstatic:]]
+        group.bcast(residual_tasks)
+    else:
+        assigned = None
+        residual_tasks = group.bcast(None)
+    mine = group.scatter(assigned)
+
+    for i in mine:
+        yield tasks[i]
+    # The residual list is the same on all processes.  The shared counter
+    # (an RMA window and a barrier) is not needed when it is empty.
+    if residual_tasks:
+        for i in _counter_partition(residual_tasks, chunksize, False, group):
+            yield tasks[i]
+
 def _create_dtype(dat):
     mpi_dtype = MPI._typedict[dat.dtype.char]
     # the smallest power of 2 greater than dat.size/INT_MAX
@@ -174,25 +407,55 @@ def bcast_test(buf, root=0):  # To test, maybe with better performance
         comm.Bcast([buf[-rest*deriv_dtype.size:], deriv_dtype], root)
     return buf
 
-def bcast(buf, root=0):
+@profiler.instrument('bcast', _wait_for_peers)
+def bcast(buf, root=0, hierarchical=None):
+    '''Broadcast the array of root to all processes.
+
+    Kwargs:
+        hierarchical : bool
+            Whether to broadcast to the node leaders first then to the
+            processes on each node.  Default is HIERARCHICAL.
+    '''
     buf = numpy.asarray(buf, order='C')
-    shape, dtype = comm.bcast((buf.shape, buf.dtype.char))
+    shape, dtype = comm.bcast((buf.shape, buf.dtype.char), root)
+    return _bcast(buf, shape, dtype, root, hierarchical)
+
+def _bcast(buf, shape, dtype, root, hierarchical=None):
     if rank != root:
         buf = numpy.empty(shape, dtype=dtype)
 
     dtype = buf.dtype.char
     buf_seg = numpy.ndarray(buf.size, dtype=buf.dtype, buffer=buf)
-    for p0, p1 in lib.prange(0, buf.size, BLKSIZE):
-        comm.Bcast([buf_seg[p0:p1], dtype], root)
+    if _hierarchical(hierarchical, root):
+        node_comm, leader_comm = _get_node_comms()[:2]
+        for p0, p1 in lib.prange(0, buf.size, BLKSIZE):
+            if node_comm.rank == 0:
+                leader_comm.Bcast([buf_seg[p0:p1], dtype], 0)
+            node_comm.Bcast([buf_seg[p0:p1], dtype], 0)
+    else:
+        for p0, p1 in lib.prange(0, buf.size, BLKSIZE):
+            comm.Bcast([buf_seg[p0:p1], dtype], root)
     return buf
 
 
-def bcast_tagged_array(arr):
-    '''Broadcast big nparray or tagged array.'''
+@profiler.instrument('bcast_tagged_array', _wait_for_peers)
+def bcast_tagged_array(arr, shared=False):
+    '''Broadcast big nparray or tagged array.
+
+    Kwargs:
+        shared : bool
+            Whether to broadcast the array to the shared memory of each node
+            (see bcast_shared).  The shared array is returned on all
+            processes, including rank 0.  It should be released with
+            free_shared.
+    '''
     if comm.bcast(not isinstance(arr, numpy.ndarray)):
         return comm.bcast(arr)
 
-    new_arr = bcast(arr)
+    if shared:
+        new_arr = bcast_shared(arr)
+    else:
+        new_arr = bcast(arr)
 
     if comm.bcast(isinstance(arr, lib.NPArrayWithTag)):
         new_arr = lib.tag_array(new_arr)
@@ -206,63 +469,469 @@ def bcast_tagged_array(arr):
             comm.bcast(kv)
         else:
             kv = comm.bcast(None)
-            new_arr.__dict__.update(kv)
 
         for k, v in kv:
             if v is Message.NparrayToBcast:
-                new_arr.k = bcast(v)
+                if rank == 0:
+                    v = bcast(arr.__dict__[k])
+                else:
+                    v = bcast(None)
+            new_arr.__dict__[k] = v
 
-    if rank != 0:
+    if rank != 0 or shared:
         arr = new_arr
     return arr
 
+# The fingerprints of the last sync for each distributed object, keyed by
+# _reg_procs.  The copies of an object on master share the same object on
+# workers, therefore the state is recorded for the object on workers.
+_sync_states = {}
+
+def sync(obj):
+    '''Synchronize the attributes given by obj.pack() from root to the other
+    processes, then call obj.unpack_ with the updated attributes.
+
+    Root keeps the fingerprints (content hashes) of the attributes of the
+    last sync of the object on workers (identified by obj._reg_procs, or by
+    obj itself if it is not registered).  Only the attributes changed since
+    then are sent.  Large arrays are sent by bcast_tagged_array.  It is a
+    collective operation.
+
+    The fingerprints assume that
+    * workers never change their own copies of the packed attributes.  The
+      changes on workers are not seen by root, and they are not overwritten
+      by the following syncs.
+    * an array attribute (without tags) is not modified in place on root.
+      An array of the same id and shape as in the last sync is not hashed
+      again.  Assign a new array to have the changes sent.
+    '''
+    if rank == 0:
+        reg_procs = getattr(obj, '_reg_procs', None)
+        if reg_procs:
+            fingerprints = _sync_states.setdefault(tuple(reg_procs), {})
+        else:
+            state = obj.__dict__.get('_sync_state')
+            if state is None or state[0] != id(obj):
+                # New object, or a copy of another object
+                fingerprints = {}
+            else:
+                fingerprints = state[1]
+            obj.__dict__['_sync_state'] = (id(obj), fingerprints)
+        changed = {}
+        arrays = []
+        for key, val in obj.pack().items():
+            last = fingerprints.get(key)
+            plain_array = (isinstance(val, numpy.ndarray) and
+                           not getattr(val, '__dict__', None))
+            if (plain_array and last is not None and last[0] is not None and
+                last[0]() is val and last[1] == val.shape):
+                # The same array as in the last sync
+                continue
+            fp = _fingerprint(val)
+            # A weak reference rather than the id, which can be taken by a
+            # new array once the old array is released
+            ref = weakref.ref(val) if plain_array else None
+            fingerprints[key] = (ref, getattr(val, 'shape', None), fp)
+            if fp is None or last is None or last[2] != fp:
+                if isinstance(val, numpy.ndarray) and val.nbytes > 1e5:
+                    changed[key] = Message.NparrayToBcast
+                    arrays.append(val)
+                else:
+                    changed[key] = val
+        comm.bcast(changed)
+        for arr in arrays:
+            bcast_tagged_array(arr)
+    else:
+        changed = comm.bcast(None)
+        for key, val in changed.items():
+            if val is Message.NparrayToBcast:
+                changed[key] = bcast_tagged_array(None)
+    return obj.unpack_(changed)
+
+def _fingerprint(val):
+    '''A hash of the content of val, or None if it cannot be computed.  The
+    data of the arrays (including the subclasses like NPArrayWithTag and
+    their attributes) are hashed without being pickled.'''
+    if isinstance(val, numpy.ndarray) and val.dtype != object:
+        digest = hashlib.blake2b(
+            numpy.ascontiguousarray(val.view(numpy.ndarray)).data,
+            digest_size=16).digest()
+        fp = (type(val), val.shape, val.dtype.str, digest)
+        attrs = getattr(val, '__dict__', None)
+        for k in sorted(attrs or ()):
+            sub = _fingerprint(attrs[k])
+            if sub is None:
+                return None
+            fp += ((k, sub),)
+        return fp
+    try:
+        data = pickle.dumps(val, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+    if len(data) > 256:
+        return hashlib.blake2b(data, digest_size=16).digest()
+    return data
+
+_shared_windows = {}
+def shared_array(shape, dtype=numpy.double):
+    '''Allocate an array in the shared memory of the node.  It is a
+    collective operation.  The processes on the same node get views of the
+    same buffer, i.e. one physical copy per node.  After writing to the
+    array, call sync_shared (collectively) before other processes read it.
+    The array should be released with free_shared (collectively) when it
+    is not needed.
+    '''
+    node_comm = _get_node_comms()[0]
+    dtype = numpy.dtype(dtype)
+    if isinstance(shape, (int, numpy.integer)):
+        shape = (shape,)
+    size = int(numpy.prod(shape))
+    if node_comm.rank == 0:
+        # At least one element so that the windows have different addresses
+        nbytes = max(size, 1) * dtype.itemsize
+    else:
+        nbytes = 0
+    win = MPI.Win.Allocate_shared(nbytes, dtype.itemsize, comm=node_comm)
+    # A passive target epoch for the lifetime of the array, required by
+    # win.Sync in sync_shared
+    win.Lock_all(MPI.MODE_NOCHECK)
+    buf, itemsize = win.Shared_query(0)
+    arr = numpy.ndarray(shape, dtype=dtype, buffer=buf)
+    _shared_windows[arr.__array_interface__['data'][0]] = win
+    return arr
+
+def free_shared(arr):
+    '''Release the array allocated by shared_array or bcast_shared.  It is a
+    collective operation on the node.  The array (and the views of it)
+    should not be accessed afterwards.
+    '''
+    win = _shared_windows.pop(arr.__array_interface__['data'][0], None)
+    _assert(win is not None)
+    win.Unlock_all()
+    win.Free()
+
+def sync_shared(arr):
+    '''Make the writes to the array allocated by shared_array visible to
+    the other processes of the node.  It is a collective operation on the
+    node.  The barrier alone does not order the memory accesses of the
+    processes (see the separate/unified memory models of MPI-3 RMA).
+    '''
+    node_comm = _get_node_comms()[0]
+    win = _shared_windows[arr.__array_interface__['data'][0]]
+    win.Sync()
+    node_comm.Barrier()
+    win.Sync()
+
+@profiler.instrument('bcast_shared', _wait_for_peers)
+def bcast_shared(buf):
+    '''Broadcast the array of rank 0 to the shared memory of each node.
+
+    The array is transferred to the node leaders only.  A view of the
+    node-shared array is returned on every process (rank 0 included).  The
+    array should be treated as read-only and be released with free_shared.
+    '''
+    buf = numpy.asarray(buf, order='C')
+    shape, dtype = comm.bcast((buf.shape, buf.dtype.char))
+    arr = shared_array(shape, dtype)
+
+    node_comm, leader_comm = _get_node_comms()[:2]
+    if rank == 0:
+        arr[...] = buf
+    if node_comm.rank == 0:
+        arr_seg = numpy.ndarray(arr.size, dtype=arr.dtype, buffer=arr)
+        for p0, p1 in lib.prange(0, arr.size, BLKSIZE):
+            leader_comm.Bcast([arr_seg[p0:p1], dtype], 0)
+    # Other processes on the node can read the array after the leader is
+    # done with the writing.
+    sync_shared(arr)
+    return arr
+
 
-def reduce(sendbuf, op=MPI.SUM, root=0):
+@profiler.instrument('reduce', _wait_for_peers)
+def reduce(sendbuf, op=MPI.SUM, root=0, out=None, inplace=False,
+           hierarchical=None, group=None):
+    '''Reduce the arrays of all processes to the root process.
+
+    Kwargs:
+        out : ndarray
+            Output buffer on root.  It has to be a C-contiguous array with the
+            same shape and dtype as sendbuf.
+        inplace : bool
+            Whether to reduce to the sendbuf of root (with MPI.IN_PLACE).
+            No extra buffer is allocated.  sendbuf has to be C-contiguous.
+        hierarchical : bool
+            Whether to reduce on each node first then across the node
+            leaders.  Default is HIERARCHICAL.
+        group : communicator
+            Reduce over the processes of group (e.g. active_comm) instead of
+            all processes.  root is the rank in group.  It should be passed
+            as a keyword argument.
+    '''
     sendbuf = numpy.asarray(sendbuf, order='C')
-    shape, mpi_dtype = comm.bcast((sendbuf.shape, sendbuf.dtype.char))
+    c = comm if group is None else group
+    shape, mpi_dtype = c.bcast((sendbuf.shape, sendbuf.dtype.char), root)
     _assert(sendbuf.shape == shape and sendbuf.dtype.char == mpi_dtype)
+    return _reduce(sendbuf, op, root, out, inplace, hierarchical, group)
+
+def _reduce(sendbuf, op, root, out, inplace, hierarchical=None, group=None):
+    if group is None or group is comm:
+        group = comm
+        if _hierarchical(hierarchical, root):
+            return _reduce_hierarchical(sendbuf, op, out, inplace, False)
 
     dtype = sendbuf.dtype.char
-    recvbuf = numpy.zeros_like(sendbuf)
     send_seg = numpy.ndarray(sendbuf.size, dtype=sendbuf.dtype, buffer=sendbuf)
-    recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
-    for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE):
-        comm.Reduce([send_seg[p0:p1], dtype],
-                    [recv_seg[p0:p1], dtype], op, root)
-
-    if rank == root:
+    if group.Get_rank() == root:
+        recvbuf = _reduce_recvbuf(sendbuf, out, inplace)
+        recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
+        for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE):
+            if inplace:
+                group.Reduce(MPI.IN_PLACE, [recv_seg[p0:p1], dtype], op, root)
+            else:
+                group.Reduce([send_seg[p0:p1], dtype],
+                             [recv_seg[p0:p1], dtype], op, root)
         return recvbuf
     else:
+        # recvbuf is not referenced on the non-root processes
+        for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE):
+            group.Reduce([send_seg[p0:p1], dtype], None, op, root)
         return sendbuf
 
-def allreduce(sendbuf, op=MPI.SUM):
+@profiler.instrument('allreduce', _wait_for_peers)
+def allreduce(sendbuf, op=MPI.SUM, out=None, inplace=False,
+              hierarchical=None):
+    '''Reduce the arrays of all processes and distribute the result to all
+    processes.
+
+    Kwargs:
+        out : ndarray
+            Output buffer. It has to be a C-contiguous array with the same
+            shape and dtype as sendbuf.
+        inplace : bool
+            Whether to overwrite sendbuf with the result (with MPI.IN_PLACE).
+        hierarchical : bool
+            Whether to reduce on each node, then across the node leaders,
+            then to broadcast on each node.  Default is HIERARCHICAL.
+    '''
     sendbuf = numpy.asarray(sendbuf, order='C')
     shape, mpi_dtype = comm.bcast((sendbuf.shape, sendbuf.dtype.char))
     _assert(sendbuf.shape == shape and sendbuf.dtype.char == mpi_dtype)
+    return _allreduce(sendbuf, op, out, inplace, hierarchical)
+
+def _allreduce(sendbuf, op, out, inplace, hierarchical=None):
+    if _hierarchical(hierarchical, 0):
+        return _reduce_hierarchical(sendbuf, op, out, inplace, True)
 
     dtype = sendbuf.dtype.char
-    recvbuf = numpy.zeros_like(sendbuf)
+    recvbuf = _reduce_recvbuf(sendbuf, out, inplace)
     send_seg = numpy.ndarray(sendbuf.size, dtype=sendbuf.dtype, buffer=sendbuf)
     recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
     for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE):
-        comm.Allreduce([send_seg[p0:p1], dtype],
-                       [recv_seg[p0:p1], dtype], op)
+        if inplace:
+            comm.Allreduce(MPI.IN_PLACE, [recv_seg[p0:p1], dtype], op)
+        else:
+            comm.Allreduce([send_seg[p0:p1], dtype],
+                           [recv_seg[p0:p1], dtype], op)
     return recvbuf
 
+def _reduce_recvbuf(sendbuf, out=None, inplace=False):
+    '''The receive buffer for reduce and allreduce. MPI writes to every
+    element of the receive buffer. It is not initialized here.'''
+    if inplace:
+        return sendbuf
+    elif out is None:
+        return numpy.empty_like(sendbuf)
+    else:
+        _assert(out.shape == sendbuf.shape and out.dtype == sendbuf.dtype and
+                out.flags.c_contiguous)
+        return out
+
+def row_blocks(nrow, layout='rows'):
+    '''The rows [(r0, r1), ...] held by each process in the output of
+    reduce_scatter.
+    '''
+    if layout == 'rows':
+        segsize = (nrow+pool.size-1) // pool.size
+        bounds = [min(i*segsize, nrow) for i in range(pool.size+1)]
+    elif layout == 'packed':
+        # Balance the number of elements of the lower triangular part
+        bounds = [int(round(nrow * (float(i)/pool.size)**.5))
+                  for i in range(pool.size+1)]
+    else:
+        raise ValueError('Unknown layout %s' % layout)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+@profiler.instrument('reduce_scatter', _wait_for_peers)
+def reduce_scatter(sendbuf, op=MPI.SUM, layout='rows'):
+    '''Reduce the matrices of all processes and scatter the rows of the
+    result.  Each process only receives its own row block.
+
+    Args:
+        sendbuf : ndarray of shape (..., nrow, ncol)
+
+    Kwargs:
+        layout : str
+            'rows': process i receives the rows row_blocks(nrow)[i] of the
+            reduced matrices, an array of shape (..., r1-r0, ncol).
+            'packed': the matrices are hermitian (or anti-hermitian) and only
+            their lower triangular parts are reduced.  Process i receives
+            the rows row_blocks(nrow, 'packed')[i] of the lower triangular
+            part in the packed storage (see lib.pack_tril), an array of
+            shape (..., r1*(r1+1)//2 - r0*(r0+1)//2).
+    '''
+    sendbuf = numpy.asarray(sendbuf, order='C')
+    shape, mpi_dtype = comm.bcast((sendbuf.shape, sendbuf.dtype.char))
+    _assert(sendbuf.shape == shape and sendbuf.dtype.char == mpi_dtype)
+    nrow, ncol = shape[-2:]
+    blocks = row_blocks(nrow, layout)
+
+    # Transpose the matrices so that the rows of each process are contiguous
+    if layout == 'rows':
+        sendbuf = sendbuf.reshape(-1,nrow,ncol)
+        nmat = sendbuf.shape[0]
+        if nmat > 1:
+            sendbuf = sendbuf.transpose(1,0,2)
+        sendbuf = numpy.ascontiguousarray(sendbuf).ravel()
+        offsets = [r0 * ncol for r0, r1 in blocks] + [nrow * ncol]
+    else:
+        _assert(nrow == ncol)
+        sendbuf = lib.pack_tril(sendbuf.reshape(-1,nrow,nrow))
+        nmat = sendbuf.shape[0]
+        sendbuf = numpy.ascontiguousarray(sendbuf.T).ravel()
+        offsets = [r0*(r0+1)//2 for r0, r1 in blocks] + [nrow*(nrow+1)//2]
+    displs = numpy.asarray(offsets[:-1]) * nmat
+    counts = numpy.asarray(offsets[1:]) * nmat - displs
+
+    recvbuf = numpy.empty(counts[rank], dtype=mpi_dtype)
+    for p0, p1 in lib.prange(0, max(counts), BLKSIZE // pool.size):
+        counts_seg = _segment_counts(counts, p0, p1)
+        send_seg = numpy.hstack([sendbuf[i0+p0:i0+p0+n]
+                                 for i0, n in zip(displs, counts_seg)])
+        comm.Reduce_scatter([send_seg, mpi_dtype],
+                            [recvbuf[p0:p0+counts_seg[rank]], mpi_dtype],
+                            counts_seg, op)
+    sendbuf = send_seg = None
+
+    r0, r1 = blocks[rank]
+    if layout == 'rows':
+        recvbuf = recvbuf.reshape(r1-r0,nmat,ncol).transpose(1,0,2)
+        return numpy.ascontiguousarray(recvbuf).reshape(shape[:-2]+(r1-r0,ncol))
+    else:
+        recvbuf = recvbuf.reshape(-1,nmat).T
+        return numpy.ascontiguousarray(recvbuf).reshape(shape[:-2]+(-1,))
+
+_node_comms = None
+def _get_node_comms():
+    '''The shared-memory communicator of the node, the communicator of the
+    node leaders (MPI.COMM_NULL on the other processes) and whether the
+    processes are laid out flat (one node or one process per node).
+
+    The communicators are created collectively when they are first needed.
+    The lowest rank on each node is the node leader.  Rank 0 is rank 0 of
+    its node communicator and of the leaders communicator.
+    '''
+    global _node_comms
+    if _node_comms is None:
+        node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED, key=rank)
+        if node_comm.rank == 0:
+            leader_comm = comm.Split(0, key=rank)
+        else:
+            leader_comm = comm.Split(MPI.UNDEFINED, key=rank)
+        nprocs = comm.allreduce(node_comm.size)
+        flat = nprocs == comm.size or nprocs == comm.size**2
+        _node_comms = (node_comm, leader_comm, flat)
+    return _node_comms
+
+def _hierarchical(hierarchical, root):
+    '''Whether to use the hierarchical algorithm.  All processes have to
+    pass the same arguments.'''
+    if hierarchical is None:
+        hierarchical = HIERARCHICAL
+    # Only the world rank 0 is guaranteed to be a node leader
+    return hierarchical and root == 0 and not _get_node_comms()[2]
+
+def _reduce_hierarchical(sendbuf, op, out, inplace, allreduce,
+                         nonblocking=False):
+    '''Reduce on each node to the node leader, then reduce (or allreduce)
+    across the node leaders.  For allreduce, the result is broadcasted on
+    each node in the end.  For the non-blocking mode, only the on-node
+    reduction is non-blocking.  The rest is executed in wait().
+    '''
+    node_comm, leader_comm = _get_node_comms()[:2]
+    is_leader = node_comm.rank == 0
+    dtype = sendbuf.dtype.char
+    if allreduce or rank == 0:
+        recvbuf = result = _reduce_recvbuf(sendbuf, out, inplace)
+    elif is_leader:
+        # A buffer for the partial sum of the node
+        recvbuf = numpy.empty_like(sendbuf)
+        result = sendbuf
+    else:
+        recvbuf = None
+        result = sendbuf
+
+    send_seg = numpy.ndarray(sendbuf.size, dtype=sendbuf.dtype, buffer=sendbuf)
+    if recvbuf is not None:
+        recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
+    segs = list(lib.prange(0, sendbuf.size, BLKSIZE))
+    if is_leader and recvbuf is sendbuf:
+        node_args = [(MPI.IN_PLACE, [recv_seg[p0:p1], dtype]) for p0, p1 in segs]
+    elif is_leader:
+        node_args = [([send_seg[p0:p1], dtype], [recv_seg[p0:p1], dtype])
+                     for p0, p1 in segs]
+    else:
+        node_args = [([send_seg[p0:p1], dtype], None) for p0, p1 in segs]
+
+    def across_nodes(result):
+        for p0, p1 in segs:
+            if is_leader:
+                if allreduce:
+                    leader_comm.Allreduce(MPI.IN_PLACE, [recv_seg[p0:p1], dtype], op)
+                elif rank == 0:
+                    leader_comm.Reduce(MPI.IN_PLACE, [recv_seg[p0:p1], dtype], op, 0)
+                else:
+                    leader_comm.Reduce([recv_seg[p0:p1], dtype], None, op, 0)
+            if allreduce:
+                node_comm.Bcast([recv_seg[p0:p1], dtype], 0)
+        return result
+
+    if nonblocking:
+        reqs = [node_comm.Ireduce(s, r, op, 0) for s, r in node_args]
+        return CollectiveRequest(reqs, result, across_nodes,
+                                 buffers=(sendbuf, recvbuf))
+    else:
+        for s, r in node_args:
+            node_comm.Reduce(s, r, op, 0)
+        return across_nodes(result)
+
+@profiler.instrument('scatter', _wait_for_peers)
 def scatter(sendbuf, root=0):
+    '''Scatter the list of arrays of root.  The arrays can be strided views.
+    They are sent without being packed to a contiguous buffer.
+    '''
     if rank == root:
         mpi_dtype = numpy.result_type(*sendbuf).char
-        shape = comm.scatter([x.shape for x in sendbuf])
+        shape = comm.scatter([x.shape for x in sendbuf], root)
         counts = numpy.asarray([x.size for x in sendbuf])
-        comm.bcast((mpi_dtype, counts))
-        sendbuf = [numpy.asarray(x, mpi_dtype).ravel() for x in sendbuf]
-        sendbuf = numpy.hstack(sendbuf)
+        sendbuf = [numpy.asarray(x, mpi_dtype) for x in sendbuf]
+        strided, supported = _views_layout(sendbuf)
+        comm.bcast((mpi_dtype, counts, strided and supported), root)
+        sendviews = sendbuf
     else:
-        shape = comm.scatter(None)
-        mpi_dtype, counts = comm.bcast(None)
+        shape = comm.scatter(None, root)
+        mpi_dtype, counts, strided = comm.bcast(None, root)
+        sendviews = [None] * pool.size
 
-    displs = numpy.append(0, numpy.cumsum(counts[:-1]))
     recvbuf = numpy.empty(numpy.prod(shape), dtype=mpi_dtype)
+    if strided:
+        recvviews = [None] * pool.size
+        recvviews[root] = recvbuf
+        _alltoallw(sendviews, recvviews)
+        return recvbuf.reshape(shape)
+
+    if rank == root:
+        sendbuf = numpy.hstack([x.ravel() for x in sendbuf])
+    displs = numpy.append(0, numpy.cumsum(counts[:-1]))
 
     #DONOT use lib.prange. lib.prange may terminate early in some processes
     for p0, p1 in prange(0, numpy.max(counts), BLKSIZE):
@@ -271,6 +940,7 @@ def scatter(sendbuf, root=0):
                       [recvbuf[p0:p1], mpi_dtype], root)
     return recvbuf.reshape(shape)
 
+@profiler.instrument('gather', _wait_for_peers)
 def gather(sendbuf, root=0, split_recvbuf=False):
     #if pool.debug:
     #    if rank == 0:
@@ -283,17 +953,45 @@ def gather(sendbuf, root=0, split_recvbuf=False):
     #        comm.send(sendbuf, dest=0)
     #        return sendbuf
 
+    sendbuf = numpy.asarray(sendbuf)
+    size_dtype = comm.allgather((sendbuf.shape, sendbuf.dtype.char)
+                                + _views_layout([sendbuf]))
+    plan = _gather_plan(size_dtype)
+    _assert(sendbuf.dtype == plan[3] or sendbuf.size == 0)
+
+    if any(x[2] for x in size_dtype) and all(x[3] for x in size_dtype):
+        # Strided arrays are received directly, without packing
+        rshape, counts, displs, mpi_dtype = plan
+        sendviews = [None] * pool.size
+        sendviews[root] = sendbuf
+        if rank == root:
+            recvbuf = numpy.empty(sum(counts), dtype=mpi_dtype)
+            recvviews = [recvbuf[p0:p0+c] for p0, c in zip(displs, counts)]
+        else:
+            recvviews = [None] * pool.size
+        _alltoallw(sendviews, recvviews)
+        if rank == root:
+            return _gather_recvbuf(recvbuf, plan, sendbuf.shape,
+                                   split_recvbuf)
+        else:
+            return sendbuf
+
     sendbuf = numpy.asarray(sendbuf, order='C')
-    shape = sendbuf.shape
-    size_dtype = comm.allgather((shape, sendbuf.dtype.char))
+    return _gather(sendbuf, plan, root, split_recvbuf)
+
+def _gather_plan(size_dtype):
+    '''The receive shapes, counts, displacements and the MPI datatype of
+    gather and allgather'''
     rshape = [x[0] for x in size_dtype]
     counts = numpy.array([numpy.prod(x) for x in rshape])
-
+    displs = numpy.append(0, numpy.cumsum(counts[:-1]))
     mpi_dtype = numpy.result_type(*[x[1] for x in size_dtype]).char
-    _assert(sendbuf.dtype == mpi_dtype or sendbuf.size == 0)
+    return rshape, counts, displs, mpi_dtype
 
+def _gather(sendbuf, plan, root, split_recvbuf):
+    rshape, counts, displs, mpi_dtype = plan
+    shape = sendbuf.shape
     if rank == root:
-        displs = numpy.append(0, numpy.cumsum(counts[:-1]))
         recvbuf = numpy.empty(sum(counts), dtype=mpi_dtype)
 
         sendbuf = sendbuf.ravel()
@@ -301,14 +999,7 @@ def gather(sendbuf, root=0, split_recvbuf=False):
             counts_seg = _segment_counts(counts, p0, p1)
             comm.Gatherv([sendbuf[p0:p1], mpi_dtype],
                          [recvbuf, counts_seg, displs+p0, mpi_dtype], root)
-        if split_recvbuf:
-            return [recvbuf[p0:p0+c].reshape(shape)
-                    for p0,c,shape in zip(displs,counts,rshape)]
-        else:
-            try:
-                return recvbuf.reshape((-1,) + shape[1:])
-            except ValueError:
-                return recvbuf
+        return _gather_recvbuf(recvbuf, plan, shape, split_recvbuf)
     else:
         send_seg = sendbuf.ravel()
         for p0, p1 in lib.prange(0, numpy.max(counts), BLKSIZE):
@@ -316,16 +1007,16 @@ def gather(sendbuf, root=0, split_recvbuf=False):
         return sendbuf
 
 
+@profiler.instrument('allgather', _wait_for_peers)
 def allgather(sendbuf, split_recvbuf=False):
     sendbuf = numpy.asarray(sendbuf, order='C')
-    shape = sendbuf.shape
-    attr = comm.allgather((shape, sendbuf.dtype.char))
-    rshape = [x[0] for x in attr]
-    counts = numpy.array([numpy.prod(x) for x in rshape])
-    mpi_dtype = numpy.result_type(*[x[1] for x in attr]).char
-    _assert(sendbuf.dtype.char == mpi_dtype or sendbuf.size == 0)
+    plan = _gather_plan(comm.allgather((sendbuf.shape, sendbuf.dtype.char)))
+    _assert(sendbuf.dtype.char == plan[3] or sendbuf.size == 0)
+    return _allgather(sendbuf, plan, split_recvbuf)
 
-    displs = numpy.append(0, numpy.cumsum(counts[:-1]))
+def _allgather(sendbuf, plan, split_recvbuf):
+    rshape, counts, displs, mpi_dtype = plan
+    shape = sendbuf.shape
     recvbuf = numpy.empty(sum(counts), dtype=mpi_dtype)
 
     sendbuf = sendbuf.ravel()
@@ -333,6 +1024,10 @@ def allgather(sendbuf, split_recvbuf=False):
         counts_seg = _segment_counts(counts, p0, p1)
         comm.Allgatherv([sendbuf[p0:p1], mpi_dtype],
                         [recvbuf, counts_seg, displs+p0, mpi_dtype])
+    return _gather_recvbuf(recvbuf, plan, shape, split_recvbuf)
+
+def _gather_recvbuf(recvbuf, plan, shape, split_recvbuf):
+    rshape, counts, displs = plan[:3]
     if split_recvbuf:
         return [recvbuf[p0:p0+c].reshape(shape)
                 for p0,c,shape in zip(displs,counts,rshape)]
@@ -342,7 +1037,49 @@ def allgather(sendbuf, split_recvbuf=False):
         except ValueError:
             return recvbuf
 
-def alltoall(sendbuf, split_recvbuf=False):
+@profiler.instrument('alltoall', _wait_for_peers)
+def alltoall(sendbuf, split_recvbuf=False, compress=None):
+    '''All-to-all exchange.  sendbuf can be an array, which is evenly split
+    along the first axis, or a list of arrays, one for each process.  The
+    arrays in the list can be strided views.  They are sent without being
+    packed to a contiguous buffer.
+
+    Kwargs:
+        compress : bool or str
+            Compression mode (False, True/'lossless' or 'float32') of the
+            data on the wire.  All processes should pass the same value.
+            The blocks smaller than COMPRESSION_MIN_BYTES are not
+            compressed.  Default is COMPRESSION.
+    '''
+    mode = _compression_mode(compress)
+    if mode is not None:
+        return _alltoall_compressed(sendbuf, split_recvbuf, mode)
+
+    if isinstance(sendbuf, numpy.ndarray):
+        sendbuf, scounts, sdispls, recvbuf, rcounts, rdispls, rshape, mpi_dtype = \
+                _alltoall_setup(sendbuf)
+    else:
+        sendbuf, rshape, mpi_dtype, strided = _alltoall_meta(sendbuf)
+        rcounts, rdispls, recvbuf = _alltoall_recvbuf(rshape, mpi_dtype)
+        if strided:
+            recvviews = [recvbuf[p0:p0+c] for p0, c in zip(rdispls, rcounts)]
+            _alltoallw(sendbuf, recvviews)
+            return _split_alltoall_recvbuf(recvbuf, rcounts, rdispls, rshape,
+                                           split_recvbuf)
+        sendbuf, scounts, sdispls = _alltoall_pack(sendbuf)
+
+    max_counts = max(numpy.max(scounts), numpy.max(rcounts))
+    #DONOT use lib.prange. lib.prange may terminate early in some processes
+    for p0, p1 in prange(0, max_counts, BLKSIZE):
+        scounts_seg = _segment_counts(scounts, p0, p1)
+        rcounts_seg = _segment_counts(rcounts, p0, p1)
+        comm.Alltoallv([sendbuf, scounts_seg, sdispls+p0, mpi_dtype],
+                       [recvbuf, rcounts_seg, rdispls+p0, mpi_dtype])
+
+    return _split_alltoall_recvbuf(recvbuf, rcounts, rdispls, rshape,
+                                   split_recvbuf)
+
+def _alltoall_setup(sendbuf):
     if isinstance(sendbuf, numpy.ndarray):
         mpi_dtype = comm.bcast(sendbuf.dtype.char)
         sendbuf = numpy.asarray(sendbuf, mpi_dtype, 'C')
@@ -353,51 +1090,234 @@ def alltoall(sendbuf, split_recvbuf=False):
         sdispls[sdispls>sendbuf.size] = sendbuf.size
         scounts = numpy.append(sdispls[1:]-sdispls[:-1], sendbuf.size-sdispls[-1])
         rshape = comm.alltoall(scounts)
+        sendbuf = sendbuf.ravel()
+    else:
+        sendbuf, rshape, mpi_dtype = _alltoall_meta(sendbuf)[:3]
+        sendbuf, scounts, sdispls = _alltoall_pack(sendbuf)
+
+    rcounts, rdispls, recvbuf = _alltoall_recvbuf(rshape, mpi_dtype)
+    return sendbuf, scounts, sdispls, recvbuf, rcounts, rdispls, rshape, mpi_dtype
+
+def _alltoall_compressed(sendbuf, split_recvbuf, mode):
+    if isinstance(sendbuf, numpy.ndarray):
+        mpi_dtype = comm.bcast(sendbuf.dtype.char)
+        sendbuf = numpy.asarray(sendbuf, mpi_dtype, 'C')
+        segsize = (sendbuf.shape[0]+pool.size-1) // pool.size
+        sendbuf = [sendbuf[i*segsize:(i+1)*segsize].ravel()
+                   for i in range(pool.size)]
+        shapes = [x.size for x in sendbuf]
     else:
         _assert(len(sendbuf) == pool.size)
         mpi_dtype = comm.bcast(sendbuf[0].dtype.char)
         sendbuf = [numpy.asarray(x, mpi_dtype) for x in sendbuf]
-        rshape = comm.alltoall([x.shape for x in sendbuf])
-        scounts = numpy.asarray([x.size for x in sendbuf])
-        sdispls = numpy.append(0, numpy.cumsum(scounts[:-1]))
-        sendbuf = numpy.hstack([x.ravel() for x in sendbuf])
-
-    rcounts = numpy.asarray([numpy.prod(x) for x in rshape])
+        shapes = [x.shape for x in sendbuf]
+
+    # The small blocks are sent raw, with the header None
+    packed = [compression.compress_with_stats('alltoall', x, mode)
+              if x.nbytes >= COMPRESSION_MIN_BYTES else
+              (None, numpy.ascontiguousarray(x).ravel().view(numpy.uint8))
+              for x in sendbuf]
+    rmeta = comm.alltoall([(shape, header, payload.size)
+                           for shape, (header, payload) in zip(shapes, packed)])
+    sendbuf, scounts, sdispls = _alltoall_pack([x[1] for x in packed])
+    packed = None
+    rcounts = numpy.asarray([x[2] for x in rmeta])
     rdispls = numpy.append(0, numpy.cumsum(rcounts[:-1]))
-    recvbuf = numpy.empty(sum(rcounts), dtype=mpi_dtype)
+    recv_packed = numpy.empty(sum(rcounts), dtype=numpy.uint8)
 
     max_counts = max(numpy.max(scounts), numpy.max(rcounts))
-    sendbuf = sendbuf.ravel()
-    #DONOT use lib.prange. lib.prange may terminate early in some processes
     for p0, p1 in prange(0, max_counts, BLKSIZE):
         scounts_seg = _segment_counts(scounts, p0, p1)
         rcounts_seg = _segment_counts(rcounts, p0, p1)
-        comm.Alltoallv([sendbuf, scounts_seg, sdispls+p0, mpi_dtype],
-                       [recvbuf, rcounts_seg, rdispls+p0, mpi_dtype])
+        comm.Alltoallv([sendbuf, scounts_seg, sdispls+p0, 'B'],
+                       [recv_packed, rcounts_seg, rdispls+p0, 'B'])
+    sendbuf = None
+
+    rshape = [x[0] for x in rmeta]
+    counts, displs, recvbuf = _alltoall_recvbuf(rshape, mpi_dtype)
+    for i, (header, p0, n) in enumerate(zip([x[1] for x in rmeta], rdispls, rcounts)):
+        out = recvbuf[displs[i]:displs[i]+counts[i]]
+        if header is None:
+            out.view(numpy.uint8)[:] = recv_packed[p0:p0+n]
+        else:
+            compression.decompress(header, recv_packed[p0:p0+n], counts[i],
+                                   out=out)
+    return _split_alltoall_recvbuf(recvbuf, counts, displs, rshape,
+                                   split_recvbuf)
+
+def _compression_mode(compress, nbytes=None):
+    '''The compression mode of a call.  The messages of nbytes smaller than
+    COMPRESSION_MIN_BYTES are not compressed.'''
+    if compress is None:
+        compress = COMPRESSION
+    mode = compression.get_mode(compress)
+    if nbytes is not None and nbytes < COMPRESSION_MIN_BYTES:
+        mode = None
+    return mode
+
+def _alltoall_meta(sendbuf):
+    '''Exchange the shapes of the list of arrays for alltoall.  The layout of
+    the local arrays (see _views_layout) is attached to every shape, so that
+    all processes learn whether the arrays can be exchanged by _alltoallw.
+    '''
+    _assert(len(sendbuf) == pool.size)
+    mpi_dtype = comm.bcast(sendbuf[0].dtype.char)
+    sendbuf = [numpy.asarray(x, mpi_dtype) for x in sendbuf]
+    layout = _views_layout(sendbuf)
+    meta = comm.alltoall([(x.shape,) + layout for x in sendbuf])
+    rshape = [x[0] for x in meta]
+    strided = any(x[1] for x in meta) and all(x[2] for x in meta)
+    return sendbuf, rshape, mpi_dtype, strided
+
+def _alltoall_pack(sendbuf):
+    scounts = numpy.asarray([x.size for x in sendbuf])
+    sdispls = numpy.append(0, numpy.cumsum(scounts[:-1]))
+    sendbuf = numpy.hstack([x.ravel() for x in sendbuf])
+    return sendbuf, scounts, sdispls
+
+def _alltoall_recvbuf(rshape, mpi_dtype):
+    rcounts = numpy.asarray([numpy.prod(x, dtype=int) for x in rshape])
+    rdispls = numpy.append(0, numpy.cumsum(rcounts[:-1]))
+    recvbuf = numpy.empty(sum(rcounts), dtype=mpi_dtype)
+    return rcounts, rdispls, recvbuf
 
+def _split_alltoall_recvbuf(recvbuf, rcounts, rdispls, rshape, split_recvbuf):
     if split_recvbuf:
         return [recvbuf[p0:p0+c].reshape(shape)
                 for p0,c,shape in zip(rdispls, rcounts, rshape)]
     else:
         return recvbuf
 
-def send(sendbuf, dest=0, tag=0):
+def _view_supported(arr):
+    '''Whether the layout of the array can be described by _view_datatype.
+    Negative strides and the arrays of more than BLKSIZE elements are not
+    supported.'''
+    return (arr.size <= BLKSIZE and arr.dtype.char in MPI._typedict and
+            all(stride >= 0 or n == 1
+                for n, stride in zip(arr.shape, arr.strides)))
+
+def _views_layout(views):
+    '''(strided, supported) of the arrays sent by a process: whether any
+    array is not contiguous, and whether all arrays are supported by
+    _view_datatype.  The arrays received by the peers are contiguous
+    segments of the same sizes, therefore the flags of all senders decide
+    whether the exchange can go through _alltoallw.'''
+    views = [x for x in views if x is not None and x.size > 0]
+    return (not all(x.flags.c_contiguous for x in views),
+            all(_view_supported(x) for x in views))
+
+def _view_datatype(arr):
+    '''The MPI datatype which describes the memory layout of a (strided)
+    array.  The absolute address of the array is encoded in the datatype.
+    It should be used with the buffer MPI.BOTTOM.  The array should be
+    supported by _view_supported.
+    '''
+    # Merge the axes which are contiguous to each other
+    shape = []
+    strides = []
+    for n, stride in zip(arr.shape, arr.strides):
+        if n == 1:
+            continue
+        if strides and strides[-1] == n * stride:
+            shape[-1] *= n
+            strides[-1] = stride
+        else:
+            shape.append(n)
+            strides.append(stride)
+
+    mpi_dtype = MPI._typedict[arr.dtype.char]
+    datatype = mpi_dtype
+    temp_types = []
+    for n, stride in zip(shape[::-1], strides[::-1]):
+        if datatype is mpi_dtype and stride == arr.itemsize:
+            datatype = datatype.Create_contiguous(n)
+        else:
+            datatype = datatype.Create_hvector(n, 1, stride)
+        temp_types.append(datatype)
+
+    address = arr.__array_interface__['data'][0]
+    datatype = MPI.Datatype.Create_struct([1], [address], [datatype]).Commit()
+    for t in temp_types:
+        t.Free()
+    return datatype
+
+def _alltoallw(sendviews, recvviews):
+    '''Exchange the (strided) arrays with MPI.Alltoallw.  sendviews[i] is
+    sent to process i and recvviews[i] receives the data from process i.
+    None means no data.  The data are transferred without packing.
+
+    The callers decide from the exchanged metadata (see _views_layout) that
+    all arrays are supported by _view_datatype.  No extra communication is
+    needed to agree on the path.
+    '''
+    created = []
+    def build(views):
+        counts = []
+        types = []
+        for x in views:
+            if x is None or x.size == 0:
+                counts.append(0)
+                types.append(MPI.BYTE)
+            else:
+                datatype = _view_datatype(x)
+                created.append(datatype)
+                counts.append(1)
+                types.append(datatype)
+        return counts, types
+
+    smsg = build(sendviews)
+    rmsg = build(recvviews)
+    displs = [0] * pool.size
+    comm.Alltoallw([MPI.BOTTOM, (smsg[0], displs), smsg[1]],
+                   [MPI.BOTTOM, (rmsg[0], displs), rmsg[1]])
+    for datatype in created:
+        datatype.Free()
+
+@profiler.instrument('send')
+def send(sendbuf, dest=0, tag=0, compress=None):
+    '''Send an array to process dest.
+
+    Kwargs:
+        compress : bool or str
+            Compression mode (False, True/'lossless' or 'float32') of the
+            data on the wire.  Small arrays are not compressed.  recv
+            detects the compression automatically.  Default is COMPRESSION.
+    '''
     sendbuf = numpy.asarray(sendbuf, order='C')
     dtype = sendbuf.dtype.char
+    mode = _compression_mode(compress, sendbuf.nbytes)
+    if mode is not None:
+        header, payload = compression.compress_with_stats('send', sendbuf, mode)
+        comm.send((sendbuf.shape, dtype, header, payload.size), dest=dest, tag=tag)
+        for p0, p1 in lib.prange(0, payload.size, BLKSIZE):
+            comm.Send([payload[p0:p1], 'B'], dest=dest, tag=tag)
+        return sendbuf
+
     comm.send((sendbuf.shape, dtype), dest=dest, tag=tag)
     send_seg = numpy.ndarray(sendbuf.size, dtype=sendbuf.dtype, buffer=sendbuf)
     for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE):
         comm.Send([send_seg[p0:p1], dtype], dest=dest, tag=tag)
     return sendbuf
 
+@profiler.instrument('recv', _wait_for_message, sendbuf=None)
 def recv(source=0, tag=0):
-    shape, dtype = comm.recv(source=source, tag=tag)
+    meta = comm.recv(source=source, tag=tag)
+    if len(meta) == 4:  # compressed
+        shape, dtype, header, nbytes = meta
+        payload = numpy.empty(nbytes, dtype=numpy.uint8)
+        for p0, p1 in lib.prange(0, nbytes, BLKSIZE):
+            comm.Recv([payload[p0:p1], 'B'], source=source, tag=tag)
+        size = int(numpy.prod(shape, dtype=int))
+        return compression.decompress(header, payload, size).reshape(shape)
+
+    shape, dtype = meta
     recvbuf = numpy.empty(shape, dtype=dtype)
     recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
     for p0, p1 in lib.prange(0, recvbuf.size, BLKSIZE):
         comm.Recv([recv_seg[p0:p1], dtype], source=source, tag=tag)
     return recvbuf
 
+@profiler.instrument('sendrecv')
 def sendrecv(sendbuf, source=0, dest=0, tag=0):
     if source == dest:
         return sendbuf
@@ -407,13 +1327,16 @@ def sendrecv(sendbuf, source=0, dest=0, tag=0):
     elif rank == dest:
         return recv(source, tag)
 
-def rotate(sendbuf, blocking=True, tag=0):
+@profiler.instrument('rotate')
+def rotate(sendbuf, blocking=True, tag=0, compress=None):
     '''On every process, pass the sendbuf to the next process.
     Node-ID  Before-rotate  After-rotate
     node-0   buf-0          buf-1
     node-1   buf-1          buf-2
     node-2   buf-2          buf-3
     node-3   buf-3          buf-0
+
+    See send for the argument compress.
     '''
     if pool.size <= 1:
         return sendbuf
@@ -431,13 +1354,14 @@ def rotate(sendbuf, blocking=True, tag=0):
     if isinstance(sendbuf, numpy.ndarray):
         if blocking:
             if rank % 2 == 0:
-                send(sendbuf, prev_node, tag)
+                send(sendbuf, prev_node, tag, compress)
                 recvbuf = recv(next_node, tag)
             else:
                 recvbuf = recv(next_node, tag)
-                send(sendbuf, prev_node, tag)
+                send(sendbuf, prev_node, tag, compress)
         else:
-            handler = lib.ThreadWithTraceBack(target=send, args=(sendbuf, prev_node, tag))
+            handler = lib.ThreadWithTraceBack(target=send,
+                                              args=(sendbuf, prev_node, tag, compress))
             handler.start()
             recvbuf = recv(next_node, tag)
             handler.join()
@@ -450,6 +1374,597 @@ def rotate(sendbuf, blocking=True, tag=0):
             comm.send(sendbuf, dest=next_node, tag=tag)
     return recvbuf
 
+class RingShift(object):
+    '''Ring shift of the blocks of a distributed tensor.
+
+    Every process holds one block.  The blocks are passed to the previous
+    process (like rotate) until every process has seen all blocks.  Two
+    communication buffers and the persistent send/recv requests are kept in
+    the object and reused for all hops and all calls.  The requests are
+    created for the actual sizes of the blocks passed in each hop.  They
+    are set up in the first call for each tensor shape, then reused in the
+    following calls (e.g. the following CCSD iterations).  While the
+    consumer works on one block, the next block is transferred, driven by
+    one helper thread which lives as long as the object.
+
+    Usage::
+
+        ring = RingShift()
+        for task_id, block in ring.iterate(buf):
+            ...
+        ring.close()
+
+    The block yielded by iterate is a view of the communication buffers.
+    It is only valid until the next iteration, and is overwritten by the
+    following transfers.  Copy the block if it is needed later.  With
+    debug=True, iterate yields copies of the blocks, to check whether the
+    results depend on the reuse of the buffers.
+
+    When the profiler is enabled, each hop is recorded as a 'ring_shift'
+    call (the start of the transfer, with the bytes sent) and a
+    'ring_shift.wait' call (the time blocked until the next block arrives,
+    with the bytes received) at the call site of iterate.
+    '''
+    def __init__(self, tag=0, debug=False):
+        self.tag = tag
+        self.debug = debug
+        self._profiler = profiler.stats if profiler.ENABLED else None
+        self._bufs = None
+        self._requests = {}
+        self._thread = None
+        self._queue = None
+        self._done = None
+
+    def _setup(self, count, dtype):
+        if (self._bufs is None or self._bufs[0].size < count or
+                self._bufs[0].dtype != dtype):
+            self.free()
+            self._bufs = [numpy.empty(count, dtype=dtype),
+                          numpy.empty(count, dtype=dtype)]
+
+        if self._thread is None:
+            import queue
+            self._queue = queue.Queue()
+            self._done = queue.Queue()
+            self._thread = threading.Thread(target=self._progress)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _hop_requests(self, cur, nsend, nrecv):
+        '''The persistent requests to send nsend elements of buffer cur and
+        receive nrecv elements into the other buffer'''
+        key = (cur, nsend, nrecv)
+        if key not in self._requests:
+            prev_node = (rank - 1) % pool.size
+            next_node = (rank + 1) % pool.size
+            dtype = self._bufs[0].dtype.char
+            sendbuf = self._bufs[cur]
+            recvbuf = self._bufs[1-cur]
+            reqs = []
+            for p0, p1 in lib.prange(0, nsend, BLKSIZE):
+                reqs.append(comm.Send_init([sendbuf[p0:p1], dtype],
+                                           prev_node, self.tag))
+            for p0, p1 in lib.prange(0, nrecv, BLKSIZE):
+                reqs.append(comm.Recv_init([recvbuf[p0:p1], dtype],
+                                           next_node, self.tag))
+            self._requests[key] = reqs
+        return self._requests[key]
+
+    def _progress(self):
+        while True:
+            reqs = self._queue.get()
+            if reqs is None:
+                break
+            try:
+                MPI.Prequest.Startall(reqs)
+                MPI.Request.Waitall(reqs)
+                self._done.put(None)
+            except Exception as err:
+                self._done.put(err)
+
+    def _start(self, reqs, nbytes=0, site=None):
+        t0 = time.perf_counter()
+        self._queue.put(reqs)
+        if site is not None:
+            self._profiler.record('ring_shift', site, nbytes, 0,
+                                  time.perf_counter() - t0, 0.)
+
+    def _wait(self, nbytes=0, site=None):
+        t0 = time.perf_counter()
+        err = self._done.get()
+        if site is not None:
+            dt = time.perf_counter() - t0
+            self._profiler.record('ring_shift.wait', site, 0, nbytes, dt, dt)
+        if err is not None:
+            raise err
+
+    def iterate(self, buf):
+        '''Iterate over the blocks of all processes, starting from the local
+        block.  Yields (task_id, block) where task_id is the process which
+        owns the block.
+        '''
+        buf = numpy.asarray(buf, order='C')
+        metas = comm.allgather((buf.shape, buf.dtype.char))
+        ntasks = pool.size
+        if ntasks <= 1:
+            yield rank, buf
+            return
+
+        _assert(all(x[1] == buf.dtype.char for x in metas))
+        shapes = [x[0] for x in metas]
+        sizes = [int(numpy.prod(x, dtype=int)) for x in shapes]
+        self._setup(max(sizes), buf.dtype)
+        self._bufs[0][:buf.size] = buf.ravel()
+        itemsize = buf.dtype.itemsize
+        site = None
+        if self._profiler is not None:
+            # The frame which resumes the generator, i.e. the consumer
+            site = profiler._call_site(sys._getframe(1))
+
+        cur = 0
+        pending = False
+        try:
+            for k in range(ntasks):
+                task = (rank + k) % ntasks
+                if k + 1 < ntasks:
+                    # Send the current block, receive the block of the next task
+                    next_task = (rank + k + 1) % ntasks
+                    self._start(self._hop_requests(cur, sizes[task],
+                                                   sizes[next_task]),
+                                sizes[task] * itemsize, site)
+                    nrecv = sizes[next_task] * itemsize
+                    pending = True
+                if k == 0:
+                    block = buf
+                else:
+                    block = self._bufs[cur][:sizes[task]].reshape(shapes[task])
+                if self.debug:
+                    block = block.copy()
+                yield task, block
+                block = None
+                if pending:
+                    pending = False
+                    self._wait(nrecv, site)
+                    cur = 1 - cur
+        finally:
+            if pending:
+                self._wait(nrecv, site)
+
+    def _free_requests(self):
+        for reqs in self._requests.values():
+            for req in reqs:
+                req.Free()
+        self._requests = {}
+
+    def free(self):
+        '''Release the communication buffers and the persistent requests.
+        They are allocated again in the next call of iterate.'''
+        self._free_requests()
+        self._bufs = None
+
+    def close(self):
+        self.free()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+class CollectiveRequest(object):
+    '''Handle of a non-blocking collective operation (ibcast, ireduce, ...).
+
+    The communication buffers are referenced by the handle.  They should not
+    be modified until wait() returns.  Multiple non-blocking collectives can
+    be in flight at the same time, as long as all processes issue them in the
+    same order.
+    '''
+    def __init__(self, requests, result, finalize=None, buffers=None):
+        self._requests = requests
+        self._result = result
+        self._finalize = finalize
+        self._buffers = buffers
+        self.done = False
+
+    def test(self):
+        '''Whether the operation is completed.  It does not block.'''
+        if not self.done:
+            self.done = MPI.Request.Testall(self._requests)
+        return self.done
+
+    @profiler.instrument('wait', sendbuf=None, blocking=True)
+    def wait(self):
+        '''Block until the operation is completed then return the result.'''
+        if not self.done:
+            MPI.Request.Waitall(self._requests)
+            self.done = True
+        if self._finalize is not None:
+            self._result = self._finalize(self._result)
+            self._finalize = None
+        self._buffers = None
+        return self._result
+
+@profiler.instrument('ibcast')
+def ibcast(buf, root=0):
+    '''Non-blocking version of bcast. It returns a CollectiveRequest. The
+    broadcasted array is returned by the wait() method of the request.
+    '''
+    buf = numpy.asarray(buf, order='C')
+    shape, dtype = comm.bcast((buf.shape, buf.dtype.char), root)
+    return _ibcast(buf, shape, dtype, root)
+
+def _ibcast(buf, shape, dtype, root):
+    if rank != root:
+        buf = numpy.empty(shape, dtype=dtype)
+
+    buf_seg = numpy.ndarray(buf.size, dtype=buf.dtype, buffer=buf)
+    reqs = [comm.Ibcast([buf_seg[p0:p1], dtype], root)
+            for p0, p1 in lib.prange(0, buf.size, BLKSIZE)]
+    return CollectiveRequest(reqs, buf)
+
+@profiler.instrument('ireduce')
+def ireduce(sendbuf, op=MPI.SUM, root=0, out=None, inplace=False,
+            hierarchical=None):
+    '''Non-blocking version of reduce. The reduced array (on root) or the
+    sendbuf (on other processes) is returned by the wait() method.
+
+    In the hierarchical mode, the on-node reduction is non-blocking.  The
+    reduction across nodes is carried out in the wait() method.
+    '''
+    sendbuf = numpy.asarray(sendbuf, order='C')
+    shape, mpi_dtype = comm.bcast((sendbuf.shape, sendbuf.dtype.char), root)
+    _assert(sendbuf.shape == shape and sendbuf.dtype.char == mpi_dtype)
+    return _ireduce(sendbuf, op, root, out, inplace, hierarchical)
+
+def _ireduce(sendbuf, op, root, out, inplace, hierarchical=None):
+    if _hierarchical(hierarchical, root):
+        return _reduce_hierarchical(sendbuf, op, out, inplace, False, True)
+
+    dtype = sendbuf.dtype.char
+    send_seg = numpy.ndarray(sendbuf.size, dtype=sendbuf.dtype, buffer=sendbuf)
+    if rank == root:
+        recvbuf = _reduce_recvbuf(sendbuf, out, inplace)
+        recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
+        if inplace:
+            reqs = [comm.Ireduce(MPI.IN_PLACE, [recv_seg[p0:p1], dtype], op, root)
+                    for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE)]
+        else:
+            reqs = [comm.Ireduce([send_seg[p0:p1], dtype],
+                                 [recv_seg[p0:p1], dtype], op, root)
+                    for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE)]
+        return CollectiveRequest(reqs, recvbuf, buffers=sendbuf)
+    else:
+        reqs = [comm.Ireduce([send_seg[p0:p1], dtype], None, op, root)
+                for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE)]
+        return CollectiveRequest(reqs, sendbuf)
+
+@profiler.instrument('iallreduce')
+def iallreduce(sendbuf, op=MPI.SUM, out=None, inplace=False,
+               hierarchical=None):
+    '''Non-blocking version of allreduce'''
+    sendbuf = numpy.asarray(sendbuf, order='C')
+    shape, mpi_dtype = comm.bcast((sendbuf.shape, sendbuf.dtype.char))
+    _assert(sendbuf.shape == shape and sendbuf.dtype.char == mpi_dtype)
+    return _iallreduce(sendbuf, op, out, inplace, hierarchical)
+
+def _iallreduce(sendbuf, op, out, inplace, hierarchical=None):
+    if _hierarchical(hierarchical, 0):
+        return _reduce_hierarchical(sendbuf, op, out, inplace, True, True)
+
+    dtype = sendbuf.dtype.char
+    recvbuf = _reduce_recvbuf(sendbuf, out, inplace)
+    send_seg = numpy.ndarray(sendbuf.size, dtype=sendbuf.dtype, buffer=sendbuf)
+    recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
+    if inplace:
+        reqs = [comm.Iallreduce(MPI.IN_PLACE, [recv_seg[p0:p1], dtype], op)
+                for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE)]
+    else:
+        reqs = [comm.Iallreduce([send_seg[p0:p1], dtype],
+                                [recv_seg[p0:p1], dtype], op)
+                for p0, p1 in lib.prange(0, sendbuf.size, BLKSIZE)]
+    return CollectiveRequest(reqs, recvbuf, buffers=sendbuf)
+
+@profiler.instrument('ialltoall')
+def ialltoall(sendbuf, split_recvbuf=False):
+    '''Non-blocking version of alltoall. The shapes of the arrays are
+    exchanged (blocking) before the data transfer is started.
+    '''
+    sendbuf, scounts, sdispls, recvbuf, rcounts, rdispls, rshape, mpi_dtype = \
+            _alltoall_setup(sendbuf)
+
+    max_counts = max(numpy.max(scounts), numpy.max(rcounts))
+    reqs = []
+    #DONOT use lib.prange. lib.prange may terminate early in some processes
+    for p0, p1 in prange(0, max_counts, BLKSIZE):
+        scounts_seg = _segment_counts(scounts, p0, p1)
+        rcounts_seg = _segment_counts(rcounts, p0, p1)
+        reqs.append(comm.Ialltoallv([sendbuf, scounts_seg, sdispls+p0, mpi_dtype],
+                                    [recvbuf, rcounts_seg, rdispls+p0, mpi_dtype]))
+
+    def finalize(recvbuf):
+        return _split_alltoall_recvbuf(recvbuf, rcounts, rdispls, rshape,
+                                       split_recvbuf)
+    return CollectiveRequest(reqs, recvbuf, finalize, buffers=sendbuf)
+
+def _pipeline(buf_seg, start, blksize=None, depth=None):
+    '''Start the non-blocking operations for the segments of buf_seg and
+    yield each segment when its operation is completed.  At most "depth"
+    segments are in flight.
+    '''
+    if blksize is None:
+        blksize = PIPELINE_BLKSIZE
+    if depth is None:
+        depth = PIPELINE_DEPTH
+    blksize = min(max(1, int(blksize)), BLKSIZE)
+    depth = max(1, depth)
+
+    pending = collections.deque()
+    for p0, p1 in lib.prange(0, buf_seg.size, blksize):
+        pending.append((p0, p1, start(p0, p1)))
+        if len(pending) >= depth:
+            p0, p1, req = pending.popleft()
+            req.Wait()
+            yield p0, p1, buf_seg[p0:p1]
+    while pending:
+        p0, p1, req = pending.popleft()
+        req.Wait()
+        yield p0, p1, buf_seg[p0:p1]
+
+def bcast_iter(buf, root=0, blksize=None, depth=None):
+    '''Broadcast the array of root segment by segment.
+
+    The segments of the flattened array are yielded as (p0, p1, segment) as
+    soon as they are received, while the following segments are still in
+    flight.  The segments are views of the broadcasted array.  The iterator
+    has to be consumed to the end on all processes.
+
+    Kwargs:
+        blksize : int
+            Number of elements of each segment.  Default is PIPELINE_BLKSIZE.
+        depth : int
+            Number of segments in flight.  Default is PIPELINE_DEPTH.
+
+    Examples:
+
+    >>> for p0, p1, seg in mpi.bcast_iter(buf):
+    ...     h5dat[p0:p1] = seg
+    '''
+    buf = numpy.asarray(buf, order='C')
+    shape, dtype = comm.bcast((buf.shape, buf.dtype.char), root)
+    if rank != root:
+        buf = numpy.empty(shape, dtype=dtype)
+
+    buf_seg = numpy.ndarray(buf.size, dtype=buf.dtype, buffer=buf)
+    def start(p0, p1):
+        return comm.Ibcast([buf_seg[p0:p1], dtype], root)
+    return _pipeline(buf_seg, start, blksize, depth)
+
+def allreduce_iter(sendbuf, op=MPI.SUM, out=None, inplace=False,
+                   blksize=None, depth=None):
+    '''Allreduce segment by segment.  The reduced segments of the flattened
+    array are yielded as (p0, p1, segment) as soon as they are available.
+    See also bcast_iter.
+    '''
+    sendbuf = numpy.asarray(sendbuf, order='C')
+    shape, mpi_dtype = comm.bcast((sendbuf.shape, sendbuf.dtype.char))
+    _assert(sendbuf.shape == shape and sendbuf.dtype.char == mpi_dtype)
+
+    dtype = sendbuf.dtype.char
+    recvbuf = _reduce_recvbuf(sendbuf, out, inplace)
+    send_seg = numpy.ndarray(sendbuf.size, dtype=sendbuf.dtype, buffer=sendbuf)
+    recv_seg = numpy.ndarray(recvbuf.size, dtype=recvbuf.dtype, buffer=recvbuf)
+    def start(p0, p1):
+        if inplace:
+            return comm.Iallreduce(MPI.IN_PLACE, [recv_seg[p0:p1], dtype], op)
+        else:
+            return comm.Iallreduce([send_seg[p0:p1], dtype],
+                                   [recv_seg[p0:p1], dtype], op)
+    return _pipeline(recv_seg, start, blksize, depth)
+
+class PipelinedReduce(object):
+    '''Reduction of an array which is produced segment by segment.
+
+    The segments of the flattened array are passed to push() in order, as
+    soon as they are computed.  The reduction of a segment starts immediately
+    and overlaps with the computation of the following segments.  All
+    processes have to push segments of the same sizes in the same order.
+    When root is None, the result is reduced to all processes (allreduce).
+
+    Examples:
+
+    >>> red = mpi.PipelinedReduce((nrow,ncol))
+    >>> for p0, p1 in lib.prange(0, nrow, blksize):
+    ...     red.push(compute(p0, p1))
+    >>> v = red.wait()  # None on non-root processes
+    '''
+    def __init__(self, shape, dtype=numpy.double, op=MPI.SUM, root=0,
+                 depth=None):
+        if isinstance(shape, (int, numpy.integer)):
+            shape = (shape,)
+        shape = tuple(shape)
+        dtype = numpy.dtype(dtype)
+        meta = comm.bcast((shape, dtype.char), root or 0)
+        _assert(meta == (shape, dtype.char))
+
+        self.shape = shape
+        self.dtype = dtype
+        self.op = op
+        self.root = root
+        if depth is None:
+            depth = PIPELINE_DEPTH
+        self.depth = max(1, depth)
+        self.size = int(numpy.prod(shape))
+        if root is None or rank == root:
+            self.recvbuf = numpy.empty(shape, dtype=dtype)
+            self._recv_seg = self.recvbuf.reshape(-1)
+        else:
+            self.recvbuf = None
+        self.offset = 0
+        self._pending = collections.deque()
+
+    def push(self, seg):
+        '''Start the reduction of the next segment'''
+        seg = numpy.asarray(seg, dtype=self.dtype, order='C').ravel()
+        p0 = self.offset
+        p1 = p0 + seg.size
+        _assert(p1 <= self.size)
+
+        dtype = self.dtype.char
+        op = self.op
+        root = self.root
+        for q0, q1 in lib.prange(0, seg.size, BLKSIZE):
+            sendbuf = [seg[q0:q1], dtype]
+            if root is None:
+                recvbuf = [self._recv_seg[p0+q0:p0+q1], dtype]
+                req = comm.Iallreduce(sendbuf, recvbuf, op)
+            elif rank == root:
+                recvbuf = [self._recv_seg[p0+q0:p0+q1], dtype]
+                req = comm.Ireduce(sendbuf, recvbuf, op, root)
+            else:
+                req = comm.Ireduce(sendbuf, None, op, root)
+            # The segment has to be kept until the request is completed
+            self._pending.append((req, seg))
+        self.offset = p1
+
+        while len(self._pending) > self.depth:
+            self._pending.popleft()[0].Wait()
+        return self
+
+    def wait(self):
+        '''Complete the reduction.  The reduced array is returned on root
+        (on all processes if root is None).  None is returned on the other
+        processes.'''
+        _assert(self.offset == self.size)
+        while self._pending:
+            self._pending.popleft()[0].Wait()
+        return self.recvbuf
+
+class Channel(object):
+    '''A typed channel for the collective operations which repeatedly
+    transfer arrays of the same shapes (e.g. the Fock matrix in SCF
+    iterations, the T1 amplitudes or the DIIS matrix).
+
+    The shapes, dtypes, counts and displacements are exchanged in the first
+    call of each operation and cached in the channel.  The following calls
+    only transfer the array data.  All processes have to issue the operations
+    of a channel in the same order.  For bcast, gather and allgather, the
+    shapes and dtypes have to be the same for every call of the channel
+    (a new channel should be used for each array).  reduce and allreduce
+    can be called with arrays of different shapes.  Only the shape of the
+    last reduction is kept, a new shape is checked again.  Call reset() (on
+    all processes) to renegotiate the metadata.
+    '''
+    def __init__(self, key=None):
+        self.key = key
+        self._plans = {}
+
+    def reset(self):
+        self._plans.clear()
+        return self
+
+    def _plan(self, key, local_meta, negotiate):
+        if key in self._plans:
+            plan, meta = self._plans[key]
+            _assert(meta == local_meta)
+        else:
+            plan = negotiate()
+            self._plans[key] = (plan, local_meta)
+        return plan
+
+    @profiler.instrument('channel.bcast', _wait_for_peers, sendbuf=1)
+    def bcast(self, buf, root=0, hierarchical=None):
+        buf = numpy.asarray(buf, order='C')
+        if rank == root:
+            meta = (buf.shape, buf.dtype.char)
+        else:
+            meta = None
+        shape, dtype = self._plan(('bcast', root), meta,
+                                  lambda: comm.bcast(meta, root))
+        return _bcast(buf, shape, dtype, root, hierarchical)
+
+    @profiler.instrument('channel.ibcast', sendbuf=1)
+    def ibcast(self, buf, root=0):
+        buf = numpy.asarray(buf, order='C')
+        if rank == root:
+            meta = (buf.shape, buf.dtype.char)
+        else:
+            meta = None
+        shape, dtype = self._plan(('ibcast', root), meta,
+                                  lambda: comm.bcast(meta, root))
+        return _ibcast(buf, shape, dtype, root)
+
+    def _check_reduce(self, key, sendbuf, root=0, group=None):
+        # Every process holds the shape of the reduced array.  The metadata
+        # is only exchanged to check the consistency.  Only the last checked
+        # shape is cached for each operation, so that the cache does not grow
+        # with the shapes served by a channel.  The size of the group is a
+        # part of the key, so that the processes of a group (the first
+        # processes, see active_comm) and the other processes agree on the
+        # cached entries.
+        if group is None:
+            group = comm
+        meta = (sendbuf.shape, sendbuf.dtype.char)
+        key = (key, group.Get_size())
+        if key not in self._plans or self._plans[key][1] != meta:
+            ref = group.bcast(meta, root)
+            _assert(ref == meta)
+            self._plans[key] = (ref, meta)
+
+    @profiler.instrument('channel.reduce', _wait_for_peers, sendbuf=1)
+    def reduce(self, sendbuf, op=MPI.SUM, root=0, out=None, inplace=False,
+               hierarchical=None, group=None):
+        '''See mpi.reduce for the keyword argument group'''
+        sendbuf = numpy.asarray(sendbuf, order='C')
+        self._check_reduce(('reduce', root), sendbuf, root, group)
+        return _reduce(sendbuf, op, root, out, inplace, hierarchical, group)
+
+    @profiler.instrument('channel.allreduce', _wait_for_peers, sendbuf=1)
+    def allreduce(self, sendbuf, op=MPI.SUM, out=None, inplace=False,
+                  hierarchical=None):
+        sendbuf = numpy.asarray(sendbuf, order='C')
+        self._check_reduce('allreduce', sendbuf)
+        return _allreduce(sendbuf, op, out, inplace, hierarchical)
+
+    @profiler.instrument('channel.ireduce', sendbuf=1)
+    def ireduce(self, sendbuf, op=MPI.SUM, root=0, out=None, inplace=False,
+                hierarchical=None):
+        sendbuf = numpy.asarray(sendbuf, order='C')
+        self._check_reduce(('ireduce', root), sendbuf, root)
+        return _ireduce(sendbuf, op, root, out, inplace, hierarchical)
+
+    @profiler.instrument('channel.iallreduce', sendbuf=1)
+    def iallreduce(self, sendbuf, op=MPI.SUM, out=None, inplace=False,
+                   hierarchical=None):
+        sendbuf = numpy.asarray(sendbuf, order='C')
+        self._check_reduce('iallreduce', sendbuf)
+        return _iallreduce(sendbuf, op, out, inplace, hierarchical)
+
+    @profiler.instrument('channel.gather', _wait_for_peers, sendbuf=1)
+    def gather(self, sendbuf, root=0, split_recvbuf=False):
+        sendbuf = numpy.asarray(sendbuf, order='C')
+        meta = (sendbuf.shape, sendbuf.dtype.char)
+        plan = self._plan(('gather', root), meta,
+                          lambda: _gather_plan(comm.allgather(meta)))
+        _assert(sendbuf.dtype == plan[3] or sendbuf.size == 0)
+        return _gather(sendbuf, plan, root, split_recvbuf)
+
+    @profiler.instrument('channel.allgather', _wait_for_peers, sendbuf=1)
+    def allgather(self, sendbuf, split_recvbuf=False):
+        sendbuf = numpy.asarray(sendbuf, order='C')
+        meta = (sendbuf.shape, sendbuf.dtype.char)
+        plan = self._plan('allgather', meta,
+                          lambda: _gather_plan(comm.allgather(meta)))
+        _assert(sendbuf.dtype.char == plan[3] or sendbuf.size == 0)
+        return _allgather(sendbuf, plan, split_recvbuf)
+
+_channels = {}
+def channel(key):
+    '''The Channel associated to the key.  The key should include the
+    dimensions of the transferred arrays, e.g. ('ccsd.t1', nocc, nvir), so
+    that a new channel is created when the problem size is changed.
+    '''
+    if key not in _channels:
+        _channels[key] = Channel(key)
+    return _channels[key]
+
 def _assert(condition):
     if not condition:
         sys.stderr.write(''.join(traceback.format_stack()[:-1]))
@@ -461,46 +1976,153 @@ def del_registry(reg_procs):
             from mpi4pyscf.tools import mpi
             mpi._registry.pop(reg_procs[mpi.rank])
         pool.apply(f, (reg_procs,), (reg_procs,))
+        _sync_states.pop(tuple(reg_procs), None)
     return []
 
+# Mole and Cell objects are sent to workers by the references to a cache of
+# MOLE_CACHE_SIZE objects on workers.  The objects are identified by the hash
+# of their content.  The content is only sent when workers do not hold the
+# object.  The master keeps the keys of the cache and evicts them in the same
+# order as workers.
+MOLE_CACHE_SIZE = getattr(__config__, 'mpi_mole_cache_size', 8)
+_mole_cache = collections.OrderedDict()
+
+class _MoleRef(object):
+    '''A reference to a Mole/Cell object in the cache of workers.  data is
+    the content of the object if it is not cached on workers.'''
+    def __init__(self, key, data=None):
+        self.key = key
+        self.data = data
+
+def _mole_data(mol):
+    '''The compact form of a Mole/Cell object: the integral environments
+    _atm, _bas, _env, _ecpbas and the pickled remaining attributes'''
+    arrays = dict((k, numpy.asarray(getattr(mol, k)))
+                  for k in ('_atm', '_bas', '_env', '_ecpbas')
+                  if getattr(mol, k, None) is not None)
+    attrs = dict((k, v) for k, v in mol.__dict__.items()
+                 if k not in arrays and k not in ('stdout', 'output'))
+    return mol.__class__, arrays, pickle.dumps(attrs, protocol=pickle.HIGHEST_PROTOCOL)
+
+def _mole_ref(mol):
+    data = _mole_data(mol)
+    cls, arrays, attrs = data
+    h = hashlib.blake2b(digest_size=16)
+    h.update(('%s.%s' % (cls.__module__, cls.__name__)).encode())
+    for k, v in sorted(arrays.items()):
+        h.update(k.encode())
+        h.update(numpy.ascontiguousarray(v).data)
+    h.update(attrs)
+    key = h.digest()
+    if key in _mole_cache:
+        _mole_cache.move_to_end(key)
+        return _MoleRef(key)
+    _mole_cache[key] = None
+    while len(_mole_cache) > MOLE_CACHE_SIZE:
+        _mole_cache.popitem(last=False)
+    return _MoleRef(key, data)
+
+def _mole_from_ref(ref):
+    '''A Mole/Cell object from the cache of workers.  The caller gets its own
+    copy (with its own integral environments), so that modifications of the
+    object (set_range_coulomb, build, ...) do not leak into the other
+    objects created from the same cache entry.'''
+    if ref.data is None:
+        _mole_cache.move_to_end(ref.key)
+        mol = _mole_cache[ref.key]
+    else:
+        cls, arrays, attrs = ref.data
+        mol = cls.__new__(cls)
+        mol.__dict__.update(pickle.loads(attrs))
+        mol.__dict__.update(arrays)
+        mol.output = None
+        mol.stdout = sys.stdout
+        _mole_cache[ref.key] = mol
+        while len(_mole_cache) > MOLE_CACHE_SIZE:
+            _mole_cache.popitem(last=False)
+
+    mol = copy.copy(mol)
+    for key in ('_atm', '_bas', '_env', '_ecpbas'):
+        if isinstance(getattr(mol, key, None), numpy.ndarray):
+            setattr(mol, key, getattr(mol, key).copy())
+    return mol
+
+def bcast_mole(mol):
+    '''Broadcast a Mole or Cell object from root.  Workers get the object
+    from their cache if they hold the same object.'''
+    if rank == 0:
+        comm.bcast(_mole_ref(mol))
+    else:
+        mol = _mole_from_ref(comm.bcast(None))
+    return mol
+
+# The caches of the systems (the direct SCF screening tables, the J/K job
+# lists, the DFT grids, ...) are kept on each process for SYSTEM_CACHE_SIZE
+# systems after the objects which built them are released.  It is used by
+# the service mode to share the caches between the jobs of the same system.
+# 0 to disable.
+SYSTEM_CACHE_SIZE = getattr(__config__, 'mpi_system_cache_size', 0)
+_system_caches = collections.OrderedDict()
+
+def system_cache(mol):
+    '''The dict of the caches of the system mol on this process, or None if
+    the caches of the systems are disabled (SYSTEM_CACHE_SIZE = 0).
+
+    The system is identified by the integral environments of mol (except
+    the range-separation parameter), which are the same on all processes.
+    The caches of the least recently used systems are evicted when a new
+    system arrives.  The processes may hold different cache entries (e.g.
+    an entry is only created on the processes which run a calculation), so
+    the decisions based on the cache which lead to collective operations
+    have to be agreed on all processes.
+    '''
+    if SYSTEM_CACHE_SIZE <= 0:
+        return None
+    from pyscf.gto.mole import PTR_RANGE_OMEGA
+    env = numpy.array(mol._env)
+    env[PTR_RANGE_OMEGA] = 0
+    h = hashlib.blake2b(digest_size=16)
+    for arr in (mol._atm, mol._bas, env, getattr(mol, '_ecpbas', None)):
+        if arr is not None:
+            h.update(numpy.ascontiguousarray(arr).data)
+    key = h.digest()
+    if key in _system_caches:
+        _system_caches.move_to_end(key)
+    else:
+        _system_caches[key] = {}
+        while len(_system_caches) > SYSTEM_CACHE_SIZE:
+            _system_caches.popitem(last=False)
+    return _system_caches[key]
+
 def _init_on_workers(module, name, args, kwargs):
     import importlib
-    from pyscf.gto import mole
-    from pyscf.pbc.gto import cell
     from mpi4pyscf.tools import mpi
     if args is None and kwargs is None:  # Not to call __init__ function on workers
         if module is None:  # master proccess
             obj = name
             if hasattr(obj, 'cell'):
-                mol_str = obj.cell.dumps()
+                mol_attr = 'cell'
             elif hasattr(obj, 'mol'):
-                mol_str = obj.mol.dumps()
+                mol_attr = 'mol'
             else:
-                mol_str = None
-            mpi.comm.bcast((mol_str, obj.pack()))
+                mol_attr = None
+            mpi.comm.bcast((mol_attr, obj.pack()))
+            if mol_attr is not None:
+                mpi.bcast_mole(getattr(obj, mol_attr))
         else:
             cls = getattr(importlib.import_module(module), name)
             obj = cls.__new__(cls)
-            mol_str, obj_attr = mpi.comm.bcast(None)
+            mol_attr, obj_attr = mpi.comm.bcast(None)
             obj.unpack_(obj_attr)
-            if mol_str is not None:
-                if '"ke_cutoff"' in mol_str:
-                    obj.cell = cell.loads(mol_str)
-                elif '_bas' in mol_str:
-                    obj.mol = mole.loads(mol_str)
+            if mol_attr is not None:
+                setattr(obj, mol_attr, mpi.bcast_mole(None))
 
     elif module is None:  # master proccess
         obj = name
 
     else:
-        # Guess whether the args[0] is the serialized mole or cell objects
-        if isinstance(args[0], str) and args[0][0] == '{':
-            if '"ke_cutoff"' in args[0]:
-                c = cell.loads(args[0])
-                args = (c,) + args[1:]
-            elif '_bas' in args[0]:
-                m = mole.loads(args[0])
-                args = (m,) + args[1:]
+        if isinstance(args[0], mpi._MoleRef):
+            args = (mpi._mole_from_ref(args[0]),) + args[1:]
         cls = getattr(importlib.import_module(module), name)
         obj = cls(*args, **kwargs)
 
@@ -521,11 +2143,14 @@ if rank == 0:
 # * hasattr(obj, '_reg_procs') to ensure class is created only once
 # * If class initialized in mpi session, bypass the distributing step
             if pool.worker_status == 'P' and not hasattr(obj, '_reg_procs'):
+                # The arguments for workers (_mole_ref) must be built after
+                # the calls launched by submit
+                pool.join()
                 cls = obj.__class__
                 if len(args) > 0 and isinstance(args[0], mole.Mole):
                     regs = pool.apply(_init_on_workers, (None, obj, args, kwargs),
                                       (cls.__module__, cls.__name__,
-                                       (args[0].dumps(),)+args[1:], kwargs))
+                                       (_mole_ref(args[0]),)+args[1:], kwargs))
                 elif with__init__:
                     regs = pool.apply(_init_on_workers, (None, obj, args, kwargs),
                                       (cls.__module__, cls.__name__, args, kwargs))
@@ -561,39 +2186,79 @@ else:
     def register_class_without__init__(cls):
         return cls
 
-def _distribute_call(module, name, reg_procs, args, kwargs):
-    import importlib
+_dispatch_ids = {}    # master: (module, name) -> id
+_dispatch_table = {}  # workers: id -> function
+def _dispatch_key(f):
+    '''The key of the parallel function f for workers.  The module and the
+    name of the function are only sent in the first call.'''
+    key = (f.__module__, f.__name__)
+    if key in _dispatch_ids:
+        return _dispatch_ids[key]
+    func_id = _dispatch_ids[key] = len(_dispatch_ids)
+    return (func_id,) + key
+
+def _dispatched_function(key):
+    if isinstance(key, tuple):
+        import importlib
+        func_id, module, name = key
+        _dispatch_table[func_id] = getattr(importlib.import_module(module), name)
+        key = func_id
+    return _dispatch_table[key]
+
+def _distribute_call(module, name, reg_procs, args, kwargs, shared_args=None):
+    from mpi4pyscf.tools import mpi
     dev = reg_procs
     if module is None:  # Master process
         fn = name
     else:
-        fn = getattr(importlib.import_module(module), name)
+        # module is the key returned by _dispatch_key
+        fn = mpi._dispatched_function(module)
         if dev is None:
             pass
-        elif isinstance(dev, str) and dev[0] == '{':
-            # Guess whether dev is Mole or Cell, then deserialize dev
-            from pyscf.gto import mole
-            from pyscf.pbc.gto import cell
-            if '"ke_cutoff"' in dev:
-                dev = cell.loads(dev)
-            elif '_bas' in dev:
-                dev = mole.loads(dev)
+        elif isinstance(dev, mpi._MoleRef):
+            dev = mpi._mole_from_ref(dev)
         else:
-            from mpi4pyscf.tools import mpi
             dev = mpi._registry[reg_procs[mpi.rank]]
-    return fn(dev, *args, **kwargs)
+    if not shared_args:
+        return fn(dev, *args, **kwargs)
+
+    # The skipped arrays are broadcast here, so that one copy of each array
+    # is kept in the shared memory of each node.  They are released when fn
+    # returns.
+    args = list(args)
+    shared = []
+    try:
+        for k in shared_args:
+            if k-1 < len(args):
+                args[k-1] = mpi.bcast_tagged_array(args[k-1], shared=True)
+                if isinstance(args[k-1], numpy.ndarray):
+                    shared.append(args[k-1])
+        return fn(dev, *args, **kwargs)
+    finally:
+        for arr in shared:
+            mpi.free_shared(arr)
 
 if rank == 0:
-    def parallel_call(fn=None, skip_args=None, skip_kwargs=None):
+    def parallel_call(fn=None, skip_args=None, skip_kwargs=None,
+                      shared_args=None):
         '''
         Kwargs:
             skip_args (list of ints): the argument indices in the args list.
                 The arguments specified in skip_args will be skipped when
-                broadcasting f's args.
+                broadcasting f's args.  Large arrays in the args are
+                broadcast out of band by the pool (see MPIPool.apply).  They
+                do not need to be skipped.
 
             skip_kwargs (list of keys): the names in the kwargs dict.
                 The keys specified in skip_kwargs will be skipped when
                 broadcasting f's kwargs.
+
+            shared_args (list of ints): the indices of the skipped arguments
+                which are broadcast from master to the shared memory of each
+                node (see bcast_shared) when the call is dispatched by the
+                pool.  f receives the node-shared arrays, which are read-only
+                and released when f returns.  Direct calls (on all processes
+                in a parallel function) pass the arguments unchanged.
         '''
         def mpi_map(f):
             def with_mpi(dev, *args, **kwargs):
@@ -601,10 +2266,15 @@ if rank == 0:
                     # A direct call if worker is not in pending mode
                     return f(dev, *args, **kwargs)
                 else:
-                    return pool.apply(_distribute_call, (None, f, dev, args, kwargs),
-                                      (f.__module__, f.__name__, _dev_for_worker(dev),
+                    # _dispatch_key and _dev_for_worker update the caches of
+                    # master. They must run after the calls launched by submit.
+                    pool.join()
+                    return pool.apply(_distribute_call,
+                                      (None, f, dev, args, kwargs, shared_args),
+                                      (_dispatch_key(f), None, _dev_for_worker(dev),
                                        _update_args(args, skip_args),
-                                       _update_kwargs(kwargs, skip_kwargs)))
+                                       _update_kwargs(kwargs, skip_kwargs),
+                                       shared_args))
             with_mpi.__doc__ = f.__doc__
             return with_mpi
 
@@ -633,7 +2303,8 @@ if rank == 0:
         return kwargs
 
 else:
-    def parallel_call(fn=None, skip_args=None, skip_kwargs=None):
+    def parallel_call(fn=None, skip_args=None, skip_kwargs=None,
+                      shared_args=None):
         if fn is None:
             return lambda f: f
         else:
@@ -658,9 +2329,12 @@ if rank == 0:
                 if pool.size <= 1 or pool.worker_status == 'R':
                     return f(dev, *args, **kwargs)
                 else:
+                    # _dispatch_key and _dev_for_worker update the caches of
+                    # master. They must run after the calls launched by submit.
+                    pool.join()
                     return pool.apply(_distribute_call,
                                       (None, _merge_yield(f), dev, args, kwargs),
-                                      (f.__module__, f.__name__, _dev_for_worker(dev),
+                                      (_dispatch_key(f), None, _dev_for_worker(dev),
                                        _update_args(args, skip_args),
                                        _update_kwargs(kwargs, skip_kwargs)))
             with_mpi.__doc__ = f.__doc__
@@ -700,8 +2374,11 @@ if rank == 0:
                 if pool.size <= 1 or pool.worker_status == 'R':
                     return f(dev, *args, **kwargs)
                 else:
+                    # _dispatch_key and _dev_for_worker update the caches of
+                    # master. They must run after the calls launched by submit.
+                    pool.join()
                     return pool.apply(_reduce_call, (None, f, dev, args, kwargs),
-                                      (f.__module__, f.__name__, _dev_for_worker(dev),
+                                      (_dispatch_key(f), None, _dev_for_worker(dev),
                                        _update_args(args, skip_args),
                                        _update_kwargs(kwargs, skip_kwargs)))
             with_mpi.__doc__ = f.__doc__
@@ -719,12 +2396,30 @@ else:
         else:
             return fn
 
+def submit(fn, *args, **kwargs):
+    '''Launch the parallel function fn (decorated by parallel_call,
+    call_then_reduce etc.) asynchronously.  See MPIPool.submit.
+
+    Returns:
+        A concurrent.futures.Future of the result of fn
+    '''
+    return pool.submit(fn, *args, **kwargs)
+
+def require_parallel_call(name):
+    '''Raise RuntimeError unless the caller runs on all processes, i.e. in a
+    function launched by pool.apply (or a parallel_call).  It is checked on
+    master before any communication, so that the error does not leave the
+    workers waiting in the collective operations.'''
+    if pool.size > 1 and pool.worker_status != 'R':
+        raise RuntimeError('%s should be called on all processes inside a '
+                           'parallel function (see mpi.pool.apply)' % name)
+
 def _dev_for_worker(dev):
     '''The first argument (dev) to be sent to workers'''
     if hasattr(dev, '_reg_procs'):
         return dev._reg_procs
     elif isinstance(dev, mole.Mole):
-        return dev.dumps()
+        return _mole_ref(dev)
     else:
         return dev
 
@@ -746,6 +2441,52 @@ def prange(start, stop, step):
         i1 = min(stop, i0 + step)
         yield i0, i1
 
+def farm(jobs, group_size=None, chunksize=1):
+    '''Run independent calculations concurrently in the process groups.
+
+    Each job is a function without arguments.  It is executed on the master
+    of one group and can use the MPI classes (scf, dft, cc, ...), which run
+    on the processes of that group.  The jobs are dynamically assigned to
+    the groups.  All group masters should call farm with the same jobs.
+
+    The results (which should be picklable) are returned in the order of jobs
+    on the master of group 0.  The masters of the other groups exit after
+    farm, like the worker processes after the first parallel call.
+
+    Kwargs:
+        group_size : int
+            The expected number of processes in each group.  The groups are
+            formed when this module is imported (see GROUP_SIZE).
+            RuntimeError is raised if the groups have a different size.
+    '''
+    if group_size is not None:
+        nproc = world.Get_size()
+        actual_size = GROUP_SIZE if ngroups > 1 else nproc
+        if min(group_size, nproc) != actual_size:
+            raise RuntimeError('farm with group_size=%d but the processes were '
+                               'split into groups of %d processes.  Set '
+                               'MPI4PYSCF_GROUP_SIZE=%d before starting the '
+                               'program' % (group_size, actual_size, group_size))
+    if not pool.is_master():
+        # Workers serve the parallel calls of their group master
+        pool.wait()
+        sys.exit(0)
+
+    if _leader_comm is None:
+        return [job() for job in jobs]
+
+    results = {}
+    for job_id in _counter_partition(range(len(jobs)), chunksize, False,
+                                     _leader_comm):
+        results[job_id] = jobs[job_id]()
+
+    all_results = _leader_comm.gather(results, root=0)
+    if _leader_comm.Get_rank() != 0:
+        sys.exit(0)
+    for x in all_results[1:]:
+        results.update(x)
+    return [results[i] for i in range(len(jobs))]
+
 def platform_info():
     def info():
         import platform
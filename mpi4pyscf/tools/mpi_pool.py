@@ -10,11 +10,42 @@ __all__ = ["MPIPool", "MPIPoolException"]
 
 import os
 import sys
+import time
 import types
+import io
+import pickle
 import importlib
 import marshal
 import traceback
+import threading
+from concurrent import futures
+import numpy
 from mpi4py import MPI
+from . import profiler
+from pyscf import __config__
+
+# Arrays (buffers) larger than this (in bytes) in the arguments of apply are
+# broadcast out of band, without being copied into the pickle stream.  It
+# requires pickle protocol 5 (Python 3.8).  The arguments are pickled in band
+# with the older versions.
+OOB_THRESHOLD = 1 << 16
+_OOB_SUPPORTED = pickle.HIGHEST_PROTOCOL >= 5
+_OOB_BLKSIZE = 1 << 30
+
+# How the workers wait for the next task between the parallel calls.
+#   'busy': blocking bcast. Most MPI implementations busy-poll in it.
+#   'backoff': poll a non-blocking barrier and sleep between the tests. The
+#       sleep time grows from IDLE_MIN_SLEEP to IDLE_MAX_SLEEP (in seconds).
+#   'barrier': wait on a non-blocking barrier. The core is released if the
+#       MPI library waits without polling (e.g. Open MPI with
+#       mpi_yield_when_idle).
+# In the 'backoff' and 'barrier' mode, idle workers leave their cores to the
+# threads of the master (and the other processes on the same node). The mode
+# must be the same on all processes.
+IDLE_MODE = os.environ.get('MPI4PYSCF_IDLE_MODE',
+                           getattr(__config__, 'mpi_idle_mode', 'busy'))
+IDLE_MIN_SLEEP = getattr(__config__, 'mpi_idle_min_sleep', 1e-4)
+IDLE_MAX_SLEEP = getattr(__config__, 'mpi_idle_max_sleep', 1e-2)
 
 
 class MPIPool(object):
@@ -34,14 +65,40 @@ class MPIPool(object):
 
     debug : bool (optional)
         If ``True``, print out a lot of status updates at each step.
+
+    idle_mode : str (optional)
+        How the workers wait for tasks, see IDLE_MODE.
     """
-    def __init__(self, comm=None, debug=False):
+    def __init__(self, comm=None, debug=False, idle_mode=None):
         self.comm = MPI.COMM_WORLD if comm is None else comm
         self.rank = self.comm.Get_rank()
         self.size = self.comm.Get_size()
         self.debug = debug
+        if idle_mode is None:
+            idle_mode = IDLE_MODE
+        if idle_mode not in ('busy', 'backoff', 'barrier'):
+            raise ValueError('Unknown idle mode %s' % idle_mode)
+        self.idle_mode = idle_mode
+        self._wakeup_request = None
         self.function = _error_function
+        # worker_status is recorded for each thread. A function launched by
+        # submit runs in the thread of the pool while the caller is pending.
+        self._local = threading.local()
         self.worker_status = 'P'  # : R = running, P = pending
+        # The thread to run the functions launched by submit
+        self._executor = None
+        self._pending = None
+        # The futures of submit which raised exceptions
+        self.failed_calls = []
+        # Functions called on all processes when the pool is closed
+        self.close_callbacks = []
+        # Dispatch table. The code of a function is sent to the workers once.
+        # Then a call only sends the function id with the arguments.
+        self._function_ids = {}  # master: code object -> id
+        self._functions = {}     # workers: id -> function
+        # Number of calls and the time spent by the master to dispatch them
+        self.dispatch_count = 0
+        self.dispatch_time = 0.
 
         if self.debug:
             import platform
@@ -51,6 +108,13 @@ class MPIPool(object):
             else:
                 print('Worker: host {0} PID {1}'.format(node, os.getpid()))
 
+    @property
+    def worker_status(self):
+        return getattr(self._local, 'worker_status', 'P')
+    @worker_status.setter
+    def worker_status(self, status):
+        self._local.worker_status = status
+
     def is_master(self):
         """
         Is the current process the master?
@@ -75,6 +139,7 @@ class MPIPool(object):
                 print("Worker {0} waiting for task.".format(self.rank))
 
             # Blocking receive to wait for instructions.
+            self._idle()
             task = self.comm.bcast(None)
             if self.debug:
                 print("Worker {0} got task {1}.".format(self.rank, task))
@@ -84,6 +149,7 @@ class MPIPool(object):
             if isinstance(task, _close_pool_message):
                 if self.debug:
                     print("Worker {0} close.".format(self.rank))
+                self._run_close_callbacks()
 # Handle global import lock for multithreading, see
 #   http://stackoverflow.com/questions/12389526/import-inside-of-a-python-thread
 #   https://docs.python.org/3.4/library/imp.html#imp.lock_held
@@ -101,14 +167,16 @@ class MPIPool(object):
                 code = marshal.loads(task.func_code)
 
                 if self.debug:
-                    print('function {0}'.format(code))
-                    print("Worker {0} replaced its task function: {1}."
-                          .format(self.rank, self.function))
-                self.function = types.FunctionType(code, globals())
-
-            else:  # message are function args
+                    print('function {0} registered as {1}'.format(code, task.func_id))
+                self._functions[task.func_id] = types.FunctionType(code, globals())
+
+            else:  # message are function id and args
+                func_id, args = task
+                if isinstance(args, _oob_message):
+                    args = self._recv_oob(args)
+                self.function = self._functions[func_id]
                 self.worker_status = 'R'
-                ans = self.function(*task)  # task = worker_args
+                ans = self.function(*args)
                 if isinstance(ans, types.GeneratorType):
                     print('\nWARNING\n  Function {0} returns generator {1}.\n'
                           '  The generator was consumed to avoid workers getting stuck.\n'
@@ -123,25 +191,118 @@ class MPIPool(object):
             self.wait()
             exit(0)
 
-        if function is not self.function:
+        # Keep the order of the calls launched by submit
+        self.join()
+
+        t0 = time.perf_counter()
+        # Closures of the same function share one code object.  They are
+        # identical on workers because the closure is not sent.
+        func_id = self._function_ids.get(function.__code__)
+        if func_id is None:
             if self.debug:
-                print("Master replacing pool function with {0}."
+                print("Master registering pool function {0}."
                       .format(function))
 
-            # Tell all the workers what function to use.
-            self.function = function
-            F = _function_wrapper(function)
-            self.comm.bcast(F)
+            # Tell all the workers the new function.
+            func_id = len(self._function_ids)
+            self._function_ids[function.__code__] = func_id
+            self._bcast_task(_function_wrapper(function, func_id))
 
+        self.function = function
         self.worker_status = 'R'
 
-        # Send all the tasks off and wait for them to be received.
-        self.comm.bcast(worker_args)
+        # Send the function id and all the tasks off
+        self._bcast_oob(func_id, worker_args)
+        dt = time.perf_counter() - t0
+        self.dispatch_count += 1
+        self.dispatch_time += dt
+        if profiler.ENABLED:
+            profiler.stats.record('dispatch', function.__name__, 0, 0, dt, 0.)
 
         result = function(*master_args)
         self.worker_status = 'P'
         return result
 
+    def submit(self, fn, *args, **kwargs):
+        '''Call fn(*args, **kwargs) asynchronously and return a
+        concurrent.futures.Future of the result.  fn is typically a function
+        decorated by mpi.parallel_call.  The master can do serial work while
+        fn is running, e.g.
+
+        >>> vj_future = pool.submit(mf.get_j, mol, dm)
+        >>> h1e = mf.get_hcore(mol)
+        >>> vj = vj_future.result()
+
+        The functions launched by submit are executed one at a time in the
+        order of submission.  apply (thus any parallel call of the caller)
+        waits until they are finished.  The caller must not communicate
+        through the communicator of the pool before the future is resolved.
+
+        On workers, or inside a running parallel function, fn is called
+        immediately.
+        '''
+        if not self.is_master() or self.worker_status == 'R':
+            future = futures.Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=1, initializer=self._init_pool_thread)
+        self._pending = self._executor.submit(fn, *args, **kwargs)
+        self._pending.add_done_callback(self._check_call)
+        return self._pending
+
+    def _check_call(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            self.failed_calls.append(future)
+
+    def _init_pool_thread(self):
+        self._local.in_pool_thread = True
+
+    def join(self):
+        '''Wait until the functions launched by submit are finished.  It
+        does nothing in the pool thread, which runs these functions.'''
+        if getattr(self._local, 'in_pool_thread', False):
+            return
+        if self._pending is not None:
+            futures.wait([self._pending])
+            self._pending = None
+
+    def _bcast_oob(self, func_id, worker_args):
+        '''Broadcast the arguments with pickle protocol 5.  Large arrays
+        (including the arrays in the attributes of tagged arrays) are
+        sent by Bcast out of band.'''
+        if not _OOB_SUPPORTED:
+            self._bcast_task((func_id, worker_args))
+            return
+
+        buffers = []
+        def buffer_callback(buf):
+            if buf.raw().nbytes < OOB_THRESHOLD:
+                return True  # serialized in band
+            buffers.append(buf)
+            return False
+
+        stream = io.BytesIO()
+        _OOBPickler(stream, protocol=5, buffer_callback=buffer_callback).dump(worker_args)
+        raws = [buf.raw() for buf in buffers]
+        self._bcast_task((func_id, _oob_message(stream.getvalue(),
+                                                [x.nbytes for x in raws])))
+        for raw in raws:
+            _bcast_bytes(self.comm, raw)
+
+    def _recv_oob(self, msg):
+        buffers = []
+        for nbytes in msg.nbytes:
+            buf = numpy.empty(nbytes, dtype=numpy.uint8)
+            _bcast_bytes(self.comm, buf)
+            buffers.append(buf)
+        return pickle.loads(msg.payload, buffers=buffers)
+
     def close(self):
         """
         Just send a message off to all the pool members which contains
@@ -149,9 +310,46 @@ class MPIPool(object):
 
         """
         if self.is_master():
-            self.comm.bcast(_close_pool_message())
+            self.join()
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+            self._bcast_task(_close_pool_message())
+            if self._wakeup_request is not None:
+                self._wakeup_request.Wait()
+                self._wakeup_request = None
             if self.debug:
                 print('master close')
+            self._run_close_callbacks()
+
+    def _idle(self):
+        '''Wait on workers until the master sends the next task'''
+        if self.idle_mode == 'busy':
+            return
+        req = self.comm.Ibarrier()
+        if self.idle_mode == 'barrier':
+            req.Wait()
+        else:
+            delay = IDLE_MIN_SLEEP
+            while not req.Test():
+                time.sleep(delay)
+                delay = min(delay * 2, IDLE_MAX_SLEEP)
+
+    def _bcast_task(self, task):
+        '''Broadcast a message to the workers waiting in the event loop'''
+        if self.idle_mode != 'busy':
+            # Wake up the workers.  The barrier of the previous message
+            # is completed by now (the workers joined it before receiving
+            # the previous message).
+            if self._wakeup_request is not None:
+                self._wakeup_request.Wait()
+            self._wakeup_request = self.comm.Ibarrier()
+        self.comm.bcast(task)
+
+    def _run_close_callbacks(self):
+        callbacks, self.close_callbacks = self.close_callbacks, []
+        for callback in callbacks:
+            callback()
 
     def __enter__(self):
         return self
@@ -165,10 +363,41 @@ class _close_pool_message(object):
         return "<Close pool message>"
 
 
+class _oob_message(object):
+    '''The pickled arguments and the sizes of the out-of-band buffers'''
+    def __init__(self, payload, nbytes):
+        self.payload = payload
+        self.nbytes = nbytes
+
+
+class _OOBPickler(pickle.Pickler):
+    # numpy only supports out-of-band pickling for the base ndarray class.
+    # Subclasses (e.g. lib.NPArrayWithTag) are pickled as a view of the base
+    # class plus the attributes.
+    def reducer_override(self, obj):
+        if (isinstance(obj, numpy.ndarray) and type(obj) is not numpy.ndarray
+                and obj.nbytes >= OOB_THRESHOLD):
+            return _rebuild_array, (obj.view(numpy.ndarray), type(obj),
+                                    getattr(obj, '__dict__', None))
+        return NotImplemented
+
+def _rebuild_array(arr, cls, attrs):
+    obj = arr.view(cls)
+    if attrs:
+        obj.__dict__.update(attrs)
+    return obj
+
+def _bcast_bytes(comm, buf):
+    buf = memoryview(buf).cast('B')
+    for p0 in range(0, buf.nbytes, _OOB_BLKSIZE):
+        comm.Bcast([buf[p0:p0+_OOB_BLKSIZE], MPI.BYTE], root=0)
+
+
 class _function_wrapper(object):
-    def __init__(self, function):
+    def __init__(self, function, func_id=None):
         #print(function.__closure__)
         self.func_code = marshal.dumps(function.__code__)
+        self.func_id = func_id
 
 def _error_function(task):
     raise RuntimeError("Pool was sent tasks before being told what "
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+'''
+Instrumentation of the communication functions.
+
+The profiler is enabled by the environment variable MPI4PYSCF_PROFILE=1.
+For every communication function of tools.mpi (and the raw communicator
+calls of the modules which use profiled_comm), the number of calls, the
+bytes sent and received, the wall time and the time blocked waiting for the
+peers are recorded for each call site on each process.  The time waiting
+for the peers of a collective operation is measured by a barrier in front
+of the operation, which only exists when the profiler is enabled.  Rank 0
+prints the aggregated report when the pool is closed.
+'''
+
+import os
+import sys
+import time
+import functools
+import threading
+
+ENABLED = os.environ.get('MPI4PYSCF_PROFILE', '0').lower() not in ('', '0', 'false', 'no')
+
+
+def _nbytes(obj):
+    nbytes = getattr(obj, 'nbytes', None)
+    if nbytes is not None:
+        return nbytes
+    if isinstance(obj, (list, tuple)):
+        return sum(_nbytes(x) for x in obj)
+    return 0
+
+def _call_site(frame):
+    code = frame.f_code
+    return '%s:%d(%s)' % (os.path.basename(code.co_filename), frame.f_lineno,
+                          code.co_name)
+
+
+class CommProfiler(object):
+    '''Call counts, transferred bytes and timings of the communications,
+    keyed by (operation, call site)'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.records = {}
+
+    def record(self, name, site, sent, received, wall, wait):
+        with self._lock:
+            rec = self.records.setdefault((name, site), [0, 0, 0, 0., 0.])
+            rec[0] += 1
+            rec[1] += sent
+            rec[2] += received
+            rec[3] += wall
+            rec[4] += wait
+
+    def instrument(self, name, wait=None, sendbuf=0, blocking=False):
+        '''Decorator to record the calls of a communication function.
+
+        Kwargs:
+            wait : callable
+                Called with the arguments of the function before the function
+                is executed.  It should block until the peers are ready (e.g.
+                a barrier for collective operations).  Its time is recorded
+                as the waiting time.
+            sendbuf : int
+                The position of the send buffer in the arguments.  None means
+                that the function does not send data.
+            blocking : bool
+                Whether the entire time of the function is waiting time (e.g.
+                the wait method of non-blocking operations).
+        '''
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                local = self._local
+                # Only the outermost operation is recorded.  The functions
+                # called by it (e.g. the send/recv of rotate) are not.
+                if getattr(local, 'active', False):
+                    return fn(*args, **kwargs)
+
+                site = _call_site(sys._getframe(1))
+                local.active = True
+                try:
+                    t0 = time.perf_counter()
+                    if wait is not None:
+                        wait(*args, **kwargs)
+                    t1 = time.perf_counter()
+                    result = fn(*args, **kwargs)
+                    t2 = time.perf_counter()
+                finally:
+                    local.active = False
+
+                if sendbuf is not None and len(args) > sendbuf:
+                    sent = _nbytes(args[sendbuf])
+                else:
+                    sent = 0
+                if blocking:
+                    t1 = t2
+                self.record(name, site, sent, _nbytes(result), t2-t0, t1-t0)
+                return result
+            return wrapper
+        return decorator
+
+    def report(self, comm, stream=None, per_rank=False):
+        '''Gather the records of all processes and write the summary on
+        rank 0.  It is a collective operation.
+
+        The summary shows the max and mean over the processes, and the rank
+        of the max wall and wait time.  per_rank=True adds the records of
+        each process below each call site.
+        '''
+        all_records = comm.gather(self.records, root=0)
+        if comm.Get_rank() != 0:
+            return
+        if stream is None:
+            stream = sys.stdout
+
+        merged = {}
+        for rank, records in enumerate(all_records):
+            for key, rec in records.items():
+                merged.setdefault(key, []).append((rank, rec))
+
+        def argmax(recs, col):
+            return max(recs, key=lambda x: x[1][col])
+        def max_wall(item):
+            return argmax(item[1], 3)[1][3]
+        lines = ['Communication profile of %d processes (time in seconds, '
+                 'max and mean over processes, rank of the max)' % comm.Get_size(),
+                 '%-12s %-36s %8s %11s %11s %9s %6s %9s %9s %6s %9s' %
+                 ('operation', 'call site', 'calls', 'sent MB', 'recv MB',
+                  'wall max', 'rank', 'wall avg', 'wait max', 'rank', 'wait avg')]
+        for (name, site), recs in sorted(merged.items(), key=max_wall,
+                                         reverse=True):
+            n = len(recs)
+            wall_rank, wall_rec = argmax(recs, 3)
+            wait_rank, wait_rec = argmax(recs, 4)
+            lines.append('%-12s %-36s %8d %11.2f %11.2f %9.3f %6d %9.3f %9.3f %6d %9.3f' %
+                         (name, site, sum(x[0] for r, x in recs),
+                          sum(x[1] for r, x in recs) / 1e6,
+                          sum(x[2] for r, x in recs) / 1e6,
+                          wall_rec[3], wall_rank, sum(x[3] for r, x in recs) / n,
+                          wait_rec[4], wait_rank, sum(x[4] for r, x in recs) / n))
+            if per_rank:
+                for rank, x in recs:
+                    lines.append('    rank %-6d %-33s %8d %11.2f %11.2f %9.3f %6s %9s %9.3f' %
+                                 (rank, '', x[0], x[1] / 1e6, x[2] / 1e6,
+                                  x[3], '', '', x[4]))
+        stream.write('\n'.join(lines) + '\n')
+        stream.flush()
+
+stats = CommProfiler()
+
+def instrument(name, wait=None, sendbuf=0, blocking=False):
+    '''Decorator to record the calls in stats when the profiler is enabled.
+    The function is returned unchanged otherwise.'''
+    if not ENABLED:
+        return lambda fn: fn
+    return stats.instrument(name, wait, sendbuf, blocking)
+
+
+class ProfiledComm(object):
+    '''A proxy of the MPI communicator which records the method calls'''
+    def __init__(self, comm, profiler=None):
+        self._comm = comm
+        self._profiler = stats if profiler is None else profiler
+
+    def __getattr__(self, key):
+        attr = getattr(self._comm, key)
+        if callable(attr) and not key.startswith(('_', 'Get_', 'Is_')):
+            attr = self._profiler.instrument('comm.' + key)(attr)
+        return attr
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+'''
+Service mode: a long running MPI job which executes the job scripts
+submitted to a queue directory on the warm worker processes.
+
+Start the service with
+
+    mpirun -np 16 python -m mpi4pyscf.tools.service /path/to/queue
+
+then submit the python scripts with
+
+    python -m mpi4pyscf.tools.service /path/to/queue --submit job.py
+
+(or service.submit_job in python).  The master process executes the scripts
+one at a time in the order of submission.  The output of a job is written to
+<job>.out.  The job script is renamed to <job>.py.done or <job>.py.failed
+when it is finished.  The service is shut down when the file STOP is found
+in the queue directory and no job is pending (see service.stop).
+
+The MPI initialization, the imports, the registration of the parallel
+functions and the Mole/Cell cache of the workers are kept between jobs.  The
+caches of the systems (the direct SCF screening tables, the J/K job lists
+and their measured costs, the semi-direct integrals and the DFT grids, see
+mpi.system_cache) are kept for the last SYSTEM_CACHE_SIZE systems.  The
+next job on the same system reuses them.  They are evicted when other
+systems arrive.  The distributed objects (SCF, CC objects etc.) created by a
+job are released from the registry of the workers when the job is finished.
+A job which fails in the middle of a parallel call (or in a call launched by
+mpi.submit) can leave the workers in an inconsistent state.  The service is
+aborted in this case.
+'''
+
+import os
+import sys
+import time
+import runpy
+import traceback
+import contextlib
+
+from pyscf import __config__
+
+# Time (in seconds) between two scans of the queue directory
+POLL_INTERVAL = getattr(__config__, 'mpi_service_poll_interval', 0.5)
+# The number of the systems whose caches are kept between jobs
+SYSTEM_CACHE_SIZE = getattr(__config__, 'mpi_service_system_cache_size', 1)
+STOP_FILE = 'STOP'
+
+
+def _pending_jobs(queue_dir):
+    jobs = [f for f in os.listdir(queue_dir)
+            if f.endswith('.py') and not f.startswith('.')]
+    return sorted(jobs, key=lambda f: (os.path.getmtime(os.path.join(queue_dir, f)), f))
+
+_persistent_keys = set()
+
+def _snapshot_registry():
+    from mpi4pyscf.tools import mpi
+    from mpi4pyscf.tools import service
+    service._persistent_keys = set(mpi._registry)
+
+def _set_system_cache_size(size):
+    from mpi4pyscf.tools import mpi
+    mpi.SYSTEM_CACHE_SIZE = size
+    while len(mpi._system_caches) > size:
+        mpi._system_caches.popitem(last=False)
+
+def _release_registry():
+    '''Release the objects registered after _snapshot_registry.  The caches
+    of the systems (mpi.system_cache) are kept.'''
+    import gc
+    from mpi4pyscf.tools import mpi
+    from mpi4pyscf.tools import service
+    for key in set(mpi._registry).difference(service._persistent_keys):
+        del mpi._registry[key]
+    mpi._sync_states.clear()
+    gc.collect()
+
+def _run_job(queue_dir, job):
+    from mpi4pyscf.tools import mpi
+    path = os.path.join(queue_dir, job)
+    running = path + '.running'
+    try:
+        # rename is atomic. It claims the job.
+        os.rename(path, running)
+    except OSError:
+        return None
+
+    mpi.pool.apply(_snapshot_registry, (), ())
+    failed = False
+    failed_in_parallel_call = False
+    with open(os.path.join(queue_dir, job[:-3] + '.out'), 'w') as f:
+        with contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+            t0 = time.perf_counter()
+            try:
+                runpy.run_path(running, run_name='__main__')
+            except SystemExit as e:
+                failed = e.code not in (None, 0)
+            except Exception:
+                traceback.print_exc()
+                failed = True
+            failed_in_parallel_call = mpi.pool.worker_status == 'R'
+
+            mpi.pool.join()
+            if mpi.pool.failed_calls:
+                for future in mpi.pool.failed_calls:
+                    e = future.exception()
+                    traceback.print_exception(type(e), e, e.__traceback__)
+                mpi.pool.failed_calls = []
+                failed = failed_in_parallel_call = True
+            sys.stdout.flush()
+            print('Job %s %s in %.2f s' % (job, 'failed' if failed else 'done',
+                                            time.perf_counter() - t0))
+
+    os.rename(running, path + ('.failed' if failed else '.done'))
+    if failed_in_parallel_call:
+        # The job failed in a parallel function. The workers may be blocked
+        # in its communications.
+        mpi.comm.Abort(1)
+    mpi.pool.apply(_release_registry, (), ())
+    return not failed
+
+def serve(queue_dir, poll_interval=None, max_jobs=None):
+    '''Execute the job scripts submitted to queue_dir until the file STOP
+    is found in queue_dir (or max_jobs jobs are executed).
+
+    Returns:
+        The number of the jobs executed.
+    '''
+    from mpi4pyscf.tools import mpi
+    if not mpi.pool.is_master():
+        mpi.pool.wait()
+        return 0
+
+    if poll_interval is None:
+        poll_interval = POLL_INTERVAL
+    if not os.path.isdir(queue_dir):
+        os.makedirs(queue_dir)
+
+    cache_size = mpi.SYSTEM_CACHE_SIZE
+    mpi.pool.apply(_set_system_cache_size, (SYSTEM_CACHE_SIZE,),
+                   (SYSTEM_CACHE_SIZE,))
+    stop_file = os.path.join(queue_dir, STOP_FILE)
+    njobs = 0
+    try:
+        while max_jobs is None or njobs < max_jobs:
+            jobs = _pending_jobs(queue_dir)
+            if jobs:
+                if _run_job(queue_dir, jobs[0]) is not None:
+                    njobs += 1
+            elif os.path.exists(stop_file):
+                os.remove(stop_file)
+                break
+            else:
+                time.sleep(poll_interval)
+    finally:
+        mpi.pool.apply(_set_system_cache_size, (cache_size,), (cache_size,))
+    return njobs
+
+def submit_job(queue_dir, script, name=None):
+    '''Copy the job script to the queue directory.
+
+    Returns:
+        The path of the output file of the job.
+    '''
+    if name is None:
+        name = os.path.splitext(os.path.basename(script))[0]
+    name = '%s_%d' % (name, time.time_ns())
+    with open(script, 'r') as f:
+        content = f.read()
+    # The script is written to a hidden file then moved to the queue, so
+    # that the service does not pick up a partially written file.
+    tmp = os.path.join(queue_dir, '.' + name + '.py')
+    with open(tmp, 'w') as f:
+        f.write(content)
+    os.rename(tmp, os.path.join(queue_dir, name + '.py'))
+    return os.path.join(queue_dir, name + '.out')
+
+def stop(queue_dir):
+    '''Shut down the service after the pending jobs are finished'''
+    open(os.path.join(queue_dir, STOP_FILE), 'w').close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='mpi4pyscf job service')
+    parser.add_argument('queue_dir')
+    parser.add_argument('--submit', nargs='+', metavar='SCRIPT',
+                        help='submit the scripts to a running service')
+    parser.add_argument('--stop', action='store_true',
+                        help='shut down the service')
+    args = parser.parse_args()
+
+    if args.submit or args.stop:
+        for script in args.submit or []:
+            print(submit_job(args.queue_dir, script))
+        if args.stop:
+            stop(args.queue_dir)
+    else:
+        # Workers are suspended in pool.wait when mpi4pyscf is imported
+        serve(args.queue_dir)
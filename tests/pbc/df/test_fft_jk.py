@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+
+import pytest
+import numpy
+from pyscf.pbc import gto as pgto
+from pyscf.pbc.df import fft, fft_jk
+from mpi4pyscf.pbc import df as mpi_df
+from mpi4pyscf.pbc.df import fft_jk as mpi_fft_jk
+
+@pytest.fixture
+def get_cell(scope='module'):
+    cell = pgto.M(atom='He 0 0 0; He 0 0 1', a=numpy.eye(3)*4,
+                  basis='ccpvdz', mesh=[11]*3)
+    return cell
+
+
+def test_jk_kpts_distributed(get_cell):
+    from mpi4pyscf.tools import mpi
+    def jk_blocks(mydf, dm, kpts):
+        from mpi4pyscf.tools import mpi
+        from mpi4pyscf.pbc.df import fft_jk as mpi_fft_jk
+        if mpi.rank != 0:
+            mydf = mpi._registry[mydf[mpi.rank]]
+        vj = mpi_fft_jk.get_j_kpts_distributed(mydf, dm, 1, kpts)
+        vk = mpi_fft_jk.get_k_kpts_distributed(mydf, dm, 1, kpts,
+                                               exxdiv='ewald')
+        return mpi.comm.gather((mpi.rank, vj, vk))
+
+    cell = get_cell
+    nao = cell.nao
+    kpts = cell.make_kpts([2,1,1])
+    numpy.random.seed(1)
+    dm = numpy.random.random((len(kpts),nao,nao))
+    dm = dm + dm.transpose(0,2,1)
+    ref = fft.FFTDF(cell, kpts)
+    vj0 = fft_jk.get_j_kpts(ref, dm, 1, kpts)
+    vk0 = fft_jk.get_k_kpts(ref, dm, 1, kpts, exxdiv='ewald')
+
+    mydf = mpi_df.FFTDF(cell, kpts)
+    blocks = mpi.pool.apply(jk_blocks, (mydf, dm, kpts),
+                            (mydf._reg_procs, dm, kpts))
+    # The blocks of rows gathered from all processes give the replicated
+    # result.  The ewald correction is included once.
+    vj = numpy.zeros_like(vj0)
+    vk = numpy.zeros_like(vk0)
+    for rank, vj_blk, vk_blk in blocks:
+        r0, r1 = mpi.row_blocks(nao)[rank]
+        vj[:,r0:r1] = vj_blk[0]
+        vk[:,r0:r1] = vk_blk[0]
+    assert abs(vj - vj0).max() < 1e-9
+    assert abs(vk - vk0).max() < 1e-9
+
+    if mpi.pool.size > 1:
+        with pytest.raises(RuntimeError):
+            mpi_fft_jk.get_j_kpts_distributed(mydf, dm, 1, kpts)
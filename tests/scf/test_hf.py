@@ -38,6 +38,161 @@ def test_jk(get_mol):
     assert abs(vj0-vj).max() < 1e-9
     assert abs(vk0-vk).max() < 1e-9
 
+    # The node-shared copies of dm are released by the wrapper
+    from mpi4pyscf.tools import mpi
+    assert not mpi._shared_windows
+
+def test_jk_measured_costs(get_mol):
+    mol = get_mol
+    nao = mol.nao
+    numpy.random.seed(2)
+    dm = numpy.random.random((nao,nao))
+    dm = dm + dm.T
+    mf = mpi_scf.RHF(mol)
+    vj0, vk0 = scf.hf.get_jk(mol, dm)
+    # The second call is scheduled with the job costs measured in the first call
+    for i in range(2):
+        vj, vk = mf.get_jk(mol, dm)
+        assert abs(vj0-vj).max() < 1e-9
+        assert abs(vk0-vk).max() < 1e-9
+
+def test_jk_costs_of_copied_object(get_mol):
+    import copy
+    mol = get_mol
+    nao = mol.nao
+    numpy.random.seed(5)
+    dm = numpy.random.random((nao,nao))
+    dm = dm + dm.T
+    mf = mpi_scf.RHF(mol)
+    # mf2 shares the object on workers but not the measured costs
+    mf2 = copy.copy(mf)
+    vj0, vk0 = scf.hf.get_jk(mol, dm)
+    for m in (mf, mf2, mf):
+        vj, vk = m.get_jk(mol, dm)
+        assert abs(vj0-vj).max() < 1e-9
+        assert abs(vk0-vk).max() < 1e-9
+
+def test_jk_distributed(get_mol):
+    from mpi4pyscf.tools import mpi
+    def jk_blocks(mol, dm):
+        import numpy
+        from pyscf import lib, scf
+        from mpi4pyscf.tools import mpi
+        from mpi4pyscf import scf as mpi_scf
+        nao = mol.nao
+        # J and K of hermitian dm are left in the packed layout
+        vj0, vk0 = scf.hf.get_jk(mol, dm)
+        vj, vk = mpi_scf.hf.get_jk_distributed(mol, dm, hermi=1)
+        r0, r1 = mpi.row_blocks(nao, 'packed')[mpi.rank]
+        p0, p1 = r0*(r0+1)//2, r1*(r1+1)//2
+        err = max(abs(vj - lib.pack_tril(vj0)[:,p0:p1]).max(),
+                  abs(vk - lib.pack_tril(vk0)[:,p0:p1]).max())
+        vj = mpi_scf.hf.get_jk_distributed(mol, dm, hermi=1, with_k=False)[0]
+        vk = mpi_scf.hf.get_jk_distributed(mol, dm, hermi=1, with_j=False)[1]
+        err = max(err, abs(vj - lib.pack_tril(vj0)[:,p0:p1]).max(),
+                  abs(vk - lib.pack_tril(vk0)[:,p0:p1]).max())
+
+        # K of non-hermitian dm is left in the layout of rows
+        dm = dm[0] + numpy.arange(nao*nao).reshape(nao,nao) * 1e-2
+        vj0, vk0 = scf.hf.get_jk(mol, dm, hermi=0)
+        vj, vk = mpi_scf.hf.get_jk_distributed(mol, dm, hermi=0)
+        r0, r1 = mpi.row_blocks(nao)[mpi.rank]
+        err = max(err, abs(vj - lib.pack_tril(vj0)[p0:p1]).max(),
+                  abs(vk - vk0[r0:r1]).max())
+        nrows = mpi.comm.allreduce(r1 - r0)
+        return mpi.comm.allreduce(err, op=mpi.MPI.MAX), nrows
+
+    mol = get_mol
+    nao = mol.nao
+    numpy.random.seed(7)
+    dm = numpy.random.random((2,nao,nao))
+    dm = dm + dm.transpose(0,2,1)
+    err, nrows = mpi.pool.apply(jk_blocks, (mol, dm), (mol, dm))
+    assert err < 1e-9
+    # The row blocks of all processes cover the matrix
+    assert nrows == nao
+
+    if mpi.pool.size > 1:
+        # Only the block of root would be returned on master
+        with pytest.raises(RuntimeError):
+            mpi_scf.hf.get_jk_distributed(mol, dm)
+
+def test_submit_with_same_mol():
+    from mpi4pyscf.tools import mpi
+    # A Mole which is not in the cache of workers yet
+    mol = gto.M(atom='H 0 0 0; H 0 0 .75; H 0 1 0; H 0 1 .75', basis='cc-pvdz')
+    nao = mol.nao
+    numpy.random.seed(6)
+    dm = numpy.random.random((nao,nao))
+    dm = dm + dm.T
+    vj0, vk0 = scf.hf.get_jk(mol, dm)
+    future = mpi.submit(mpi_scf.hf.get_jk, mol, dm)
+    vj, vk = mpi_scf.hf.get_jk(mol, dm)
+    assert abs(vj0-vj).max() < 1e-9
+    assert abs(vk0-vk).max() < 1e-9
+    vj, vk = future.result()
+    assert abs(vj0-vj).max() < 1e-9
+    assert abs(vk0-vk).max() < 1e-9
+
+def test_sync_copied_object(get_mol):
+    import copy
+    from mpi4pyscf.tools import mpi
+    def get_tol(obj):
+        from mpi4pyscf.tools import mpi
+        if mpi.rank != 0:
+            obj = mpi._registry[obj[mpi.rank]]
+        mpi.sync(obj)
+        return mpi.comm.gather(obj.direct_scf_tol)
+
+    mf = mpi_scf.RHF(get_mol)
+    mpi.pool.apply(get_tol, (mf,), (mf._reg_procs,))
+    # mf2 shares the object on workers with mf
+    mf2 = copy.copy(mf)
+    mf2.direct_scf_tol = 1e-8
+    assert mpi.pool.apply(get_tol, (mf2,), (mf2._reg_procs,)) == [1e-8] * mpi.pool.size
+    tols = mpi.pool.apply(get_tol, (mf,), (mf._reg_procs,))
+    assert tols == [mf.direct_scf_tol] * mpi.pool.size
+
+def test_jk_screened_jobs():
+    mol = gto.M(atom='H 0 0 0; H 0 0 .74; H 0 0 30; H 0 0 30.74',
+                basis='cc-pvdz')
+    nao = mol.nao
+    numpy.random.seed(3)
+    # Jobs of the far-apart blocks are dropped by the screening
+    dm = numpy.zeros((nao,nao))
+    dm[:nao//2,:nao//2] = numpy.random.random((nao//2,nao//2))
+    dm = dm + dm.T
+    mf = mpi_scf.RHF(mol)
+    vj0, vk0 = scf.hf.get_jk(mol, dm)
+    for i in range(2):
+        vj, vk = mf.get_jk(mol, dm)
+        assert abs(vj0-vj).max() < 1e-9
+        assert abs(vk0-vk).max() < 1e-9
+
+def test_jk_semi_direct(get_mol):
+    from mpi4pyscf.tools import mpi
+    def set_max_memory(max_memory):
+        from mpi4pyscf.scf import hf
+        hf.SEMI_DIRECT_MAX_MEMORY = max_memory
+
+    mol = get_mol
+    nao = mol.nao
+    numpy.random.seed(4)
+    dm = numpy.random.random((nao,nao))
+    dm = dm + dm.T
+    vj0, vk0 = scf.hf.get_jk(mol, dm)
+    mpi.pool.apply(set_max_memory, (100,), (100,))
+    try:
+        mf = mpi_scf.RHF(mol)
+        # The integrals are computed in the first call and read from the
+        # cache in the second call
+        for i in range(2):
+            vj, vk = mf.get_jk(mol, dm)
+            assert abs(vj0-vj).max() < 1e-9
+            assert abs(vk0-vk).max() < 1e-9
+    finally:
+        mpi.pool.apply(set_max_memory, (0,), (0,))
+
 def test_mpi_uhf(get_mol):
     mol = get_mol
     mf = mpi_scf.UHF(mol)
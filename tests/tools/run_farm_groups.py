@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+'''
+farm with process groups.  It has to be executed on all processes
+
+    MPI4PYSCF_GROUP_SIZE=2 mpiexec -np 4 python tests/tools/run_farm_groups.py
+'''
+
+import numpy
+from mpi4pyscf.tools import mpi
+
+def f(i):
+    import numpy
+    from mpi4pyscf.tools import mpi
+    return mpi.comm.gather((mpi.world.Get_rank(), mpi.allreduce(numpy.ones(3) * i).sum()))
+
+def job(i):
+    return lambda: mpi.pool.apply(f, (i,), (i,))
+
+assert mpi.ngroups == mpi.world.Get_size() // mpi.GROUP_SIZE > 1
+res = mpi.farm([job(i) for i in range(6)], group_size=mpi.GROUP_SIZE)
+
+# Only the master of group 0 returns from farm
+size = mpi.GROUP_SIZE
+for i, x in enumerate(res):
+    ranks = [r for r, v in x]
+    assert len(ranks) == size
+    assert ranks == list(range(ranks[0], ranks[0]+size))
+    assert all(int(v) == 3*i*size for r, v in x)
+print('farm on %d groups passed' % mpi.ngroups)
@@ -0,0 +1,524 @@
+#!/usr/bin/env python
+
+import numpy
+from mpi4pyscf.tools import mpi
+
+
+def test_nonblocking_collectives():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        a = numpy.arange(12.).reshape(3,4) + mpi.rank
+        req_reduce = mpi.ireduce(a)
+        req_allreduce = mpi.iallreduce(a)
+        req_bcast = mpi.ibcast(a)
+        arrs = [numpy.ones((i+1, 2)) * mpi.rank for i in range(mpi.pool.size)]
+        req_alltoall = mpi.ialltoall(arrs, split_recvbuf=True)
+        b = req_allreduce.wait()
+        c = req_bcast.wait()
+        d = req_alltoall.wait()
+        assert abs(b - req_reduce.wait()).max() < 1e-12 or mpi.rank != 0
+        assert abs(c - numpy.arange(12.).reshape(3,4)).max() < 1e-12
+        assert all(x.shape == (mpi.rank+1, 2) for x in d)
+        assert all(abs(x - i).max() < 1e-12 for i, x in enumerate(d))
+        return b
+
+    size = mpi.pool.size
+    b = mpi.pool.apply(f, (), ())
+    ref = numpy.arange(12.).reshape(3,4) * size + size * (size - 1) / 2
+    assert abs(b - ref).max() < 1e-12
+
+def test_inplace_reduce():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        a = numpy.arange(12.).reshape(3,4) + mpi.rank
+        b = a.copy()
+        out = numpy.empty_like(a)
+        c = mpi.allreduce(a, out=out)
+        assert c is out
+        d = mpi.allreduce(b, inplace=True)
+        assert d is b
+        assert abs(c - d).max() < 1e-12
+        e = mpi.reduce(a, inplace=True)
+        assert e is a
+        return e
+
+    size = mpi.pool.size
+    e = mpi.pool.apply(f, (), ())
+    ref = numpy.arange(12.).reshape(3,4) * size + size * (size - 1) / 2
+    assert abs(e - ref).max() < 1e-12
+
+def test_channel():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        chan = mpi.channel(('test_channel', 3, 4))
+        for i in range(3):
+            a = numpy.arange(12.).reshape(3,4) + mpi.rank + i
+            b = chan.bcast(a)
+            assert abs(b - numpy.arange(12.).reshape(3,4) - i).max() < 1e-12
+            c = chan.allreduce(a)
+            d = chan.allreduce(a[0])
+            assert abs(c[0] - d).max() < 1e-12
+            e = chan.allgather(a[:mpi.rank+1], split_recvbuf=True)
+            assert len(e) == mpi.pool.size
+            assert all(x.shape == (k+1, 4) for k, x in enumerate(e))
+        # One cached shape for the reductions of different shapes
+        assert sum(k[0] == 'allreduce' for k in chan._plans) == 1
+        return chan.reduce(a)
+
+    size = mpi.pool.size
+    c = mpi.pool.apply(f, (), ())
+    ref = numpy.arange(12.).reshape(3,4) * size + size * (size - 1) / 2 + 2 * size
+    assert abs(c - ref).max() < 1e-12
+
+def test_hierarchical_collectives():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        a = numpy.arange(12.).reshape(3,4) + mpi.rank
+        b = mpi.allreduce(a, hierarchical=True)
+        c = mpi.iallreduce(a, hierarchical=True).wait()
+        assert abs(b - c).max() < 1e-12
+        d = mpi.bcast(a, hierarchical=True)
+        assert abs(d - numpy.arange(12.).reshape(3,4)).max() < 1e-12
+        e = mpi.reduce(a, hierarchical=True)
+        f = mpi.ireduce(a, hierarchical=True).wait()
+        assert mpi.rank != 0 or abs(e - b).max() < 1e-12
+        assert mpi.rank != 0 or abs(f - b).max() < 1e-12
+        return e
+
+    size = mpi.pool.size
+    e = mpi.pool.apply(f, (), ())
+    ref = numpy.arange(12.).reshape(3,4) * size + size * (size - 1) / 2
+    assert abs(e - ref).max() < 1e-12
+
+def test_bcast_shared():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        a = mpi.bcast_shared(numpy.arange(12.).reshape(3,4) + mpi.rank)
+        assert a.shape == (3,4)
+        b = a.sum()
+        mpi.free_shared(a)
+        return mpi.comm.allreduce(b)
+
+    size = mpi.pool.size
+    b = mpi.pool.apply(f, (), ())
+    assert abs(b - 66 * size) < 1e-12
+
+def test_shared_array():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        node_comm = mpi._get_node_comms()[0]
+        a = mpi.shared_array((node_comm.size, 4))
+        # Each process writes its row, then reads the rows of the others
+        a[node_comm.rank] = mpi.rank
+        mpi.sync_shared(a)
+        ranks = node_comm.allgather(mpi.rank)
+        assert all((a[i] == r).all() for i, r in enumerate(ranks))
+        mpi.sync_shared(a)
+        mpi.free_shared(a)
+        return mpi.comm.allreduce(node_comm.rank == 0)
+
+    # One leader on each node
+    assert mpi.pool.apply(f, (), ()) >= 1
+
+def test_dynamic_partition():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        counts = numpy.zeros(100, dtype=int)
+        for task in mpi.dynamic_partition(range(100)):
+            counts[task] += 1
+        for task in mpi.dynamic_partition(range(100), guided=True):
+            counts[task] += 1
+        for task in mpi.dynamic_partition(range(100), chunksize=3):
+            counts[task] += 1
+        # No residual tasks.  The shared counter is skipped.
+        for task in mpi.cost_balanced_partition(range(100), numpy.arange(100.),
+                                                residual=0):
+            counts[task] += 1
+        return mpi.reduce(counts)
+
+    counts = mpi.pool.apply(f, (), ())
+    assert all(counts == 4)
+
+def test_strided_views():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        size = mpi.pool.size
+        a = numpy.arange(size*6*5.).reshape(size*6,5) + mpi.rank * 1000
+        views = [a[i*6:i*6+6:2,1:4] for i in range(size)]
+        res = mpi.alltoall(views, split_recvbuf=True)
+        for i, x in enumerate(res):
+            b = numpy.arange(size*6*5.).reshape(size*6,5) + i * 1000
+            assert abs(x - b[mpi.rank*6:mpi.rank*6+6:2,1:4]).max() < 1e-12
+
+        c = mpi.scatter(views)
+        assert abs(c - numpy.arange(size*6*5.).reshape(size*6,5)
+                   [mpi.rank*6:mpi.rank*6+6:2,1:4]).max() < 1e-12
+
+        d = mpi.gather(a[:,::2].T)
+        return d
+
+    size = mpi.pool.size
+    d = mpi.pool.apply(f, (), ())
+    ref = [(numpy.arange(size*6*5.).reshape(size*6,5) + i*1000)[:,::2].T
+           for i in range(size)]
+    assert abs(d - numpy.vstack(ref)).max() < 1e-12
+
+def test_pipelined_collectives():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        a = numpy.arange(40.).reshape(10,4) + mpi.rank
+        segs = [(p0, p1) for p0, p1, seg in mpi.bcast_iter(a, blksize=12)]
+        assert segs == [(0,12), (12,24), (24,36), (36,40)]
+
+        b = numpy.empty(40)
+        for p0, p1, seg in mpi.allreduce_iter(a, blksize=7, depth=3):
+            b[p0:p1] = seg
+
+        red = mpi.PipelinedReduce((10,4), root=None)
+        for p0, p1 in [(0,3), (3,8), (8,10)]:
+            red.push(a[p0:p1])
+        c = red.wait()
+        assert abs(b - c.ravel()).max() < 1e-12
+        return c
+
+    size = mpi.pool.size
+    c = mpi.pool.apply(f, (), ())
+    ref = numpy.arange(40.).reshape(10,4) * size + size * (size - 1) / 2
+    assert abs(c - ref).max() < 1e-12
+
+def test_compressed_alltoall():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        size = mpi.pool.size
+        a = numpy.arange(size*3*4.).reshape(size*3,4) + mpi.rank
+        b = mpi.alltoall(a, compress=True)
+        c = mpi.alltoall(a)
+        assert abs(b - c).max() == 0
+        n = mpi.COMPRESSION_MIN_BYTES // 16
+        arrs = [numpy.ones((i+1, n)) * mpi.rank / 3 for i in range(size)]
+        d = mpi.alltoall(arrs, split_recvbuf=True, compress='float32')
+        assert all(abs(x - i / 3.).max() < 1e-6 for i, x in enumerate(d))
+        # The small blocks are sent raw
+        arrs = [numpy.ones((i+1, 2)) * mpi.rank / 3 for i in range(size)]
+        d = mpi.alltoall(arrs, split_recvbuf=True, compress='float32')
+        assert all(abs(x - i / 3.).max() == 0 for i, x in enumerate(d))
+        e = mpi.rotate(a, compress=True)
+        return mpi.gather(e)
+
+    size = mpi.pool.size
+    e = mpi.pool.apply(f, (), ())
+    ref = numpy.arange(size*3*4.).reshape(size*3,4)
+    ref = numpy.vstack([ref + (i+1) % size for i in range(size)])
+    assert abs(e - ref).max() == 0
+
+def test_comm_profiler():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi, profiler
+        prof = profiler.CommProfiler()
+        allreduce = prof.instrument('allreduce', mpi._wait_for_peers)(mpi.allreduce)
+        comm = profiler.ProfiledComm(mpi.comm, prof)
+        a = numpy.ones(10)
+        for i in range(3):
+            allreduce(a)
+        comm.allgather(mpi.rank)
+        assert sorted(x[0] for x in prof.records) == ['allreduce', 'comm.allgather']
+        rec = [v for k, v in prof.records.items() if k[0] == 'allreduce'][0]
+        assert rec[:3] == [3, 240, 240]
+        import io
+        stream = io.StringIO()
+        prof.report(mpi.comm, stream, per_rank=True)
+        if mpi.rank == 0:
+            lines = stream.getvalue().splitlines()
+            # A line of each process below each call site
+            assert sum(x.lstrip().startswith('rank ') for x in lines) == 2 * mpi.pool.size
+        return rec[0]
+
+    assert mpi.pool.apply(f, (), ()) == 3
+
+def test_reduce_scatter():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        a = numpy.arange(2*7*7.).reshape(2,7,7) + mpi.rank
+        ref = mpi.allreduce(a)
+        r0, r1 = mpi.row_blocks(7)[mpi.rank]
+        b = mpi.reduce_scatter(a)
+        assert abs(b - ref[:,r0:r1]).max() < 1e-12
+        r0, r1 = mpi.row_blocks(7, 'packed')[mpi.rank]
+        c = mpi.reduce_scatter(a, layout='packed')
+        tril = ref[:,numpy.tril_indices(7)[0],numpy.tril_indices(7)[1]]
+        assert abs(c - tril[:,r0*(r0+1)//2:r1*(r1+1)//2]).max() < 1e-12
+        return mpi.comm.allreduce(c.size)
+
+    assert mpi.pool.apply(f, (), ()) == 2 * 28
+
+def test_ring_shift_profiler():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi, profiler
+        ring = mpi.RingShift()
+        ring._profiler = prof = profiler.CommProfiler()
+        a = numpy.zeros((mpi.rank+1, 3))
+        for task_id, blk in ring.iterate(a):
+            pass
+        ring.close()
+        if mpi.pool.size == 1:
+            return [None]
+        assert sorted(x[0] for x in prof.records) == ['ring_shift', 'ring_shift.wait']
+        assert all(k[1].startswith('test_mpi.py') for k in prof.records)
+        sent = [v for k, v in prof.records.items() if k[0] == 'ring_shift'][0]
+        recv = [v for k, v in prof.records.items() if k[0] == 'ring_shift.wait'][0]
+        return mpi.comm.gather((sent[:3], recv[:3]))
+
+    nproc = mpi.pool.size
+    recs = mpi.pool.apply(f, (), ())
+    if nproc > 1:
+        # Each process sends all blocks except the one of its previous process
+        nbytes = sum(range(1, nproc+1)) * 3 * 8
+        for rank, (sent, recv) in enumerate(recs):
+            prev_size = (rank - 1) % nproc + 1
+            assert sent == [nproc-1, nbytes - prev_size*24, 0]
+            assert recv == [nproc-1, 0, nbytes - (rank+1)*24]
+
+def test_ring_shift():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        ring = mpi.RingShift()
+        for n in (3, 2, 3):
+            a = numpy.zeros((mpi.rank+1, n)) + mpi.rank
+            seen = []
+            for task_id, blk in ring.iterate(a):
+                assert blk.shape == (task_id+1, n)
+                assert abs(blk - task_id).max() == 0
+                seen.append(task_id)
+            assert sorted(seen) == list(range(mpi.pool.size))
+            if n == 2:
+                nrequests = len(ring._requests)
+        # The persistent requests are reused for the same shapes
+        assert len(ring._requests) == nrequests
+        ring.close()
+
+        ring = mpi.RingShift(debug=True)
+        blocks = [blk for task_id, blk in ring.iterate(a)]
+        assert all(abs(blk - (mpi.rank+k) % mpi.pool.size).max() == 0
+                   for k, blk in enumerate(blocks))
+        ring.close()
+        return len(seen)
+
+    assert mpi.pool.apply(f, (), ()) == mpi.pool.size
+
+def test_farm():
+    def f(i):
+        import numpy
+        from mpi4pyscf.tools import mpi
+        return mpi.allreduce(numpy.ones(3) * i).sum()
+
+    def job(i):
+        return lambda: mpi.pool.apply(f, (i,), (i,))
+
+    res = mpi.farm([job(i) for i in range(4)])
+    size = mpi.pool.size
+    assert [int(x) for x in res] == [0, 3*size, 6*size, 9*size]
+
+def test_dispatch_table():
+    def f(i):
+        return i
+    nfuncs = len(mpi.pool._function_ids)
+    ncalls = mpi.pool.dispatch_count
+    for i in range(3):
+        assert mpi.pool.apply(f, (i,), (i,)) == i
+    assert len(mpi.pool._function_ids) == nfuncs + 1
+    assert mpi.pool.dispatch_count == ncalls + 3
+
+def test_out_of_band_arguments():
+    def f(a, b):
+        from mpi4pyscf.tools import mpi
+        return mpi.comm.allreduce(float(a.sum() + a.vj.sum() + b[1].sum()))
+
+    from pyscf import lib
+    a = lib.tag_array(numpy.ones((100,100)), vj=numpy.ones((100,100)))
+    b = (1, numpy.ones(50000))
+    res = mpi.pool.apply(f, (a, b), (a, b))
+    assert res == mpi.pool.size * 70000.
+
+    # In-band arguments, as with pickle protocol < 5.  Workers accept both.
+    from mpi4pyscf.tools import mpi_pool
+    mpi_pool._OOB_SUPPORTED, supported = False, mpi_pool._OOB_SUPPORTED
+    try:
+        res = mpi.pool.apply(f, (a, b), (a, b))
+    finally:
+        mpi_pool._OOB_SUPPORTED = supported
+    assert res == mpi.pool.size * 70000.
+
+def test_sync():
+    def f():
+        import numpy
+        from mpi4pyscf.tools import mpi
+        class Obj(object):
+            def pack(self):
+                return {'a': self.a, 'b': self.b}
+            def unpack_(self, dic):
+                self.updated = sorted(dic.keys())
+                self.__dict__.update(dic)
+                return self
+        obj = Obj()
+        if mpi.rank == 0:
+            obj.a = numpy.arange(20000.)
+            obj.b = 1
+        mpi.sync(obj)
+        assert obj.updated == ['a', 'b'] and obj.a[-1] == 19999
+        if mpi.rank == 0:
+            obj.b = 2
+        mpi.sync(obj)
+        assert obj.updated == ['b'] and obj.b == 2
+        if mpi.rank == 0:
+            # A new array.  The arrays modified in place are not hashed again.
+            obj.a = obj.a.copy()
+            obj.a[0] = 5
+        mpi.sync(obj)
+        assert obj.updated == ['a'] and obj.a[0] == 5
+        return obj.updated
+
+    assert mpi.pool.apply(f, (), ()) == ['a']
+
+def test_bcast_mole():
+    def f():
+        from pyscf import gto
+        from mpi4pyscf.tools import mpi
+        mol = None
+        if mpi.rank == 0:
+            mol = gto.M(atom='H 0 0 0; H 0 0 .74', basis='ccpvdz', verbose=0)
+        mol1 = mpi.bcast_mole(mol)
+        mol2 = mpi.bcast_mole(mol)
+        if mpi.rank != 0:
+            # the second broadcast is resolved from the cache of workers
+            key = list(mpi._mole_cache)[-1]
+            assert mpi._mole_cache[key]._env is not None
+            # but the objects do not share their content
+            assert mol1 is not mol2
+            mol1.set_range_coulomb(.5)
+            assert mol2.omega == 0
+        return mol2.nao_nr()
+
+    assert mpi.pool.apply(f, (), ()) == 10
+
+def test_submit():
+    def f(x):
+        from mpi4pyscf.tools import mpi
+        return mpi.comm.allreduce(x)
+
+    future = mpi.submit(mpi.pool.apply, f, (1,), (1,))
+    # The second call waits until the submitted call is finished
+    assert mpi.pool.apply(f, (2,), (2,)) == mpi.pool.size * 2
+    assert future.done()
+    assert future.result() == mpi.pool.size
+
+def test_service():
+    import os
+    import tempfile
+    from mpi4pyscf.tools import service
+    with tempfile.TemporaryDirectory() as queue_dir:
+        script = os.path.join(queue_dir, 'job.txt')
+        with open(script, 'w') as f:
+            f.write('from mpi4pyscf.tools import mpi\n'
+                    'def f():\n'
+                    '    from mpi4pyscf.tools import mpi\n'
+                    '    return mpi.comm.allreduce(1)\n'
+                    'print("nproc", mpi.pool.apply(f, (), ()))\n'
+                    'from pyscf import gto\n'
+                    'from mpi4pyscf import scf\n'
+                    'mf = scf.RHF(gto.M(atom="H 0 0 0; H 0 0 .74", verbose=0))\n')
+        out1 = service.submit_job(queue_dir, script)
+        out2 = service.submit_job(queue_dir, script)
+        service.stop(queue_dir)
+
+        def registry_size():
+            from mpi4pyscf.tools import mpi
+            return mpi.comm.gather(len(mpi._registry))
+        size0 = mpi.pool.apply(registry_size, (), ())
+        assert service.serve(queue_dir, poll_interval=0.01) == 2
+        # The objects created by the jobs are released
+        assert mpi.pool.apply(registry_size, (), ()) == size0
+        for out in (out1, out2):
+            with open(out, 'r') as f:
+                assert 'nproc %d' % mpi.pool.size in f.read()
+        assert not os.path.exists(os.path.join(queue_dir, service.STOP_FILE))
+
+def test_service_system_cache():
+    import os
+    import tempfile
+    from mpi4pyscf.tools import service
+    with tempfile.TemporaryDirectory() as queue_dir:
+        script = os.path.join(queue_dir, 'job.txt')
+        with open(script, 'w') as f:
+            f.write('from pyscf import gto\n'
+                    'from mpi4pyscf import dft\n'
+                    'from mpi4pyscf.tools import mpi\n'
+                    'mol = gto.M(atom="H 0 0 0; H 0 0 .74", basis="cc-pvdz", verbose=0)\n'
+                    'cache = mpi.system_cache(mol)\n'
+                    'print("cached", sorted(k if isinstance(k, str) else k[0] for k in cache))\n'
+                    'mf = dft.RKS(mol)\n'
+                    'mf.kernel()\n'
+                    'print("reused", mf._jk_jobs_cache is cache["jk_jobs"])\n'
+                    'print("e_tot %.12f" % mf.e_tot)\n')
+        out1 = service.submit_job(queue_dir, script)
+        out2 = service.submit_job(queue_dir, script)
+        service.stop(queue_dir)
+        assert service.serve(queue_dir, poll_interval=0.01) == 2
+
+        with open(out1, 'r') as f:
+            log1 = f.read()
+        with open(out2, 'r') as f:
+            log2 = f.read()
+        assert 'cached []' in log1
+        # The second job on the same system reuses the screening tables, the
+        # J/K jobs and the grids built by the first job
+        assert "cached ['grids', 'jk_job_costs', 'jk_jobs', 'vhfopt']" in log2
+        assert 'reused True' in log2
+        e1 = float(log1.split('e_tot')[1].split()[0])
+        e2 = float(log2.split('e_tot')[1].split()[0])
+        assert abs(e1 - e2) < 1e-9
+
+    # The setting of the caches is restored when the service is stopped
+    assert len(mpi._system_caches) <= mpi.SYSTEM_CACHE_SIZE
+
+def test_active_size():
+    def f():
+        import numpy
+        from mpi4py import MPI
+        from mpi4pyscf.tools import mpi
+        assert mpi.active_size(3, 2) == 1
+        assert mpi.active_size(100, 1) == mpi.pool.size
+        assert mpi.active_comm(mpi.pool.size) is mpi.comm
+        nproc = max(1, mpi.pool.size - 1)
+        group = mpi.active_comm(nproc)
+        # The surplus process does not take part in the operations of group
+        if group == MPI.COMM_NULL:
+            assert mpi.rank >= nproc
+            return mpi.comm.gather((0, None))
+        assert group.Get_size() == nproc and group.Get_rank() == mpi.rank
+        costs = [1.] * 10
+        tasks = list(mpi.cost_balanced_partition(range(10), costs, group=group))
+        a = mpi.reduce(numpy.ones(3), group=group)
+        # The cached communicator is returned in the following calls
+        assert mpi.active_comm(nproc) is group
+        return mpi.comm.gather((len(tasks), a.sum()))
+
+    counts = mpi.pool.apply(f, (), ())
+    assert sum(x[0] for x in counts) == 10
+    nproc = max(1, mpi.pool.size - 1)
+    assert counts[0][1] == 3 * nproc
+    if mpi.pool.size > 1:
+        assert counts[-1] == (0, None)